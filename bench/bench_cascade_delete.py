@@ -0,0 +1,96 @@
+"""
+Times removing a whitelisted user with 100k messages: before, by deleting the user's messages,
+conversations, user entry and whitelist entry by hand, each on its own connection and commit;
+after, with remove_whitelist_user(), where one DELETE cascades inside SQLite.
+
+With foreign keys enforced, SQLite deletes the cascaded rows one at a time, which costs more than the
+bulk DELETEs of the manual chain. Where commits are cheap (e.g. a tmpfs), the cascade can come out
+slower; what it buys is one atomic commit instead of four, which leaves no orphaned rows on failure.
+
+Usage: python bench/bench_cascade_delete.py
+"""
+import sqlite3
+import statistics
+import time
+
+from common import report, temporary_database
+import database.db_connector as db_connector
+import database.models as db
+
+CONVERSATIONS = 100                 # Conversations of the removed user
+MESSAGES_PER_CONVERSATION = 1000    # Messages in each of them
+RUNS = 3
+
+
+def populate(user_id: int) -> None:
+    """
+    Adds a whitelisted user with CONVERSATIONS * MESSAGES_PER_CONVERSATION messages, in one transaction.
+    """
+    with db_connector.transaction() as conn:
+        conn.execute('INSERT INTO Whitelist (user_id) VALUES (?)', (user_id,))
+        conn.execute('INSERT INTO User (user_id, username) VALUES (?, ?)', (user_id, f'user{user_id}'))
+
+        for i in range(CONVERSATIONS):
+            conversation_id = conn.execute('INSERT INTO Conversation (user_id, title) VALUES (?, ?)',
+                                           (user_id, f'Conversation {i}')).lastrowid
+            conn.executemany('INSERT INTO Message (user_id, conversation_id, message_role, message_content) '
+                             'VALUES (?, ?, ?, ?)',
+                             [(user_id, conversation_id, 'user', f'Message {j} ' + 'x' * 100)
+                              for j in range(MESSAGES_PER_CONVERSATION)])
+
+
+def remove_by_hand(db_path: str, user_id: int) -> None:
+    """
+    Replica of remove_whitelist_user() before foreign keys were enforced: the manual cascade
+    runs each DELETE on a new connection, without foreign keys, and commits it.
+    """
+    for query in ('DELETE FROM Message WHERE user_id = ?',
+                  'DELETE FROM Conversation WHERE user_id = ?',
+                  'DELETE FROM User WHERE user_id = ?',
+                  'DELETE FROM Whitelist WHERE user_id = ?'):
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute(query, (user_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def remaining_messages(user_id: int) -> int:
+    conn = db_connector.connect_to_database()
+
+    return conn.execute('SELECT COUNT(*) FROM Message WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+
+def time_removal(remove) -> float:
+    """
+    Returns the median seconds taken by remove(settings, user_id) on a freshly populated database.
+    """
+    durations = []
+
+    for _ in range(RUNS):
+        with temporary_database() as settings:
+            # Another user's data, which the removal must leave alone
+            populate(2)
+            populate(1)
+
+            start = time.perf_counter()
+            remove(settings, 1)
+            durations.append(time.perf_counter() - start)
+
+            assert remaining_messages(1) == 0
+            assert remaining_messages(2) == CONVERSATIONS * MESSAGES_PER_CONVERSATION
+
+    return statistics.median(durations)
+
+
+def main() -> None:
+    before = time_removal(lambda settings, user_id: remove_by_hand(settings.db_path, user_id))
+    after = time_removal(lambda settings, user_id: db.remove_whitelist_user(user_id))
+
+    report(f'Remove a user with {CONVERSATIONS * MESSAGES_PER_CONVERSATION:,} messages', 'ms',
+           before * 1000, after * 1000, higher_is_better=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares ops/sec of add_message and get_past_messages on a connection opened per query (as before
+thread-local connections) and on the pooled, thread-local connections of database.db_connector.
+
+get_past_messages is timed through select_past_messages, the query behind it, so that the history
+buffer does not hide the connection cost.
+
+Usage: python bench/bench_connections.py
+"""
+import sqlite3
+from unittest import mock
+
+from common import ops_per_second, report, temporary_database
+import database.models as db
+
+MESSAGES = 2000      # Messages added per run
+READS = 2000         # History reads per run
+HISTORY = 50         # Messages in the conversation that is read back
+
+
+def connect_per_query(db_path: str):
+    """
+    Builds a replica of execute_query() before connections were reused: every query opens
+    a connection, commits and closes it.
+    """
+    def execute_query(query, params=None, fetch=False, fetch_lastrowid=False):
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        try:
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+
+            conn.commit()
+
+            if fetch:
+                return cursor.fetchall()
+            elif fetch_lastrowid:
+                return cursor.lastrowid
+            else:
+                return None
+
+        except sqlite3.Error:
+            return None
+
+        finally:
+            conn.close()
+
+    return execute_query
+
+
+def measure() -> dict:
+    """
+    Returns the ops/sec of adding and reading messages.
+    """
+    db.add_whitelist_user(1)
+    db.add_user(1, 'bench')
+    write_conversation_id = db.add_conversation(1, 'Writes')
+    read_conversation_id = db.add_conversation(1, 'Reads')
+    db.add_messages(1, read_conversation_id, [('user', f'Message {i}') for i in range(HISTORY)])
+
+    return {
+        "add_message": ops_per_second(
+            lambda i: db.add_message(1, write_conversation_id, 'user', f'Message {i}'), MESSAGES),
+        "get_past_messages": ops_per_second(
+            lambda i: db.select_past_messages(1, read_conversation_id, max_messages=20), READS)
+    }
+
+
+def main() -> None:
+    with temporary_database() as settings:
+        with mock.patch.object(db, 'execute_query', connect_per_query(settings.db_path)):
+            before = measure()
+
+    with temporary_database():
+        after = measure()
+
+    for name in before:
+        report(name, 'ops/s', before[name], after[name])
+
+
+if __name__ == '__main__':
+    main()
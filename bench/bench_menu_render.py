@@ -0,0 +1,101 @@
+"""
+Times a full menu navigation round: main menu, help, back, admin menu, delete conversation (with the
+user's conversation list), confirmation and back to the main menu. Each step produces what the bot
+sends to Telegram: the message text and the keyboard's JSON.
+
+Before, every step rebuilt its keyboard and re-rendered composed messages with markdownify; after,
+static keyboards and their JSON are prebuilt and composed messages are pre-rendered. The conversation
+list is dynamic and built per request in both.
+
+Usage: python bench/bench_menu_render.py
+"""
+import telebot
+from telegramify_markdown import markdownify
+
+from common import ops_per_second, report
+from bot_core.strings import Strings
+import bot_core.utils as utils
+
+ROUNDS = 2000   # Navigation rounds per run
+
+# The conversation list shown by the delete step
+CONVERSATIONS = [(i, f'Conversation {i}') for i in range(10)]
+
+
+def custom_inline_keyboard(buttons: list) -> telebot.types.InlineKeyboardMarkup:
+    """
+    Replica of custom_inline_keyboard() before static keyboards were prebuilt.
+    """
+    keyboard = []
+
+    for row_buttons in buttons:
+        keyboard.append([telebot.types.InlineKeyboardButton(button_text, callback_data=callback_data)
+                         for button_text, callback_data in row_buttons])
+
+    return telebot.types.InlineKeyboardMarkup(keyboard)
+
+
+def main_menu_before() -> telebot.types.InlineKeyboardMarkup:
+    return custom_inline_keyboard([
+        [('🆕 Create New Conversation', 'create')],
+        [('💬 Load Existing Conversation', 'load')],
+        [('✏️ Edit Existing Conversation', 'edit')],
+        [('🗑️ Delete Existing Conversation', 'delete')],
+        [('❓ Help', 'help'), ('🆔 Show User ID', 'id'), ('👋 Quit', 'quit')]
+    ])
+
+
+def admin_menu_before() -> telebot.types.InlineKeyboardMarkup:
+    return custom_inline_keyboard([
+        [('➕ Add Whitelist User', 'add')],
+        [('➖ Remove Whitelist User', 'remove')],
+        [('📜 Show Whitelist Users', 'show')],
+        [('👋 Quit', 'quit')]
+    ])
+
+
+def back_quit_before() -> telebot.types.InlineKeyboardMarkup:
+    return custom_inline_keyboard([[('🔙 Back', 'back'), ('👋 Quit', 'quit')]])
+
+
+def confirmation_before() -> telebot.types.InlineKeyboardMarkup:
+    return custom_inline_keyboard([[('✔️ Yes', 'yes'), ('❌ No', 'no')]])
+
+
+def round_before(i: int) -> list:
+    return [
+        (Strings.MAIN_MENU_MESSAGE, main_menu_before().to_json()),
+        (Strings.HELP_MESSAGE, back_quit_before().to_json()),
+        (Strings.MAIN_MENU_MESSAGE, main_menu_before().to_json()),
+        (Strings.ADMIN_MENU_MESSAGE, admin_menu_before().to_json()),
+        (Strings.DELETE_CONV_MESSAGE, utils.conversations_inline_keyboard(1, CONVERSATIONS).to_json()),
+        (Strings.DELETE_CONV_MESSAGE, confirmation_before().to_json()),
+        (markdownify(Strings.DELETE_CONV_HEADER + 'Conversation has been deleted.' + Strings.NAVIGATION_FOOTER),
+         back_quit_before().to_json()),
+        (Strings.MAIN_MENU_MESSAGE, main_menu_before().to_json())
+    ]
+
+
+def round_after(i: int) -> list:
+    return [
+        (Strings.MAIN_MENU_MESSAGE, utils.main_menu_inline_keyboard().to_json()),
+        (Strings.HELP_MESSAGE, utils.back_quit_inline_keyboard().to_json()),
+        (Strings.MAIN_MENU_MESSAGE, utils.main_menu_inline_keyboard().to_json()),
+        (Strings.ADMIN_MENU_MESSAGE, utils.admin_menu_inline_keyboard().to_json()),
+        (Strings.DELETE_CONV_MESSAGE, utils.conversations_inline_keyboard(1, CONVERSATIONS).to_json()),
+        (Strings.DELETE_CONV_MESSAGE, utils.confirmation_inline_keyboard().to_json()),
+        (utils.RenderedStrings.DELETE_CONV_SUCCESS_MESSAGE, utils.back_quit_inline_keyboard().to_json()),
+        (Strings.MAIN_MENU_MESSAGE, utils.main_menu_inline_keyboard().to_json())
+    ]
+
+
+def main() -> None:
+    assert round_before(0) == round_after(0)
+
+    report('Menu navigation round', 'rounds/s',
+           ops_per_second(round_before, ROUNDS),
+           ops_per_second(round_after, ROUNDS))
+
+
+if __name__ == '__main__':
+    main()
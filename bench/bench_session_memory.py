@@ -0,0 +1,76 @@
+"""
+Measures the memory held by 100k user sessions: before, as the user_data dict of dicts with a list of
+message IDs; after, as UserSession objects with arrays of message IDs and their times. The times are
+new, and counted against UserSession.
+
+Usage: python bench/bench_session_memory.py
+"""
+import time
+import tracemalloc
+
+from common import report
+from bot_core.sessions import UserSession
+from bot_core.states import UserState
+
+SESSIONS = 100000           # Sessions held in memory
+MESSAGES_PER_SESSION = 20   # Message IDs tracked by each session
+
+
+def build_before() -> dict:
+    now = time.time()
+    user_data = {}
+
+    for user_id in range(SESSIONS):
+        user_data[user_id] = {
+            'state': UserState.MAIN_MENU,
+            'conversation_id': user_id,
+            'message_ids': [100000 + user_id * MESSAGES_PER_SESSION + i for i in range(MESSAGES_PER_SESSION)],
+            'last_activity': now,
+            'temp_data': None
+        }
+
+    return user_data
+
+
+def build_after() -> dict:
+    now = time.time()
+    sessions = {}
+
+    for user_id in range(SESSIONS):
+        session = UserSession()
+        session.state = UserState.MAIN_MENU
+        session.conversation_id = user_id
+        for i in range(MESSAGES_PER_SESSION):
+            session.add_message_id(100000 + user_id * MESSAGES_PER_SESSION + i, now)
+        session.last_activity = now
+        sessions[user_id] = session
+
+    return sessions
+
+
+def measure(build) -> int:
+    """
+    Returns the bytes still allocated by build() once it has returned, i.e. those held by its sessions.
+    """
+    tracemalloc.start()
+    try:
+        sessions = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    del sessions
+
+    return size
+
+
+def main() -> None:
+    before = measure(build_before)
+    after = measure(build_after)
+
+    report(f'Memory of {SESSIONS:,} sessions with {MESSAGES_PER_SESSION} message IDs each', 'MiB',
+           before / 1024**2, after / 1024**2, higher_is_better=False)
+
+
+if __name__ == '__main__':
+    main()
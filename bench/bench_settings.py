@@ -0,0 +1,51 @@
+"""
+Measures the per-query configuration overhead removed by loading the settings once: before, every
+query re-read the .env file with load_dotenv() and looked up DB_PATH, and every /admin parsed ADMIN_ID.
+
+The .env file is a copy of .env.example. load_dotenv() is given its path, so the directory search
+it did before is not counted and the 'before' figures are a lower bound.
+
+Usage: python bench/bench_settings.py
+"""
+from os import getenv
+from pathlib import Path
+import tempfile
+
+from dotenv import load_dotenv
+
+from common import ops_per_second, report
+from config.settings import get_settings
+
+DOTENV_LOOKUPS = 500       # Lookups per run that re-read the .env file
+CACHED_LOOKUPS = 100000    # Lookups per run on the loaded settings
+
+ENV_EXAMPLE = Path(__file__).resolve().parent.parent / '.env.example'
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        env_path = Path(directory) / '.env'
+        env_path.write_text(ENV_EXAMPLE.read_text(encoding='utf-8').replace('ADMIN_ID=admin_id', 'ADMIN_ID=1'),
+                            encoding='utf-8')
+
+        def db_path_before(i):
+            load_dotenv(env_path)
+            return getenv('DB_PATH')
+
+        def admin_id_before(i):
+            load_dotenv(env_path)
+            return int(getenv('ADMIN_ID'))
+
+        load_dotenv(env_path)
+        settings = get_settings()
+
+        report('DB_PATH per query', 'ops/s',
+               ops_per_second(db_path_before, DOTENV_LOOKUPS),
+               ops_per_second(lambda i: get_settings().db_path, CACHED_LOOKUPS))
+        report('ADMIN_ID per /admin', 'ops/s',
+               ops_per_second(admin_id_before, DOTENV_LOOKUPS),
+               ops_per_second(lambda i: settings.admin_id, CACHED_LOOKUPS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import contextlib
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterator
+
+# The bot's packages are imported from src/, as when running src/main.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from config.settings import Settings
+import database.db_connector as db_connector
+import database.models as db
+
+
+@contextlib.contextmanager
+def temporary_database() -> Iterator[Settings]:
+    """
+    Points the database connector at a fresh, migrated database in a temporary directory.
+
+    Yields:
+        Settings: The settings used by the connector.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        settings = Settings(admin_id=1,
+                            bot_token='bench-token',
+                            db_path=str(Path(directory) / 'bench.db'),
+                            gpt_token='bench-token',
+                            log_path=str(Path(directory) / 'logs'))
+
+        db_connector.close_all_connections()
+        db_connector.initialize_connector(settings)
+        db.initialize_db()
+
+        try:
+            yield settings
+        finally:
+            db_connector.close_all_connections()
+
+
+def ops_per_second(operation: Callable[[int], object], count: int, repeat: int = 3) -> float:
+    """
+    Runs operation(i) for i in range(count), `repeat` times, and returns the best rate.
+
+    Args:
+        operation (Callable[[int], object]): The operation to time, given the iteration's index.
+        count (int): The number of operations per run.
+        repeat (int, optional): The number of runs. Defaults to 3.
+
+    Returns:
+        float: Operations per second of the fastest run.
+    """
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(count):
+            operation(i)
+        best = min(best, time.perf_counter() - start)
+
+    return count / best
+
+
+def median_seconds(run: Callable[[], object], repeat: int = 3) -> float:
+    """
+    Runs run() `repeat` times and returns the median duration in seconds.
+    """
+    durations = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start)
+
+    return statistics.median(durations)
+
+
+def report(title: str, unit: str, before: float, after: float, higher_is_better: bool = True) -> None:
+    """
+    Prints a before/after comparison.
+    """
+    speedup = after / before if higher_is_better else before / after
+
+    print(title)
+    print(f'  before: {before:>14,.1f} {unit}')
+    print(f'  after:  {after:>14,.1f} {unit}')
+    print(f'  ({speedup:.1f}x {"better" if speedup >= 1 else "worse"})')
@@ -1,48 +1,63 @@
+import asyncio
+from concurrent.futures import Future
+import functools
 import logging
-from os import getenv
 import time
 
-from dotenv import load_dotenv
 import telebot
-from telebot.util import smart_split
+from telebot.util import MAX_MESSAGE_LENGTH, smart_split
 
 import bot_core.gpt_client as gpt
+from bot_core.scheduler import inactivity_scheduler
+from bot_core.sessions import SESSION_CHECKPOINT_INTERVAL
+from bot_core.summarizer import get_history, schedule_summary_refresh
 import bot_core.utils as utils
+import bot_core.workers as workers
 from bot_core.states import UserState
 from bot_core.strings import Strings
+from config.settings import Settings
 import database.models as db
 
+STREAM_EDIT_INTERVAL = 1.5          # Minimum seconds between edits of a streamed reply (Telegram rate-limits edits)
+PROVISIONAL_TITLE_LENGTH = 30       # Length of the prompt excerpt used as title until the generated title arrives
+MESSAGE_DELETION_BATCH_SIZE = 100   # Most messages Telegram deletes in one call
+
 logger = logging.getLogger(__name__)
 
 
-def initialize_bot() -> telebot.TeleBot:
+# Telegram bot. Handlers are registered on it when this module is imported, and its token is set by initialize_bot().
+bot = telebot.TeleBot(None)
+bot_settings = None
+
+
+def initialize_bot(settings: Settings) -> telebot.TeleBot:
     """
-    Initializes the main bot and states for whitelist users.
+    Initializes the main bot with the application settings. Must be called before the bot is run.
+
+    Args:
+        settings (Settings): The application settings.
 
     Returns:
         telebot.TeleBot: The main bot.
     """
     try:
-        # Load environment variables
-        load_dotenv()
-
-        global bot
-        bot = telebot.TeleBot(getenv('BOT_TOKEN'))      # Telegram bot
+        global bot_settings
+        bot_settings = settings
+        bot.token = settings.bot_token
 
         logger.info('Successfully initialized Telegram bot.')
+
+        return bot
     except Exception as e:
         logger.error(f'Error initializing Telegram bot: {str(e)}')
         raise
 
-
-# Initialize the bot globally
-initialize_bot()
-
 ##################################################
 # Functions for interacting with GPT
 def add_conversation_and_generate_title(message: telebot.types.Message) -> int:
     """
-    Creates a new conversation and returns the conversation ID.
+    Creates a new conversation with a provisional title and returns the conversation ID.
+    The title is generated in the background, so that it does not delay the response to the prompt.
 
     Args:
         message (telebot.types.Message): The message sent by the user.
@@ -53,7 +68,7 @@ def add_conversation_and_generate_title(message: telebot.types.Message) -> int:
     user_id = message.from_user.id
     prompt = message.text.strip()
 
-    title = gpt.generate_title(prompt).strip()
+    title = prompt if len(prompt) <= PROVISIONAL_TITLE_LENGTH else prompt[:PROVISIONAL_TITLE_LENGTH].rstrip() + '...'
     conv_id = db.add_conversation(user_id, title)
 
     new_conv_message_text = Strings.NEW_CONV_HEADER + f'Now conversing in _{title}_.'
@@ -61,16 +76,68 @@ def add_conversation_and_generate_title(message: telebot.types.Message) -> int:
     sent_message_id = send_mdv2_message(message.chat.id, new_conv_message_text)
     utils.add_user_message_id(user_id, sent_message_id)
 
+    # The title is generated on the GPT client's event loop, and saved by a worker once it arrives
+    future = gpt.submit(gpt.generate_title_async(prompt, user_id))
+    future.add_done_callback(lambda future: workers.submit(save_conversation_title,
+                                                           user_id,
+                                                           conv_id,
+                                                           title,
+                                                           message.chat.id,
+                                                           sent_message_id,
+                                                           future))
+
     logger.info(f'User {user_id} created new conversation: "{title}", ID: {conv_id}')
 
     return conv_id
 
 
+def save_conversation_title(user_id: int,
+                            conv_id: int,
+                            provisional_title: str,
+                            chat_id: int,
+                            header_message_id: int,
+                            future: Future) -> None:
+    """
+    Saves the generated title of a new conversation and updates the conversation's header message.
+    Does nothing if the user has renamed the conversation before the title arrived.
+
+    Args:
+        user_id (int): The user's ID.
+        conv_id (int): The ID of the conversation.
+        provisional_title (str): The title the conversation was created with.
+        chat_id (int): The ID of the chat the header message is in.
+        header_message_id (int): The ID of the conversation's header message.
+        future (Future): The future of the generated title.
+
+    Returns:
+        None
+    """
+    title = future.result().strip()
+    if not db.replace_provisional_title(user_id, conv_id, provisional_title, title):
+        return
+
+    new_conv_message_text = Strings.NEW_CONV_HEADER + f'Now conversing in _{title}_.'
+    new_conv_message_text = utils.convert_to_mdv2(new_conv_message_text)
+
+    # The header message may have been deleted (e.g. the user quit) before the title arrived
+    try:
+        edit_mdv2_message(new_conv_message_text, chat_id, header_message_id)
+    except telebot.apihelper.ApiTelegramException as e:
+        logger.debug(f'Could not update header message {header_message_id}: {str(e)}')
+
+    logger.info(f'Generated title for conversation {conv_id} of user {user_id}: "{title}"')
+
+
 def process_gpt_interaction(message: telebot.types.Message, conv_id: int) -> None:
     """
     Processes user's interaction with GPT by:
-        1. Sending the user's message to the GPT model, and
-        2. Sending the GPT model's response to the user.
+        1. Sending the user's message to the GPT model,
+        2. Streaming the GPT model's response to the user as it is generated, and
+        3. Formatting the complete response once the stream ends.
+
+    The response is streamed on the GPT client's event loop, so this returns as soon as the request is queued
+    and no handler thread waits on the network. The user's turn, which the caller must have begun,
+    is ended once the response has been formatted.
 
     Args:
         message (telebot.types.Message): The message sent by the user.
@@ -83,28 +150,175 @@ def process_gpt_interaction(message: telebot.types.Message, conv_id: int) -> Non
 
     prompt = message.text.strip()
 
+    # The indicator message becomes the first message of the streamed reply
     indicator_message_id = send_mdv2_message(message.chat.id, 'Thinking...', disable_notification=True)
+    utils.add_user_message_id(user_id, indicator_message_id)
+    reply_message_ids = [indicator_message_id]
 
-    past_messages = db.get_past_messages(user_id, conv_id)
+    # Only fetch the history window that will be sent to GPT, and older messages not yet in the summary
+    past_messages, summary = get_history(user_id,
+                                         conv_id,
+                                         max_messages=bot_settings.history_max_messages,
+                                         max_tokens=bot_settings.history_max_tokens)
 
-    gpt_response = gpt.generate_response(prompt, past_messages)
+    future = gpt.submit(stream_gpt_response(user_id, message.chat.id, reply_message_ids, prompt, past_messages, summary))
+    future.add_done_callback(lambda future: workers.submit(finish_gpt_interaction,
+                                                           message,
+                                                           conv_id,
+                                                           reply_message_ids,
+                                                           future))
 
-    # Add unformatted messages to DB
-    db.add_message(user_id, conv_id, 'user', prompt)
-    db.add_message(user_id, conv_id, 'assistant', gpt_response)
 
-    # Format GPT response
-    gpt_response = utils.convert_to_mdv2(gpt_response)
-    bot_response = Strings.BOT_MESSAGE_HEADER + gpt_response + Strings.BOT_RESPONSE_FOOTER
+def finish_gpt_interaction(message: telebot.types.Message,
+                           conv_id: int,
+                           reply_message_ids: list,
+                           future: Future) -> None:
+    """
+    Saves the streamed GPT response and replaces the streamed plain text with the formatted response.
+    Ends the user's turn.
 
-    markup = utils.back_quit_inline_keyboard()
+    Args:
+        message (telebot.types.Message): The message sent by the user.
+        conv_id (int): The ID of the conversation to which the message belongs.
+        reply_message_ids (list): The IDs of the messages holding the streamed reply.
+        future (Future): The future of the streamed response.
 
-    bot.delete_message(message.chat.id, indicator_message_id)
+    Returns:
+        None
+    """
+    user_id = message.from_user.id
+
+    try:
+        try:
+            gpt_response = future.result().strip()
+        except Exception as e:
+            logger.error(f'Error generating response for user {user_id}: {str(e)}')
+            edit_mdv2_message(Strings.GPT_RESPONSE_ERROR,
+                              message.chat.id,
+                              reply_message_ids[-1],
+                              reply_markup=utils.back_quit_inline_keyboard())
+            return
+
+        prompt = message.text.strip()
+
+        # Add unformatted messages to DB in a single commit
+        db.add_messages(user_id, conv_id, [('user', prompt), ('assistant', gpt_response)])
+
+        # Fold messages that left the history window into the summary. The window is also cut by the token budget,
+        # so it is measured rather than assumed to hold history_max_messages, or trimmed messages would be lost.
+        history_window = db.get_past_messages(user_id,
+                                              conv_id,
+                                              max_messages=bot_settings.history_max_messages,
+                                              max_tokens=bot_settings.history_max_tokens)
+        schedule_summary_refresh(user_id,
+                                 conv_id,
+                                 keep_recent=len(history_window),
+                                 threshold=bot_settings.summary_threshold)
+
+        # Format GPT response
+        gpt_response = utils.convert_to_mdv2(gpt_response)
+        bot_response = Strings.BOT_MESSAGE_HEADER + gpt_response + Strings.BOT_RESPONSE_FOOTER
+
+        markup = utils.back_quit_inline_keyboard()
+
+        # Entire bot response may be too long to send in one message.
+        # Replace the streamed plain text with the formatted chunks, reusing the streamed messages.
+        chunks = smart_split(bot_response)
+        for i, chunk in enumerate(chunks):
+            if i < len(reply_message_ids):
+                edit_mdv2_message(chunk, message.chat.id, reply_message_ids[i], reply_markup=markup)
+            else:
+                sent_message_id = send_mdv2_message(message.chat.id, chunk, reply_markup=markup)
+                utils.add_user_message_id(user_id, sent_message_id)
+
+        # Formatting may have shortened the response
+        if len(reply_message_ids) > len(chunks):
+            bot.delete_messages(message.chat.id, reply_message_ids[len(chunks):])
+    finally:
+        utils.end_user_turn(user_id)
+
+
+async def stream_gpt_response(user_id: int,
+                              chat_id: int,
+                              reply_message_ids: list,
+                              prompt: str,
+                              past_messages: list,
+                              summary: str | None) -> str:
+    """
+    Streams the GPT model's response into the reply messages as plain text, editing them at most
+    once every STREAM_EDIT_INTERVAL seconds. When the current message is full, the reply rolls over
+    into a new message, which is appended to reply_message_ids.
+
+    Runs on the GPT client's event loop. Telegram calls block, so they are made in the loop's default executor.
+
+    Args:
+        user_id (int): The user's ID.
+        chat_id (int): The ID of the chat to reply in.
+        reply_message_ids (list): The IDs of the messages holding the reply, starting with the indicator message.
+        prompt (str): The user's input prompt.
+        past_messages (list): A list of past messages in the conversation.
+        summary (str or None): A summary of the conversation's older messages.
+
+    Returns:
+        str: The complete response.
+    """
+    loop = asyncio.get_running_loop()
+
+    response = ''
+    filled_length = 0       # Length of the response held by messages that are already full
+    displayed_text = ''     # Text currently displayed in the last reply message
+    last_edit_time = 0.0
+
+    async for delta in gpt.stream_response(prompt, past_messages, summary, user_id):
+        response += delta
 
-    # Entire bot response may be too long to send in one message
-    for chunk in smart_split(bot_response):
-        sent_message = bot.reply_to(message, chunk, reply_markup=markup, parse_mode='MarkdownV2')
-        utils.add_user_message_id(user_id, sent_message.id)
+        if time.monotonic() - last_edit_time < STREAM_EDIT_INTERVAL:
+            continue
+
+        text = response[filled_length:]
+
+        # Roll over into a new message once the current one is full
+        while len(text) > MAX_MESSAGE_LENGTH:
+            part = smart_split(text)[0]
+            await loop.run_in_executor(None, edit_streamed_message, chat_id, reply_message_ids[-1], part)
+            filled_length += len(part)
+            text = response[filled_length:]
+
+            sent_message_id = await loop.run_in_executor(None, functools.partial(send_mdv2_message,
+                                                                                 chat_id,
+                                                                                 '...',
+                                                                                 parse_mode=None,
+                                                                                 disable_notification=True))
+            utils.add_user_message_id(user_id, sent_message_id)
+            reply_message_ids.append(sent_message_id)
+            displayed_text = ''
+
+        if text.strip() and text != displayed_text:
+            await loop.run_in_executor(None, edit_streamed_message, chat_id, reply_message_ids[-1], text)
+            displayed_text = text
+
+        last_edit_time = time.monotonic()
+
+    return response
+
+
+def edit_streamed_message(chat_id: int, message_id: int, text: str) -> None:
+    """
+    Edits a message of a streamed reply as plain text. Failed edits (e.g. rate limited) are skipped,
+    as the next edit or the final formatted response replaces the text anyway.
+
+    Args:
+        chat_id (int): The ID of the chat the message is in.
+        message_id (int): The ID of the message to edit.
+        text (str): The new text of the message.
+
+    Returns:
+        None
+    """
+    try:
+        bot.edit_message_text(text, chat_id, message_id)
+    except telebot.apihelper.ApiTelegramException as e:
+        logger.debug(f'Skipped edit of streamed message {message_id}: {str(e)}')
 ##################################################
 
 ##################################################
@@ -179,7 +393,7 @@ def load_existing_conversation(call: telebot.types.CallbackQuery, conversation_i
     user_id = call.from_user.id
     chat_id = call.message.chat.id
 
-    title = db.get_conversation_title(conversation_id)
+    title = db.get_conversation_title(conversation_id, user_id)
     title_message_text = Strings.EXTG_CONV_HEADER + f'_{title}_'
     title_message_text = utils.convert_to_mdv2(title_message_text)
     title_message_id = send_mdv2_message(call.message.chat.id,
@@ -199,57 +413,124 @@ def load_existing_conversation(call: telebot.types.CallbackQuery, conversation_i
             utils.add_user_message_id(user_id, sent_message_id)
 
 
+def begin_prompt_turn(message: telebot.types.Message) -> bool:
+    """
+    Starts answering the user's prompt, or tells the user to wait if their previous prompt is still being answered.
+    The turn is ended once the prompt has been answered (see process_gpt_interaction()).
+
+    Args:
+        message (telebot.types.Message): The message sent by the user.
+
+    Returns:
+        bool: True if the prompt may be answered, False otherwise.
+    """
+    user_id = message.from_user.id
+
+    if utils.try_begin_user_turn(user_id):
+        return True
+
+    utils.add_user_message_id(user_id, message.id)
+    error_message_id = send_mdv2_message(message.chat.id, Strings.PROMPT_IN_PROGRESS_ERROR, disable_notification=True)
+    utils.add_user_message_id(user_id, error_message_id)
+
+    return False
+
+
+def leave_conversation(user_id: int) -> None:
+    """
+    Releases the in-memory history of the conversation the user is in, if any. Called before the user's
+    conversation ID is reset.
+
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        None
+    """
+    if utils.get_user_state(user_id) != UserState.EXTG_CONV:
+        return
+
+    conversation_id = utils.get_user_conversation_id(user_id)
+    if conversation_id is not None:
+        db.evict_conversation_history(conversation_id)
+
+
 # Delete past messages
 def delete_past_messages(user_id: int, message_ids: list) -> None:
     """
-    Deletes past messages sent by the user.
+    Deletes past messages sent by the user in the background, so that the caller returns immediately.
 
     Args:
         user_id (int): The ID of the user.
+        message_ids (list): The list of message IDs to delete, as taken by utils.pop_user_message_ids().
+
+    Returns:
+        None
+    """
+    if message_ids:
+        workers.submit(delete_messages_in_batches, user_id, message_ids)
+
+
+def delete_messages_in_batches(chat_id: int, message_ids: list) -> None:
+    """
+    Deletes messages in batches of at most 100 (Telegram limit). A failed batch does not stop the others.
+
+    Args:
+        chat_id (int): The ID of the chat the messages are in.
         message_ids (list): The list of message IDs to delete.
 
     Returns:
         None
     """
-    try:
-        bot.delete_messages(user_id, message_ids)
-    except:
-        pass
+    for i in range(0, len(message_ids), MESSAGE_DELETION_BATCH_SIZE):
+        batch = message_ids[i:i + MESSAGE_DELETION_BATCH_SIZE]
 
-    utils.set_user_message_ids(user_id, [])
+        try:
+            bot.delete_messages(chat_id, batch)
+        except telebot.apihelper.ApiTelegramException as e:
+            logger.warning(f'Could not delete {len(batch)} messages in chat {chat_id}: {str(e)}')
 
 
 def check_inactivity() -> None:
     """
-    Checks if users have been inactive for more than 30 minutes and resets their state to idle.
+    Resets users' state to idle once they have been inactive for 30 minutes, and evicts sessions that have
+    stayed idle from memory. Sleeps until the next session is due, instead of polling.
     """
-    TIMEOUT_SECONDS = 1800
-    user_ids = db.get_whitelisted_user_ids()
-    
     while True:
-        current_time = time.time()
-        
-        for user_id in user_ids:
-            user_id = user_id[0]
-            last_activity = utils.get_user_last_activity(user_id)
-            user_state = utils.get_user_state(user_id)
-            
-            if (last_activity is not None and
-                user_state != UserState.IDLE and
-                current_time - last_activity > TIMEOUT_SECONDS):
-                timeout_message = send_mdv2_message(user_id, Strings.TIMEOUT_MESSAGE, disable_notification=True)
+        user_id = inactivity_scheduler.wait_next()
+
+        # This thread is the only one that expires sessions, so one failed user (e.g. who blocked the bot)
+        # must not stop it
+        try:
+            expired = utils.expire_user_session(user_id, time.time())
+            if expired is None:
+                continue
+
+            conversation_id, past_message_ids = expired
+
+            timeout_message = send_mdv2_message(user_id, Strings.TIMEOUT_MESSAGE, disable_notification=True)
+            delete_past_messages(user_id, past_message_ids)
 
-                past_message_ids = utils.get_user_message_ids(user_id)
-                delete_past_messages(user_id, past_message_ids)
+            if conversation_id is not None:
+                db.evict_conversation_history(conversation_id)
+            utils.add_user_message_id(user_id, timeout_message)
 
-                utils.set_user_state(user_id, UserState.IDLE)
-                utils.set_user_conversation_id(user_id, None)
-                utils.set_user_last_activity(user_id, None)
-                utils.add_user_message_id(user_id, timeout_message)
+            logger.info(f'User {user_id} has been reset to idle state due to inactivity.')
+        except Exception as e:
+            logger.error(f'Error expiring session of user {user_id}: {str(e)}')
 
-                logger.info(f'User {user_id} has been reset to idle state due to inactivity.')
 
-        time.sleep(60)
+def checkpoint_sessions() -> None:
+    """
+    Saves modified sessions to the database every few seconds, so that they survive restarts.
+    """
+    while True:
+        time.sleep(SESSION_CHECKPOINT_INTERVAL)
+
+        try:
+            utils.save_sessions()
+        except Exception as e:
+            logger.error(f'Error saving sessions: {str(e)}')
 ##################################################
 
 
@@ -344,7 +625,10 @@ def callback_create_conversation(call: telebot.types.CallbackQuery) -> None:
     bot.answer_callback_query(call.id, 'Creating new conversation...')
     
     user_id = call.from_user.id
-    utils.set_user_state(user_id, UserState.NEW_CONV)    
+
+    # The button may have been pressed twice
+    if not utils.compare_and_set_user_state(user_id, UserState.MAIN_MENU, UserState.NEW_CONV):
+        return
 
     markup = utils.back_quit_inline_keyboard()
     edit_mdv2_message(Strings.NEW_CONV_MESSAGE,
@@ -370,20 +654,38 @@ def new_conversation_handler(message: telebot.types.Message) -> None:
     utils.set_user_last_activity(message.from_user.id, time.time())
 
     user_id = message.from_user.id
-    utils.add_user_message_id(user_id, message.id)
 
-    # Create new conversation
-    # Add conversation to DB & generate title
-    conv_id = add_conversation_and_generate_title(message)
-
-    # Process the user's prompt
-    process_gpt_interaction(message, conv_id)
+    if not begin_prompt_turn(message):
+        return
 
-    # Update user state and conversation ID
-    utils.set_user_state(user_id, UserState.EXTG_CONV)
-    utils.set_user_conversation_id(user_id, conv_id)
+    # The turn is ended by process_gpt_interaction() once the response is complete
+    try:
+        # A previous prompt may have created the conversation while this one was waiting
+        if utils.get_user_state(user_id) != UserState.NEW_CONV:
+            if utils.get_user_state(user_id) == UserState.EXTG_CONV:
+                utils.add_user_message_id(user_id, message.id)
+                process_gpt_interaction(message, utils.get_user_conversation_id(user_id))
+            else:
+                utils.end_user_turn(user_id)
+            return
+
+        utils.add_user_message_id(user_id, message.id)
+
+        # Create new conversation
+        # Add conversation to DB & generate title
+        conv_id = add_conversation_and_generate_title(message)
+
+        # Update user state and conversation ID
+        utils.set_user_state(user_id, UserState.EXTG_CONV)
+        utils.set_user_conversation_id(user_id, conv_id)
+
+        # Process the user's prompt
+        process_gpt_interaction(message, conv_id)
+    except Exception:
+        utils.end_user_turn(user_id)
+        raise
 
-    logger.info(f'User {user_id} started new conversation: "{db.get_conversation_title(conv_id)}", ID: {conv_id}')
+    logger.info(f'User {user_id} started new conversation: "{db.get_conversation_title(conv_id, user_id)}", ID: {conv_id}')
 
 
 @bot.callback_query_handler(func=lambda call: (
@@ -417,7 +719,7 @@ def callback_load_all_conversations(call: telebot.types.CallbackQuery) -> None:
                           call.message.id,
                           reply_markup=markup)
     else:
-        markup = utils.conversations_inline_keyboard(user_id)
+        markup = utils.conversations_inline_keyboard(user_id, conversations)
         edit_mdv2_message(Strings.LOAD_CONV_MESSAGE,
                         call.message.chat.id,
                         call.message.id,
@@ -441,7 +743,7 @@ def callback_load_existing_conversation(call: telebot.types.CallbackQuery) -> No
     utils.set_user_last_activity(call.from_user.id, time.time())
 
     conv_id = call.data
-    title = db.get_conversation_title(conv_id)
+    title = db.get_conversation_title(conv_id, call.from_user.id)
 
     bot.answer_callback_query(call.id, f'Loading "{title}"...')
 
@@ -477,10 +779,19 @@ def existing_conversation_text_handler(message: telebot.types.Message) -> None:
     utils.set_user_last_activity(message.from_user.id, time.time())
 
     user_id = message.from_user.id
-    conversation_id = utils.get_user_conversation_id(user_id)
 
-    utils.add_user_message_id(user_id, message.id)
-    process_gpt_interaction(message, conversation_id)
+    if not begin_prompt_turn(message):
+        return
+
+    # The turn is ended by process_gpt_interaction() once the response is complete
+    try:
+        conversation_id = utils.get_user_conversation_id(user_id)
+
+        utils.add_user_message_id(user_id, message.id)
+        process_gpt_interaction(message, conversation_id)
+    except Exception:
+        utils.end_user_turn(user_id)
+        raise
 
 
 @bot.callback_query_handler(func=lambda call: (
@@ -514,7 +825,7 @@ def callback_edit_conversations(call: telebot.types.CallbackQuery) -> None:
                           call.message.id,
                           reply_markup=markup)
     else:
-        markup = utils.conversations_inline_keyboard(user_id)
+        markup = utils.conversations_inline_keyboard(user_id, conversations)
         edit_mdv2_message(Strings.EDIT_CONV_MESSAGE,
                           call.message.chat.id,
                           call.message.id,
@@ -538,7 +849,7 @@ def callback_edit_selected_conversation(call: telebot.types.CallbackQuery) -> No
     utils.set_user_last_activity(call.from_user.id, time.time())
 
     conv_id = call.data
-    title = db.get_conversation_title(conv_id)
+    title = db.get_conversation_title(conv_id, call.from_user.id)
 
     bot.answer_callback_query(call.id, f'Editing "{title}"...')
 
@@ -588,7 +899,7 @@ def edit_conversation_handler(message: telebot.types.Message) -> None:
     edit_conv_message_text = utils.convert_to_mdv2(edit_conv_message_text)
     markup = utils.back_quit_inline_keyboard()
 
-    past_message_ids = utils.get_user_message_ids(user_id)
+    past_message_ids = utils.pop_user_message_ids(user_id)
     delete_past_messages(user_id, past_message_ids)
     utils.set_user_conversation_id(user_id, None)
 
@@ -651,7 +962,7 @@ def callback_delete_conversations(call: telebot.types.CallbackQuery) -> None:
                           call.message.id,
                           reply_markup=markup)
     else:
-        markup = utils.conversations_inline_keyboard(user_id)
+        markup = utils.conversations_inline_keyboard(user_id, conversations)
         edit_mdv2_message(Strings.DELETE_CONV_MESSAGE,
                           call.message.chat.id,
                           call.message.id,
@@ -675,7 +986,7 @@ def callback_delete_selected_conversation(call: telebot.types.CallbackQuery) ->
     utils.set_user_last_activity(call.from_user.id, time.time())
 
     conv_id = call.data
-    title = db.get_conversation_title(conv_id)
+    title = db.get_conversation_title(conv_id, call.from_user.id)
 
     bot.answer_callback_query(call.id, f'Deleting "{title}"...')
 
@@ -713,14 +1024,11 @@ def callback_delete_conversation_confirmation(call: telebot.types.CallbackQuery)
 
     if call.data == 'yes':
         db.delete_conversation(user_id, conv_id)
+        utils.set_user_conversation_id(user_id, None)       # Reset conversation ID in memory
         bot.answer_callback_query(call.id, 'Conversation deleted.')
 
-        delete_conv_success_message_text = (Strings.DELETE_CONV_HEADER +
-                                            'Conversation has been deleted.' +
-                                            Strings.NAVIGATION_FOOTER)
-        delete_conv_success_message_text = utils.convert_to_mdv2(delete_conv_success_message_text)
         markup = utils.back_quit_inline_keyboard()
-        edit_mdv2_message(delete_conv_success_message_text,
+        edit_mdv2_message(utils.RenderedStrings.DELETE_CONV_SUCCESS_MESSAGE,
                           call.message.chat.id,
                           call.message.id,
                           reply_markup=markup)
@@ -835,7 +1143,7 @@ def callback_back(call: telebot.types.CallbackQuery) -> None:
                               call.message.id,
                               reply_markup=markup)
         else:
-            markup = utils.conversations_inline_keyboard(user_id)
+            markup = utils.conversations_inline_keyboard(user_id, conversations)
             edit_mdv2_message(Strings.EDIT_CONV_MESSAGE,
                               call.message.chat.id,
                               call.message.id,
@@ -859,7 +1167,7 @@ def callback_back(call: telebot.types.CallbackQuery) -> None:
                             call.message.id,
                             reply_markup=markup)
         else:
-            markup = utils.conversations_inline_keyboard(user_id)
+            markup = utils.conversations_inline_keyboard(user_id, conversations)
             edit_mdv2_message(Strings.DELETE_CONV_MESSAGE,
                             call.message.chat.id,
                             call.message.id,
@@ -869,13 +1177,14 @@ def callback_back(call: telebot.types.CallbackQuery) -> None:
     # User is in all other states, return to main menu
     bot.answer_callback_query(call.id, 'Returning to main menu...')
 
+    leave_conversation(user_id)
     utils.set_user_state(user_id, UserState.MAIN_MENU)
     utils.set_user_conversation_id(user_id, None)
 
     markup = utils.main_menu_inline_keyboard()
     # User is in existing covnersation, delete past messages before returning to main menu
     if user_state == UserState.EXTG_CONV:
-        past_message_ids = utils.get_user_message_ids(user_id)
+        past_message_ids = utils.pop_user_message_ids(user_id)
 
         start_message_id = send_mdv2_message(call.message.chat.id, Strings.MAIN_MENU_MESSAGE, reply_markup=markup)
         delete_past_messages(user_id, past_message_ids)
@@ -905,7 +1214,8 @@ def callback_quit(call: telebot.types.CallbackQuery) -> None:
     bot.answer_callback_query(call.id, 'Quitting...')
 
     user_id = call.from_user.id
-    past_message_ids = utils.get_user_message_ids(user_id)
+    past_message_ids = utils.pop_user_message_ids(user_id)
+    leave_conversation(user_id)
     utils.set_user_state(user_id, UserState.IDLE)
     utils.set_user_conversation_id(user_id, None)
 
@@ -949,13 +1259,10 @@ def callback_admin_operations(call: telebot.types.CallbackQuery) -> None:
         bot.answer_callback_query(call.id, 'Removing user from whitelist...')
         utils.set_user_state(user_id, UserState.REMOVE_WHITELIST_USER)
 
-        remove_user_message_text = Strings.REMOVE_WHITELIST_USER_HEADER
         if is_user_ids_empty:
-            remove_user_message_text += 'No whitelisted users at the moment.'
+            remove_user_message_text = utils.RenderedStrings.REMOVE_WHITELIST_USER_EMPTY_MESSAGE
         else:
-            remove_user_message_text += 'Select a user to remove from the whitelist.'
-        remove_user_message_text += Strings.NAVIGATION_FOOTER
-        remove_user_message_text = utils.convert_to_mdv2(remove_user_message_text)
+            remove_user_message_text = utils.RenderedStrings.REMOVE_WHITELIST_USER_SELECT_MESSAGE
 
         markup = utils.admin_remove_whitelist_user_inline_keyboard()
         edit_mdv2_message(remove_user_message_text,
@@ -975,7 +1282,6 @@ def callback_admin_operations(call: telebot.types.CallbackQuery) -> None:
         else:
             show_whitelist_message_text = Strings.SHOW_WHITELIST_USERS_HEADER
             for user_id in user_ids:
-                user_id = user_id[0]        # DB results are returned as tuples
                 show_whitelist_message_text += f'{user_id}\n'
             show_whitelist_message_text += ('\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-\-' +
                                             Strings.NAVIGATION_FOOTER)
@@ -1038,14 +1344,13 @@ def callback_remove_whitelist_user_confirmation(call: telebot.types.CallbackQuer
     # Error checking
     if user_id_to_remove is None:
         bot.answer_callback_query(call.id, 'Error removing user from whitelist.')
-        error_message_text = Strings.ERROR_HEADER + 'Error removing user from whitelist. Please try again.'
-        error_message_text = utils.convert_to_mdv2(error_message_text)
-        error_message_id = send_mdv2_message(call.message.chat.id, error_message_text)
+        error_message_id = send_mdv2_message(call.message.chat.id, utils.RenderedStrings.REMOVE_WHITELIST_USER_ERROR)
         utils.add_user_message_id(call.from_user.id, error_message_id)
         return
 
     if call.data == 'yes':
         db.remove_whitelist_user(user_id_to_remove)
+        utils.remove_user_session(int(user_id_to_remove))
         bot.answer_callback_query(call.id, f'Removed user {user_id_to_remove} from whitelist.')
     elif call.data == 'no':
         bot.answer_callback_query(call.id, 'Removal canceled.')
@@ -1102,7 +1407,7 @@ def add_whitelist_user_handler(message: telebot.types.Message) -> None:
     add_user_success_text = utils.convert_to_mdv2(add_user_success_text)
     markup = utils.back_quit_inline_keyboard()
 
-    past_message_ids = utils.get_user_message_ids(user_id)
+    past_message_ids = utils.pop_user_message_ids(user_id)
     delete_past_messages(user_id, past_message_ids)
     utils.set_user_conversation_id(user_id, None)
 
@@ -1162,7 +1467,7 @@ def start_command_handler(message: telebot.types.Message) -> None:
     logger.info(f'Received /start command from user {user_id}.')
 
     # Delete past messages
-    past_message_ids = utils.get_user_message_ids(user_id)
+    past_message_ids = utils.pop_user_message_ids(user_id)
     delete_past_messages(user_id, past_message_ids)
 
     utils.add_user_message_id(user_id, message.id)
@@ -1196,10 +1501,11 @@ def quit_command_handler(message: telebot.types.Message) -> None:
 
     logger.info(f'Received /quit command from user {user_id}.')
 
+    leave_conversation(user_id)
     utils.set_user_state(user_id, UserState.IDLE)
     utils.set_user_conversation_id(user_id, None)
 
-    past_messages_id = utils.get_user_message_ids(user_id)
+    past_messages_id = utils.pop_user_message_ids(user_id)
     delete_past_messages(user_id, past_messages_id)
 
     utils.add_user_message_id(user_id, message.id)
@@ -1226,21 +1532,18 @@ def admin_command_handler(message: telebot.types.Message) -> None:
     utils.add_user_message_id(user_id, message.id)
 
     # Check if the user is the admin
-    ADMIN_ID = int(getenv('ADMIN_ID'))
-    if message.from_user.id != ADMIN_ID:
+    if message.from_user.id != bot_settings.admin_id:
         logger.info(f'User {user_id} attempted to use admin commands without permission.')
         error_message_id = send_mdv2_message(chat_id, Strings.NOT_ADMIN_ERROR)
         utils.add_user_message_id(user_id, error_message_id)
         return
 
     # Check if the user is in the idle state
-    if utils.get_user_state(user_id) != UserState.IDLE:
+    if not utils.compare_and_set_user_state(user_id, UserState.IDLE, UserState.ADMIN_MENU):
         error_message_id = send_mdv2_message(chat_id, Strings.ADMIN_NOT_IDLE_ERROR)
         utils.add_user_message_id(user_id, error_message_id)
         return
 
-    utils.set_user_state(user_id, UserState.ADMIN_MENU)
-
     markup = utils.admin_menu_inline_keyboard()
     admin_message_id = send_mdv2_message(chat_id, Strings.ADMIN_MENU_MESSAGE, reply_markup=markup)
     utils.add_user_message_id(user_id, admin_message_id)
@@ -1,29 +1,52 @@
+import asyncio
+from collections.abc import AsyncIterator, Coroutine
+from concurrent.futures import Future
+from contextlib import AbstractAsyncContextManager
 import logging
-from os import getenv
+from threading import Thread
+import time
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+from bot_core.request_scheduler import RequestScheduler
+from bot_core.response_cache import ResponseCache, first_turn_key
+from bot_core.single_flight import SingleFlight
+from config.settings import Settings
+import database.models as db
 
 CONV_MODEL = 'gpt-4-turbo'      # GPT model for generating responses
 # CONV_MODEL = 'gpt-3.5-turbo'
 TITLE_MODEL = 'gpt-4o-mini'     # GPT model for generating titles
+SUMMARY_MODEL = 'gpt-4o-mini'   # GPT model for summarizing older messages
 
 logger = logging.getLogger(__name__)
 
 
-def initialize_gpt_client() -> OpenAI:
+def initialize_gpt_client(settings: Settings) -> AsyncOpenAI:
     """
-    Initializes the OpenAI client with the API key stored in the environment variables.
+    Initializes the asynchronous OpenAI client with the API key from the application settings, and starts
+    the event loop thread on which all GPT requests run.
+
+    Args:
+        settings (Settings): The application settings.
 
     Returns:
-        OpenAI: The OpenAI client.
+        AsyncOpenAI: The OpenAI client.
     """
     try:
-        # Load environment variables
-        load_dotenv()
+        global client, loop, loop_thread, closing, request_scheduler, response_cache, in_flight
+        loop = asyncio.new_event_loop()
+        loop_thread = Thread(target=loop.run_forever, name='gpt-loop', daemon=True)
+        loop_thread.start()
+        closing = False     # Set once shutdown begins, after which no more requests are accepted
 
-        global client
-        client = OpenAI(api_key=getenv('GPT_TOKEN'))        # GPT client
+        # Retries are made by the request scheduler, which also queues and rate-limits requests
+        client = AsyncOpenAI(api_key=settings.gpt_token, max_retries=0)        # GPT client
+        request_scheduler = RequestScheduler(settings.gpt_max_concurrency)
+        response_cache = ResponseCache(settings.response_cache_enabled,
+                                       settings.response_cache_ttl,
+                                       settings.response_cache_max_entries)
+        in_flight = SingleFlight()      # Coalesces identical concurrent requests
 
         logger.info('Successfully initialized GPT client.')
     except Exception as e:
@@ -31,104 +54,398 @@ def initialize_gpt_client() -> OpenAI:
         raise
 
 
-def generate_response(prompt: str, past_messages: list) -> str:
+def submit(coroutine: Coroutine) -> Future:
     """
-    Generates a text response from a given prompt using the GPT-4 model.
+    Runs a coroutine on the GPT client's event loop without waiting for it.
+
+    Args:
+        coroutine (Coroutine): The coroutine to run.
+
+    Returns:
+        Future: The future of the coroutine's result.
+
+    Raises:
+        RuntimeError: If the GPT client is shutting down, since the coroutine would never run.
+    """
+    if closing:
+        coroutine.close()
+        raise RuntimeError('GPT client is shut down.')
+
+    return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+
+def run(coroutine: Coroutine):
+    """
+    Runs a coroutine on the GPT client's event loop and waits for its result.
+    Must not be called from the event loop itself.
+
+    Args:
+        coroutine (Coroutine): The coroutine to run.
 
-    This function constructs a list of messages starting with a system message
-    that defines the assistant's behavior and standards. It then appends past
-    responses and the user's prompt to this list. The function calls the OpenAI
-    API with this message list to generate a response.
+    Returns:
+        The result of the coroutine.
+    """
+    return submit(coroutine).result()
+
+
+def shutdown_gpt_client() -> None:
+    """
+    Waits for in-flight GPT requests to finish, closes the client and stops the event loop.
+    Requests submitted from then on fail immediately instead of waiting for the stopped loop.
+
+    Returns:
+        None
+    """
+    global closing
+
+    async def drain() -> None:
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await client.close()
+
+    drained = submit(drain())
+    closing = True
+
+    drained.result()
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join()
+    loop.close()
+
+    logger.info(f'GPT request stats: {request_scheduler.get_stats()}')
+    logger.info(f'GPT response cache stats: {response_cache.get_stats()}')
+    logger.info(f'GPT request coalescing stats: {in_flight.get_stats()}')
+
+
+def create_completion(user_id: int | None, **kwargs) -> AbstractAsyncContextManager:
+    """
+    Sends a chat completion request through the request scheduler. Use as `async with ... as completion`.
+
+    Args:
+        user_id (int or None): The ID of the user the request is for, used to queue requests fairly.
+        **kwargs: Arguments for `client.chat.completions.create`.
+
+    Returns:
+        AbstractAsyncContextManager: Context yielding the completion (or stream) and holding the request's
+                                     slot until it exits.
+    """
+    return request_scheduler.request(user_id, lambda: client.chat.completions.with_raw_response.create(**kwargs))
+
+
+def build_message_list(prompt: str, past_messages: list, summary: str | None = None) -> list[dict[str, str]]:
+    """
+    Builds the list of messages sent to the GPT model for a conversation turn.
+
+    The list starts with a system message that defines the assistant's behavior
+    and standards, followed by the summary of older messages (if any), the past
+    messages, and finally the user's prompt.
 
     Args:
         prompt (str): The user's input prompt.
         past_messages (list): A list of past messages in the conversation,
                               each represented as a dictionary with "role"
                               and "content" keys.
+        summary (str or None, optional): A summary of the conversation's older
+                                         messages, which are not in past_messages.
+                                         Defaults to None.
 
     Returns:
-        str: The response generated by the GPT-4 model.
+        list: The messages to send to the GPT model.
     """
-    try:
-        # Initialize message list with system message
-        message_list = [
-            {
-                "role": "system",
-                "content": """
-                    You are a helpful academic study assistant that can provide accurate information and sound guidance.
-                    Always seek to clarify any of the user's questions so that they are better able to understand the topic.
-                    Do not give speculative or opinionated responses.
-                    Use clear and straightforward language as much as possible.
-                    Provide examples and additional resources wherever necessary to aid the user's understanding of the topic.
-                """
-            }]
-
-        # Add past responses to message list
-        for message in past_messages:
-            message_list.append({
-                "role": message["role"],
-                "content": message["content"]
-            })
-
-        # Add user prompt to message list
+    # Initialize message list with system message
+    message_list = [
+        {
+            "role": "system",
+            "content": """
+                You are a helpful academic study assistant that can provide accurate information and sound guidance.
+                Always seek to clarify any of the user's questions so that they are better able to understand the topic.
+                Do not give speculative or opinionated responses.
+                Use clear and straightforward language as much as possible.
+                Provide examples and additional resources wherever necessary to aid the user's understanding of the topic.
+            """
+        }]
+
+    # Add summary of older messages to message list
+    if summary:
+        message_list.append({
+            "role": "system",
+            "content": f'Summary of the earlier part of this conversation:\n{summary}'
+        })
+
+    # Add past responses to message list
+    for message in past_messages:
         message_list.append({
-            "role": "user",
-            "content": prompt
+            "role": message["role"],
+            "content": message["content"]
         })
 
+    # Add user prompt to message list
+    message_list.append({
+        "role": "user",
+        "content": prompt
+    })
+
+    return message_list
+
+
+def generate_response(prompt: str,
+                      past_messages: list,
+                      summary: str | None = None,
+                      user_id: int | None = None) -> str:
+    """
+    Generates a text response from a given prompt using the GPT-4 model. Blocks the calling thread.
+
+    Args:
+        prompt (str): The user's input prompt.
+        past_messages (list): A list of past messages in the conversation,
+                              each represented as a dictionary with "role"
+                              and "content" keys.
+        summary (str or None, optional): A summary of the conversation's older
+                                         messages, which are not in past_messages.
+                                         Defaults to None.
+        user_id (int or None, optional): The ID of the user the request is for, used to queue
+                                         requests fairly. Defaults to None.
+
+    Returns:
+        str: The response generated by the GPT-4 model.
+    """
+    return run(generate_response_async(prompt, past_messages, summary, user_id))
+
+
+async def generate_response_async(prompt: str,
+                                  past_messages: list,
+                                  summary: str | None = None,
+                                  user_id: int | None = None) -> str:
+    """
+    Generates a text response from a given prompt using the GPT-4 model.
+    Responses to first-turn prompts are reused from the response cache, if it is enabled,
+    and identical first-turn prompts in flight at the same time share one request.
+
+    Args:
+        prompt (str): The user's input prompt.
+        past_messages (list): A list of past messages in the conversation,
+                              each represented as a dictionary with "role"
+                              and "content" keys.
+        summary (str or None, optional): A summary of the conversation's older
+                                         messages, which are not in past_messages.
+                                         Defaults to None.
+        user_id (int or None, optional): The ID of the user the request is for, used to queue
+                                         requests fairly. Defaults to None.
+
+    Returns:
+        str: The response generated by the GPT-4 model.
+    """
+    async def request() -> str:
+        message_list = build_message_list(prompt, past_messages, summary)
+        started_at = time.monotonic()
+
         # Call the OpenAI API
-        completion = client.chat.completions.create(
-            model=CONV_MODEL,
-            messages=message_list,
-            max_tokens=2048
-        )
+        async with create_completion(user_id,
+                                     model=CONV_MODEL,
+                                     messages=message_list,
+                                     max_tokens=2048) as completion:
+            # Get the response from the completion
+            response = completion.choices[0].message.content.strip()
+            completion_tokens = completion.usage.completion_tokens if completion.usage else 0
 
-        # Get the response from the completion
-        response = completion.choices[0].message.content
+        await response_cache.put(request_key, CONV_MODEL, response, completion_tokens, time.monotonic() - started_at)
 
         # Return the response
-        return response.strip()
+        return response
+
+    try:
+        request_key = first_turn_key(CONV_MODEL, prompt, past_messages, summary)
+        cached_response = await response_cache.get(request_key)
+        if cached_response is not None:
+            return cached_response
+
+        # Identical first-turn prompts in flight at the same time share one request
+        return await in_flight.run(request_key, request)
     except Exception as e:
         logger.error(f'Error generating response: {str(e)}')
         raise
 
 
-def generate_title(prompt: str) -> str:
+async def stream_response(prompt: str,
+                          past_messages: list,
+                          summary: str | None = None,
+                          user_id: int | None = None) -> AsyncIterator[str]:
+    """
+    Generates a text response like generate_response(), but yields it in pieces as the GPT-4 model produces them.
+    Must be consumed on the GPT client's event loop (see submit()).
+    A cached response to a first-turn prompt, or the response to an identical first-turn prompt already
+    in flight, is yielded in one piece.
+
+    Args:
+        prompt (str): The user's input prompt.
+        past_messages (list): A list of past messages in the conversation,
+                              each represented as a dictionary with "role"
+                              and "content" keys.
+        summary (str or None, optional): A summary of the conversation's older
+                                         messages, which are not in past_messages.
+                                         Defaults to None.
+        user_id (int or None, optional): The ID of the user the request is for, used to queue
+                                         requests fairly. Defaults to None.
+
+    Yields:
+        str: The next piece (delta) of the response.
+    """
+    try:
+        request_key = first_turn_key(CONV_MODEL, prompt, past_messages, summary)
+        cached_response = await response_cache.get(request_key)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        # Identical first-turn prompts in flight at the same time share one request
+        shared_response, leader = in_flight.claim(request_key) if request_key is not None else (None, True)
+        if not leader:
+            # Shielded, so that closing this stream does not cancel the response for everyone else
+            yield await asyncio.shield(shared_response)
+            return
+
+        try:
+            message_list = build_message_list(prompt, past_messages, summary)
+            started_at = time.monotonic()
+            deltas = []
+
+            # Call the OpenAI API. The request holds its slot until the stream ends.
+            async with create_completion(user_id,
+                                         model=CONV_MODEL,
+                                         messages=message_list,
+                                         max_tokens=2048,
+                                         stream=True) as stream:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        deltas.append(delta)
+                        yield delta
+
+            response = ''.join(deltas).strip()
+        except BaseException as e:
+            if shared_response is not None:
+                in_flight.resolve(request_key, shared_response, error=e)
+            raise
+
+        if shared_response is not None:
+            in_flight.resolve(request_key, shared_response, response)
+
+        # Streamed chunks carry no token usage, so it is estimated
+        await response_cache.put(request_key,
+                                 CONV_MODEL,
+                                 response,
+                                 len(response) // db.CHARS_PER_TOKEN,
+                                 time.monotonic() - started_at)
+    except Exception as e:
+        logger.error(f'Error streaming response: {str(e)}')
+        raise
+
+
+def generate_title(prompt: str, user_id: int | None = None) -> str:
+    """
+    Generates a concise title for a given prompt using the GPT-3.5 model. Blocks the calling thread.
+
+    Args:
+        prompt (str): The user's input prompt.
+        user_id (int or None, optional): The ID of the user the request is for, used to queue
+                                         requests fairly. Defaults to None.
+
+    Returns:
+        str: The title generated by the GPT-3.5 model.
+    """
+    return run(generate_title_async(prompt, user_id))
+
+
+async def generate_title_async(prompt: str, user_id: int | None = None) -> str:
     """
     Generates a concise title for a given prompt using the GPT-3.5 model.
+    Identical prompts in flight at the same time share one request.
 
     Args:
         prompt (str): The user's input prompt.
+        user_id (int or None, optional): The ID of the user the request is for, used to queue
+                                         requests fairly. Defaults to None.
 
     Returns:
         str: The title generated by the GPT-3.5 model.
     """
-    try:
-        completion = client.chat.completions.create(
-            model=TITLE_MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": """
-                        You are a helpful assistant which can identify the main idea of a given prompt.
-                        Generate a concise title that captures the main idea of the prompt.
-                        The generated title should adhere to the following guidelines:
-                        1. The title MUST be less than 5 words long.
-                        2. Do not include unnecessary punctuation within the title.
-                        3. Emojis may be used to enhance the title, wherever suitable. Emojis must be added to the end of the title.
-                        """
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            max_tokens=10
-        )
-
-        title = completion.choices[0].message.content
+    async def request() -> str:
+        async with create_completion(
+                user_id,
+                model=TITLE_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": """
+                            You are a helpful assistant which can identify the main idea of a given prompt.
+                            Generate a concise title that captures the main idea of the prompt.
+                            The generated title should adhere to the following guidelines:
+                            1. The title MUST be less than 5 words long.
+                            2. Do not include unnecessary punctuation within the title.
+                            3. Emojis may be used to enhance the title, wherever suitable. Emojis must be added to the end of the title.
+                            """
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                max_tokens=10
+            ) as completion:
+            title = completion.choices[0].message.content
 
         return title.strip()
+
+    try:
+        # Identical prompts in flight at the same time share one request
+        return await in_flight.run(first_turn_key(TITLE_MODEL, prompt, []), request)
     except Exception as e:
         logger.error(f'Error generating title: {str(e)}')
         raise
+
+
+async def generate_summary_async(summary: str | None, messages: list, user_id: int | None = None) -> str:
+    """
+    Updates a conversation's running summary with newer messages using the summary model.
+
+    Args:
+        summary (str or None): The current summary of the conversation. None if there is no summary yet.
+        messages (list): A list of messages to fold into the summary, each represented
+                         as a dictionary with "role" and "content" keys.
+        user_id (int or None, optional): The ID of the user the request is for, used to queue
+                                         requests fairly. Defaults to None.
+
+    Returns:
+        str: The updated summary.
+    """
+    try:
+        transcript = '\n\n'.join(f'{message["role"].capitalize()}: {message["content"]}' for message in messages)
+
+        async with create_completion(
+                user_id,
+                model=SUMMARY_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": """
+                            You maintain a running summary of a study conversation between a user and an academic assistant.
+                            Update the existing summary with the new messages.
+                            Keep the topics covered, the user's questions, key definitions, and conclusions reached.
+                            The summary MUST be under 300 words.
+                            """
+                    },
+                    {
+                        "role": "user",
+                        "content": f'Existing summary:\n{summary or "None"}\n\nNew messages:\n{transcript}'
+                    }
+                ],
+                max_tokens=512
+            ) as completion:
+            new_summary = completion.choices[0].message.content
+
+        return new_summary.strip()
+    except Exception as e:
+        logger.error(f'Error generating summary: {str(e)}')
+        raise
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import hashlib
+import sys
+import threading
+
+from telegramify_markdown import markdownify
+
+RENDER_CACHE_SIZE = 4096                # Most rendered texts kept in memory
+RENDER_CACHE_MAX_BYTES = 32 * 1024**2   # Most memory used by rendered texts
+
+
+class RenderCache:
+    """
+    Bounded LRU cache of MarkdownV2 renderings, keyed by a hash of the source text.
+    Keying by digest keeps long source texts (e.g. replayed GPT responses) out of memory.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._rendered = OrderedDict()      # digest -> rendered text
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text: str) -> str:
+        """
+        Renders text as MarkdownV2, reusing the cached rendering of identical text.
+
+        Args:
+            text (str): The text to render.
+
+        Returns:
+            str: The text in MarkdownV2 format.
+        """
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+        with self._lock:
+            rendered = self._rendered.get(digest)
+            if rendered is not None:
+                self.hits += 1
+                self._rendered.move_to_end(digest)
+                return rendered
+            self.misses += 1
+
+        # Render outside the lock. Concurrent misses on the same text render it twice, which is harmless.
+        rendered = markdownify(text)
+
+        with self._lock:
+            if digest not in self._rendered:
+                self._rendered[digest] = rendered
+                self._bytes += sys.getsizeof(digest) + sys.getsizeof(rendered)
+
+                while self._rendered and (len(self._rendered) > self._max_entries or self._bytes > self._max_bytes):
+                    old_digest, old_rendered = self._rendered.popitem(last=False)
+                    self._bytes -= sys.getsizeof(old_digest) + sys.getsizeof(old_rendered)
+
+        return rendered
+
+    def get_stats(self) -> dict:
+        """
+        Gets the cache's counters and gauges.
+
+        Returns:
+            dict: The number of entries, approximate memory used in bytes, hits, misses and hit ratio
+                  ("entries", "bytes", "hits", "misses" and "hit_ratio" keys).
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "entries": len(self._rendered),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
+
+
+render_cache = RenderCache(RENDER_CACHE_SIZE, RENDER_CACHE_MAX_BYTES)
@@ -0,0 +1,299 @@
+import asyncio
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
+from contextlib import asynccontextmanager
+import logging
+import random
+import re
+import time
+
+import openai
+
+MAX_ATTEMPTS = 4                # Attempts per request, including the first
+BACKOFF_BASE = 1.0              # Seconds before the first retry, doubled on each further retry (before jitter)
+BACKOFF_MAX = 30.0              # Most seconds between two attempts
+CIRCUIT_FAILURE_THRESHOLD = 5   # Consecutive upstream failures that open the circuit
+CIRCUIT_COOLDOWN = 30.0         # Seconds the circuit stays open before a trial request is let through
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while the upstream is considered unhealthy.
+    """
+
+
+def parse_duration(value: str | None) -> float | None:
+    """
+    Parses a rate-limit reset duration as sent by the OpenAI API (e.g. "20ms", "1s", "6m0s").
+
+    Args:
+        value (str or None): The header value.
+
+    Returns:
+        float or None: The duration in seconds. None if the value is missing or malformed.
+    """
+    if not value:
+        return None
+
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class RequestScheduler:
+    """
+    Gate in front of the OpenAI API, used from the GPT client's event loop only.
+
+    - At most `max_concurrency` requests are in flight. Waiting requests are served round-robin by key
+      (e.g. user ID), so that one user's burst does not delay everyone else.
+    - Dispatching pauses when the rate-limit headers report an exhausted quota, until the quota resets.
+    - Rate-limited, transient server and connection errors are retried with jittered exponential backoff,
+      honouring the Retry-After header.
+    - After repeated server or connection errors the circuit opens, and requests fail fast with
+      CircuitOpenError until a trial request succeeds.
+    """
+
+    def __init__(self, max_concurrency: int) -> None:
+        self._max_concurrency = max_concurrency
+        self._in_flight = 0
+        self._queues = OrderedDict()    # key -> deque of waiting futures, in round-robin order
+        self._paused_until = 0.0        # time.monotonic() until which the rate limit is exhausted
+
+        self._consecutive_failures = 0
+        self._opened_at = None          # time.monotonic() at which the circuit opened. None if closed.
+        self._trial_in_flight = False
+
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self._waits = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @asynccontextmanager
+    async def request(self, key: Hashable, create: Callable[[], Awaitable]) -> AsyncIterator:
+        """
+        Sends a request through the scheduler, retrying it if it fails transiently.
+        The request keeps its slot until the context exits, so that streamed responses count as in flight.
+
+        Args:
+            key (Hashable): The key requests are queued fairly by (e.g. the user's ID).
+            create (Callable): Function starting the request. It must return a raw response
+                               (from `client.with_raw_response`), so that the rate-limit headers can be read.
+
+        Yields:
+            The parsed response.
+
+        Raises:
+            CircuitOpenError: If the circuit is open.
+            openai.APIError: If the request failed and cannot be retried, or ran out of attempts.
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            trial = self._check_circuit()
+
+            try:
+                await self._acquire(key)
+            except BaseException:
+                self._abandon_trial(trial)
+                raise
+
+            try:
+                self.requests += 1
+                raw_response = await create()
+            except Exception as e:
+                self._release()
+
+                retry_delay = self._handle_error(e, attempt)
+                if retry_delay is None:
+                    raise
+
+                self.retries += 1
+                logger.warning(f'GPT request failed ({type(e).__name__}), retrying in {retry_delay:.1f}s.')
+                await asyncio.sleep(retry_delay)
+                continue
+            except BaseException:
+                # Cancelled. A slot that is never released would eventually leave every request waiting.
+                self._release()
+                self._abandon_trial(trial)
+                raise
+
+            try:
+                self._record_success(raw_response.headers)
+                yield raw_response.parse()
+            finally:
+                self._release()
+            return
+
+    def get_stats(self) -> dict:
+        """
+        Gets the scheduler's counters and gauges.
+
+        Returns:
+            dict: The queue depth, requests in flight, request/retry/failure/rejection counts,
+                  average and maximum queue wait in seconds, and circuit state.
+        """
+        return {
+            "queue_depth": sum(len(waiters) for waiters in self._queues.values()),
+            "in_flight": self._in_flight,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "average_wait": self._total_wait / self._waits if self._waits else 0.0,
+            "max_wait": self._max_wait,
+            "circuit": self._circuit_state()
+        }
+
+    async def _acquire(self, key: Hashable) -> None:
+        started_at = time.monotonic()
+
+        if self._in_flight < self._max_concurrency and not self._queues:
+            self._in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(key, deque()).append(waiter)
+
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just before the cancellation
+                    self._release()
+                else:
+                    self._remove_waiter(key, waiter)
+                raise
+
+        # Hold the slot until the rate limit resets
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            try:
+                await asyncio.sleep(pause)
+            except BaseException:
+                self._release()
+                raise
+
+        wait = time.monotonic() - started_at
+        self._waits += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+    def _release(self) -> None:
+        # Hand the slot to the first waiter of the next key in turn
+        while self._queues:
+            key, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+
+            if waiters:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self._in_flight -= 1
+
+    def _remove_waiter(self, key: Hashable, waiter: asyncio.Future) -> None:
+        waiters = self._queues.get(key)
+        if waiters is None:
+            return
+
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+
+        if not waiters:
+            del self._queues[key]
+
+    def _handle_error(self, error: Exception, attempt: int) -> float | None:
+        # Returns the delay before retrying, or None if the error must be raised
+        if self._trial_in_flight:
+            self._trial_in_flight = False
+
+        retry_after = None
+
+        if isinstance(error, openai.RateLimitError):
+            retry_after = self._get_retry_after(error.response.headers)
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        elif isinstance(error, (openai.InternalServerError, openai.APIConnectionError)):
+            self._record_failure()
+        else:
+            return None
+
+        if attempt + 1 >= MAX_ATTEMPTS:
+            return None
+
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+        return max(delay, retry_after or 0.0)
+
+    def _get_retry_after(self, headers) -> float | None:
+        retry_after_ms = headers.get('retry-after-ms')
+        retry_after = headers.get('retry-after')
+
+        try:
+            if retry_after_ms is not None:
+                return float(retry_after_ms) / 1000
+            if retry_after is not None:
+                return float(retry_after)
+        except ValueError:
+            pass
+
+        return None
+
+    def _record_success(self, headers) -> None:
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+        # Stop dispatching until an exhausted quota resets
+        for limit in ('requests', 'tokens'):
+            remaining = headers.get(f'x-ratelimit-remaining-{limit}')
+            reset = parse_duration(headers.get(f'x-ratelimit-reset-{limit}'))
+
+            if remaining is not None and remaining.isdigit() and int(remaining) == 0 and reset is not None:
+                self._paused_until = max(self._paused_until, time.monotonic() + reset)
+
+    def _record_failure(self) -> None:
+        self.failures += 1
+        self._consecutive_failures += 1
+
+        if self._opened_at is not None or self._consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            if self._opened_at is None:
+                logger.error(f'Opening GPT circuit after {self._consecutive_failures} consecutive failures.')
+            self._opened_at = time.monotonic()
+
+    def _check_circuit(self) -> bool:
+        # Returns whether the request is the half-open circuit's trial request
+        if self._opened_at is None:
+            return False
+
+        if time.monotonic() - self._opened_at >= CIRCUIT_COOLDOWN and not self._trial_in_flight:
+            # Half-open: let one trial request through
+            self._trial_in_flight = True
+            return True
+
+        self.rejected += 1
+        raise CircuitOpenError('GPT upstream is unavailable.')
+
+    def _abandon_trial(self, trial: bool) -> None:
+        # A cancelled trial request must let the next request be tried, or the circuit would never close
+        if trial:
+            self._trial_in_flight = False
+
+    def _circuit_state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+
+        return 'half-open' if self._trial_in_flight else 'open'
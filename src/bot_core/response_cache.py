@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+import database.models as db
+
+EVICTION_INTERVAL = 100     # Responses cached between two evictions of expired and excess entries
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normalizes a prompt so that prompts differing only in case and whitespace share a cache entry.
+
+    Args:
+        prompt (str): The user's input prompt.
+
+    Returns:
+        str: The normalized prompt.
+    """
+    return ' '.join(prompt.casefold().split())
+
+
+def first_turn_key(model: str, prompt: str, past_messages: list, summary: str | None = None) -> str | None:
+    """
+    Gets the key identifying a first-turn request, under which its response is cached and concurrent
+    identical requests are coalesced.
+
+    Args:
+        model (str): The GPT model the response is generated with.
+        prompt (str): The user's input prompt.
+        past_messages (list): A list of past messages in the conversation,
+                              each represented as a dictionary with "role"
+                              and "content" keys.
+        summary (str or None, optional): A summary of the conversation's older
+                                         messages. Defaults to None.
+
+    Returns:
+        str or None: The key. None if the request is not a first turn (it has past messages or a summary).
+    """
+    if past_messages or summary:
+        return None
+
+    history = json.dumps(past_messages, sort_keys=True).encode('utf-8')
+    history_digest = hashlib.sha256(history).hexdigest()
+
+    key = '\0'.join((model, normalize_prompt(prompt), history_digest))
+
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match cache of GPT responses, stored in the 'ResponseCache' table and used from the GPT client's
+    event loop only.
+
+    Only first-turn prompts (no past messages and no summary) are cached, since later turns depend on the
+    conversation and rarely repeat. Entries expire after `ttl` seconds, and the oldest entries are evicted
+    beyond `max_entries`.
+    """
+
+    def __init__(self, enabled: bool, ttl: int, max_entries: int) -> None:
+        self._enabled = enabled
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._puts = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self.tokens_saved = 0
+
+    async def get(self, key: str | None) -> str | None:
+        """
+        Gets the cached response for a key, counting the hit or miss.
+
+        Args:
+            key (str or None): The cache key, as returned by first_turn_key().
+
+        Returns:
+            str or None: The cached response. None if the cache is disabled, the key is None,
+                         or there is no unexpired response.
+        """
+        if not self._enabled or key is None:
+            return None
+
+        started_at = time.monotonic()
+
+        try:
+            entry = await asyncio.to_thread(db.get_cached_response, key, time.time() - self._ttl)
+        except Exception as e:
+            logger.warning(f'Error reading response cache: {str(e)}')
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.latency_saved += max(0.0, entry["latency"] - (time.monotonic() - started_at))
+        self.tokens_saved += entry["completion_tokens"]
+
+        return entry["response"]
+
+    async def put(self, key: str | None, model: str, response: str, completion_tokens: int, latency: float) -> None:
+        """
+        Caches a response, periodically evicting expired and excess entries.
+        Failures are logged and ignored, since the response has already been generated.
+
+        Args:
+            key (str or None): The cache key, as returned by first_turn_key(). Nothing is cached if None.
+            model (str): The GPT model that generated the response.
+            response (str): The response.
+            completion_tokens (int): The number of completion tokens the response took.
+            latency (float): The seconds the response took to generate.
+
+        Returns:
+            None
+        """
+        if not self._enabled or key is None or not response:
+            return
+
+        now = time.time()
+
+        try:
+            await asyncio.to_thread(db.set_cached_response, key, model, response, completion_tokens, latency, now)
+
+            self._puts += 1
+            if self._puts % EVICTION_INTERVAL == 1:
+                await asyncio.to_thread(db.evict_cached_responses, now - self._ttl, self._max_entries)
+        except Exception as e:
+            logger.warning(f'Error writing response cache: {str(e)}')
+
+    def get_stats(self) -> dict:
+        """
+        Gets the cache's counters.
+
+        Returns:
+            dict: The hits, misses, hit ratio, seconds of generation saved and completion tokens saved
+                  ("hits", "misses", "hit_ratio", "latency_saved" and "tokens_saved" keys).
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "latency_saved": self.latency_saved,
+            "tokens_saved": self.tokens_saved
+        }
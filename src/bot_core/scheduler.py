@@ -0,0 +1,96 @@
+import heapq
+import itertools
+import threading
+import time
+from collections.abc import Hashable
+
+HEAP_COMPACTION_SLACK = 1024    # Superseded heap entries tolerated before the heap is rebuilt
+
+
+class DeadlineScheduler:
+    """
+    Min-heap of one deadline per key (e.g. a user's session timeout).
+
+    Rescheduling a key pushes a new entry and leaves the old one in the heap. Superseded entries are skipped
+    when they reach the top, and the heap is rebuilt once they outnumber the live ones.
+    """
+
+    def __init__(self) -> None:
+        self._heap = []             # (deadline, sequence number, key)
+        self._deadlines = {}        # key -> current deadline
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        """
+        Sets the deadline of a key, replacing its previous deadline.
+
+        Args:
+            key (Hashable): The key.
+            deadline (float): The time.time() at which the key is due.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._deadlines[key] = deadline
+            entry = (deadline, next(self._sequence), key)
+            heapq.heappush(self._heap, entry)
+
+            if len(self._heap) > 2 * len(self._deadlines) + HEAP_COMPACTION_SLACK:
+                self._compact()
+
+            # Wake the waiter if this is now the earliest deadline
+            if self._heap[0] is entry:
+                self._condition.notify()
+
+    def cancel(self, key: Hashable) -> None:
+        """
+        Removes the deadline of a key, if it has one.
+
+        Args:
+            key (Hashable): The key.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._deadlines.pop(key, None)
+
+    def wait_next(self) -> Hashable:
+        """
+        Blocks until the earliest deadline is due, then removes it.
+
+        Returns:
+            Hashable: The key whose deadline is due.
+        """
+        with self._condition:
+            while True:
+                while self._heap and self._deadlines.get(self._heap[0][2]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                deadline, _, key = self._heap[0]
+                delay = deadline - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+                del self._deadlines[key]
+
+                return key
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._deadlines)
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[0]]
+        heapq.heapify(self._heap)
+
+
+inactivity_scheduler = DeadlineScheduler()
@@ -0,0 +1,443 @@
+from array import array
+import json
+import threading
+import time
+
+from bot_core.scheduler import inactivity_scheduler
+from bot_core.states import UserState
+import database.models as db
+
+SESSION_LOCK_STRIPES = 64             # Locks shared by the users' sessions, by user ID
+SESSION_TIMEOUT = 1800                # Seconds of inactivity after which a session is reset to idle
+SESSION_IDLE_TTL = 3600               # Seconds after which an unused idle session is evicted from memory
+SESSION_CHECKPOINT_INTERVAL = 5       # Seconds between saves of modified sessions to the database
+MAX_TRACKED_MESSAGES = 1000           # Most message IDs kept per session for later deletion
+MESSAGE_DELETION_WINDOW = 48 * 3600   # Seconds after which Telegram no longer lets the bot delete a message
+
+
+class UserSession:
+    """
+    The in-memory state of a user's interaction with the bot.
+    """
+
+    __slots__ = ('state', 'conversation_id', 'message_ids', 'message_times', 'last_activity', 'temp_data', 'busy')
+
+    def __init__(self) -> None:
+        self.state = UserState.IDLE
+        self.conversation_id = None      # None if the user is not in a conversation
+        self.message_ids = array('q')    # IDs of the bot's and user's messages shown in the chat, oldest first
+        self.message_times = array('d')  # time.time() at which each message ID was added
+        self.last_activity = None        # time.time() of the user's last interaction
+        self.temp_data = None
+        self.busy = False                # True while a prompt of the user is being answered (not saved)
+
+    def add_message_id(self, message_id: int, now: float) -> None:
+        """
+        Adds a message ID, dropping IDs of messages that are too old to be deleted and the oldest IDs beyond the cap.
+
+        Args:
+            message_id (int): The message ID to be added.
+            now (float): The current time.
+
+        Returns:
+            None
+        """
+        self.message_ids.append(message_id)
+        self.message_times.append(now)
+
+        expired = 0
+        while expired < len(self.message_times) and now - self.message_times[expired] > MESSAGE_DELETION_WINDOW:
+            expired += 1
+        expired = max(expired, len(self.message_ids) - MAX_TRACKED_MESSAGES)
+
+        if expired:
+            del self.message_ids[:expired]
+            del self.message_times[:expired]
+
+    def take_message_ids(self, now: float) -> list[int]:
+        """
+        Gets and clears the message IDs. IDs of messages that are too old to be deleted are dropped.
+
+        Args:
+            now (float): The current time.
+
+        Returns:
+            list[int]: The IDs of the messages that can still be deleted, oldest first.
+        """
+        message_ids = [message_id for message_id, added_at in zip(self.message_ids, self.message_times)
+                       if now - added_at <= MESSAGE_DELETION_WINDOW]
+
+        self.message_ids = array('q')
+        self.message_times = array('d')
+
+        return message_ids
+
+    def to_row(self, user_id: int) -> tuple:
+        """
+        Serializes the session for the 'Session' table.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            tuple: The (user_id, state, conversation_id, message_ids, message_times, last_activity, temp_data) row.
+        """
+        temp_data = json.dumps(self.temp_data) if self.temp_data is not None else None
+
+        return (user_id,
+                self.state.value,
+                self.conversation_id,
+                self.message_ids.tobytes(),
+                self.message_times.tobytes(),
+                self.last_activity,
+                temp_data)
+
+    @classmethod
+    def from_row(cls, row: dict) -> 'UserSession':
+        """
+        Deserializes a session saved in the 'Session' table.
+
+        Args:
+            row (dict): The saved session, as returned by db.get_session().
+
+        Returns:
+            UserSession: The session.
+        """
+        session = cls()
+        session.state = UserState(row["state"])
+        session.conversation_id = row["conversation_id"]
+        session.message_ids.frombytes(row["message_ids"])
+        if row["message_times"] is not None:
+            session.message_times.frombytes(row["message_times"])
+        if len(session.message_times) != len(session.message_ids):
+            # Saved before message times were tracked
+            session.message_times = array('d', [time.time()] * len(session.message_ids))
+        session.last_activity = row["last_activity"]
+        session.temp_data = json.loads(row["temp_data"]) if row["temp_data"] is not None else None
+
+        return session
+
+
+class SessionStore:
+    """
+    Process-wide, thread-safe store of the users' sessions, keyed by user ID.
+
+    Compound updates of a session are made under the lock of its stripe, so that handlers of different users
+    rarely contend and handlers of the same user are serialized. Lookups of the session itself take no lock.
+
+    Sessions are created, or restored from the 'Session' table, on first access, and modified sessions are
+    saved back by checkpoint(), so that they survive restarts. Idle sessions are evicted by expire().
+    """
+
+    def __init__(self, stripes: int) -> None:
+        self._sessions = {}
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._dirty = set()                         # IDs of users whose session changed since the last checkpoint
+        self._dirty_lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()    # Keeps an older checkpoint from overwriting a newer one
+
+    def lock(self, user_id: int) -> threading.RLock:
+        """
+        Gets the lock guarding a user's session.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            threading.RLock: The lock of the user's stripe.
+        """
+        return self._locks[hash(user_id) % len(self._locks)]
+
+    def get(self, user_id: int) -> UserSession:
+        """
+        Gets a user's session, restoring it from the database or creating an idle one if it is not in memory.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            UserSession: The user's session.
+        """
+        session = self._sessions.get(user_id)
+        if session is not None:
+            return session
+
+        row = db.get_session(user_id)
+        session = UserSession.from_row(row) if row is not None else UserSession()
+
+        # setdefault is atomic, so concurrent callers get the same session
+        resident_session = self._sessions.setdefault(user_id, session)
+
+        # Active sessions already have a timeout. Make sure idle ones are eventually evicted.
+        if resident_session is session and session.state == UserState.IDLE:
+            inactivity_scheduler.schedule(user_id, time.time() + SESSION_IDLE_TTL)
+
+        return resident_session
+
+    def set(self, user_id: int, field: str, value) -> None:
+        """
+        Sets a field of a user's session.
+
+        Args:
+            user_id (int): The user's ID.
+            field (str): The name of the field.
+            value: The value to be set.
+
+        Returns:
+            None
+        """
+        with self.lock(user_id):
+            setattr(self.get(user_id), field, value)
+            self._mark_dirty(user_id)
+
+    def add_message_id(self, user_id: int, message_id: int) -> None:
+        """
+        Adds a message ID to a user's session.
+
+        Args:
+            user_id (int): The user's ID.
+            message_id (int): The message ID to be added.
+
+        Returns:
+            None
+        """
+        with self.lock(user_id):
+            self.get(user_id).add_message_id(message_id, time.time())
+            self._mark_dirty(user_id)
+
+    def set_message_ids(self, user_id: int, message_ids: list[int]) -> None:
+        """
+        Replaces a user's message IDs.
+
+        Args:
+            user_id (int): The user's ID.
+            message_ids (list[int]): The message IDs to be set, oldest first.
+
+        Returns:
+            None
+        """
+        now = time.time()
+
+        with self.lock(user_id):
+            session = self.get(user_id)
+            session.take_message_ids(now)
+            for message_id in message_ids:
+                session.add_message_id(message_id, now)
+            self._mark_dirty(user_id)
+
+    def compare_and_set_state(self, user_id: int, expected: UserState, state: UserState) -> bool:
+        """
+        Sets a user's state only if it is still the expected one.
+
+        Args:
+            user_id (int): The user's ID.
+            expected (UserState): The state the user must be in.
+            state (UserState): The state to be set.
+
+        Returns:
+            bool: True if the state was set, False if the user was no longer in the expected state.
+        """
+        with self.lock(user_id):
+            session = self.get(user_id)
+            if session.state != expected:
+                return False
+
+            session.state = state
+            self._mark_dirty(user_id)
+
+            return True
+
+    def take_message_ids(self, user_id: int) -> list[int]:
+        """
+        Gets and clears a user's message IDs in one step, so that no ID added concurrently is lost.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            list[int]: The message IDs the user had, except those of messages too old to be deleted.
+        """
+        with self.lock(user_id):
+            message_ids = self.get(user_id).take_message_ids(time.time())
+            self._mark_dirty(user_id)
+
+            return message_ids
+
+    def remove(self, user_id: int) -> None:
+        """
+        Drops a user's session from memory and deletes its saved copy. Used when the user is removed
+        from the whitelist, so that the old session does not come back if the user is whitelisted again.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            None
+        """
+        # Serialized with checkpoints, so that a checkpoint in progress cannot save the session again
+        with self._checkpoint_lock, self.lock(user_id):
+            db.delete_session(user_id)
+
+            with self._dirty_lock:
+                self._dirty.discard(user_id)
+            self._sessions.pop(user_id, None)
+
+    def try_begin_turn(self, user_id: int) -> bool:
+        """
+        Marks a user as busy with a prompt, unless a previous prompt of the user is still being answered.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            bool: True if the turn was started, False if the user is already busy.
+        """
+        with self.lock(user_id):
+            session = self.get(user_id)
+            if session.busy:
+                return False
+
+            session.busy = True
+
+            return True
+
+    def end_turn(self, user_id: int) -> None:
+        """
+        Marks a user as no longer busy with a prompt.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            None
+        """
+        with self.lock(user_id):
+            self.get(user_id).busy = False
+
+    def expire(self, user_id: int, now: float, timeout: float, idle_ttl: float) -> tuple[tuple | None, float | None]:
+        """
+        Times out or evicts a user's session, whichever is due.
+
+        An active session whose user has been inactive for longer than the timeout is reset to idle.
+        An idle session that has not been used for longer than the idle TTL is saved and dropped from memory,
+        together with its message IDs and temporary data. Sessions answering a prompt are left alone.
+
+        Args:
+            user_id (int): The user's ID.
+            now (float): The current time.
+            timeout (float): The number of seconds of inactivity after which an active session expires.
+            idle_ttl (float): The number of seconds after which an unused idle session is evicted.
+
+        Returns:
+            tuple: The conversation ID and message IDs the session had if it expired (None otherwise),
+                   and the time at which the session should be checked again (None if it was evicted).
+        """
+        # Serialized with checkpoints, so that a checkpoint in progress cannot miss an evicted session's changes
+        with self._checkpoint_lock, self.lock(user_id):
+            session = self.get(user_id)
+
+            if session.busy:
+                return None, now + timeout
+
+            if session.state != UserState.IDLE:
+                if session.last_activity is not None and now - session.last_activity < timeout:
+                    return None, session.last_activity + timeout
+
+                expired = (session.conversation_id, session.take_message_ids(now))
+
+                session.state = UserState.IDLE
+                session.conversation_id = None
+                session.last_activity = None
+                self._mark_dirty(user_id)
+
+                return expired, now + idle_ttl
+
+            if session.last_activity is not None and now - session.last_activity < idle_ttl:
+                return None, session.last_activity + idle_ttl
+
+            with self._dirty_lock:
+                dirty = user_id in self._dirty
+
+            if dirty or session.temp_data is not None:
+                session.temp_data = None
+                db.save_sessions([session.to_row(user_id)])
+
+            with self._dirty_lock:
+                self._dirty.discard(user_id)
+            del self._sessions[user_id]
+
+            return None, None
+
+    def checkpoint(self) -> int:
+        """
+        Saves the sessions modified since the last checkpoint to the database.
+        If saving them together fails, they are saved one at a time, so that one bad session does not keep
+        the others from being saved. Sessions that still fail are kept modified so that the next checkpoint
+        retries them, and the first error is raised.
+
+        Returns:
+            int: The number of sessions saved.
+
+        Raises:
+            Exception: The first error saving a session, after the other sessions were saved.
+        """
+        with self._checkpoint_lock:
+            with self._dirty_lock:
+                user_ids, self._dirty = self._dirty, set()
+
+            if not user_ids:
+                return 0
+
+            rows = []
+            for user_id in user_ids:
+                with self.lock(user_id):
+                    session = self._sessions.get(user_id)
+                    if session is not None:
+                        rows.append(session.to_row(user_id))
+
+            try:
+                db.save_sessions(rows)
+                return len(rows)
+            except Exception:
+                pass
+
+            failed_user_ids = set()
+            first_error = None
+            for row in rows:
+                try:
+                    db.save_sessions([row])
+                except Exception as e:
+                    failed_user_ids.add(row[0])
+                    first_error = first_error or e
+
+            with self._dirty_lock:
+                self._dirty |= failed_user_ids
+
+            if first_error is not None:
+                raise first_error
+
+            return len(rows)
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Gets the store's gauges.
+
+        Returns:
+            dict: The number of sessions in memory and of those that are not idle ("resident" and "active" keys).
+        """
+        sessions = list(self._sessions.copy().values())
+
+        return {
+            "resident": len(sessions),
+            "active": sum(1 for session in sessions if session.state != UserState.IDLE)
+        }
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _mark_dirty(self, user_id: int) -> None:
+        with self._dirty_lock:
+            self._dirty.add(user_id)
+
+
+session_store = SessionStore(SESSION_LOCK_STRIPES)
@@ -0,0 +1,120 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+
+
+class AbandonedRequestError(Exception):
+    """
+    Raised to the followers of a request whose leader was cancelled or stopped before it finished.
+    """
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent requests, used from the GPT client's event loop only.
+
+    The first caller for a key (the leader) makes the request. Callers arriving with the same key while it is
+    in flight (followers) wait for the leader's result instead of making their own request, and get the same
+    result or error (AbandonedRequestError if the leader is cancelled).
+    """
+
+    def __init__(self) -> None:
+        self._calls = {}    # key -> future of the in-flight request's result
+
+        self.calls = 0
+        self.coalesced = 0
+
+    def claim(self, key: Hashable) -> tuple[asyncio.Future, bool]:
+        """
+        Joins the in-flight request for a key, or registers a new one.
+        A new request must be resolved with resolve() once it finishes, whether it succeeds or not.
+
+        Args:
+            key (Hashable): The key identifying the request.
+
+        Returns:
+            tuple: The future of the request's result, and True if the caller is the leader and must make
+                   the request (False if the caller must await the future instead).
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future, False
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.calls += 1
+
+        return future, True
+
+    def resolve(self, key: Hashable, future: asyncio.Future, result=None, error: BaseException | None = None) -> None:
+        """
+        Completes a request registered by claim(), passing its result or error to the followers.
+
+        Args:
+            key (Hashable): The key identifying the request.
+            future (asyncio.Future): The future returned by claim().
+            result (optional): The request's result. Defaults to None.
+            error (BaseException or None, optional): The error the request failed with. Defaults to None.
+
+        Returns:
+            None
+        """
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+        if future.done():
+            return
+
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            # Followers were not cancelled themselves, so they get an ordinary error
+            error = AbandonedRequestError('The coalesced GPT request was abandoned.')
+
+        if error is not None:
+            future.set_exception(error)
+            # The leader raises its error itself, so it must not be reported as never retrieved
+            future.exception()
+        else:
+            future.set_result(result)
+
+    async def run(self, key: Hashable | None, request: Callable[[], Awaitable]):
+        """
+        Makes a request, or waits for an identical one already in flight.
+
+        Args:
+            key (Hashable or None): The key identifying the request. The request is not coalesced if None.
+            request (Callable): Function starting the request.
+
+        Returns:
+            The request's result.
+        """
+        if key is None:
+            return await request()
+
+        future, leader = self.claim(key)
+        if not leader:
+            # Shielded, so that a follower being cancelled does not cancel the result for everyone else
+            return await asyncio.shield(future)
+
+        try:
+            result = await request()
+        except BaseException as e:
+            self.resolve(key, future, error=e)
+            raise
+
+        self.resolve(key, future, result)
+
+        return result
+
+    def get_stats(self) -> dict:
+        """
+        Gets the coalescer's counters and gauges.
+
+        Returns:
+            dict: The number of requests made, of requests coalesced into them, and of requests in flight
+                  ("calls", "coalesced" and "in_flight" keys).
+        """
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls)
+        }
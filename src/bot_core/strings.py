@@ -139,4 +139,8 @@ class Strings():
 
     ADMIN_NOT_IDLE_ERROR = ERROR_HEADER + '*/admin* is only available in the idle state\.'
 
-    NOT_ADMIN_ERROR = ERROR_HEADER + 'You do not have permission to use this command\.'
\ No newline at end of file
+    NOT_ADMIN_ERROR = ERROR_HEADER + 'You do not have permission to use this command\.'
+
+    GPT_RESPONSE_ERROR = ERROR_HEADER + 'Could not generate a response\. Please try again\.'
+
+    PROMPT_IN_PROGRESS_ERROR = ERROR_HEADER + 'Please wait for the response to your previous prompt before sending another\.'
\ No newline at end of file
@@ -0,0 +1,143 @@
+from concurrent.futures import Future
+import logging
+import threading
+
+import bot_core.gpt_client as gpt
+import bot_core.workers as workers
+import database.models as db
+
+logger = logging.getLogger(__name__)
+
+# Conversations whose summary is currently being refreshed
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def get_history(user_id: int,
+                conversation_id: int,
+                max_messages: int | None,
+                max_tokens: int | None) -> tuple[list[dict[str, str]], str | None]:
+    """
+    Gets the history to send to the GPT model with a prompt: the conversation's summary, and its past messages
+    that are not in the summary. These are the recent history window, preceded by any older messages that
+    have left the window but have not been folded into the summary yet, so that no message is ever dropped.
+
+    Args:
+        user_id (int): The user's ID.
+        conversation_id (int): The conversation's ID.
+        max_messages (int or None): The most recent messages to include in the history window.
+        max_tokens (int or None): The approximate token budget of the history window.
+
+    Returns:
+        tuple: The past messages ("role" and "content" keys), oldest first, and the summary (None if there is none).
+    """
+    past_messages = db.get_past_messages(user_id, conversation_id, max_messages=max_messages, max_tokens=max_tokens)
+
+    current = db.get_conversation_summary(conversation_id)
+    summary = current['summary'] if current else None
+    last_message_id = current['last_message_id'] if current else 0
+
+    unsummarized = db.get_unsummarized_messages(user_id, conversation_id, last_message_id, len(past_messages))
+    if unsummarized:
+        past_messages = ([{"role": message['role'], "content": message['content']} for message in unsummarized] +
+                         past_messages)
+
+    return past_messages, summary
+
+
+def refresh_summary(user_id: int,
+                    conversation_id: int,
+                    keep_recent: int,
+                    threshold: int) -> tuple[list, Future] | None:
+    """
+    Starts folding messages that have left the recent history window into the conversation's stored summary,
+    once at least `threshold` of them have accumulated. The summary is generated on the GPT client's event loop
+    without blocking the calling thread, and must be saved with save_summary() once it arrives.
+
+    Args:
+        user_id (int): The user's ID.
+        conversation_id (int): The conversation's ID.
+        keep_recent (int): The number of most recent messages that are sent verbatim and not summarized.
+        threshold (int): The minimum number of unsummarized older messages before the summary is refreshed.
+
+    Returns:
+        tuple or None: The messages being summarized and the future of the new summary.
+                       None if too few messages have accumulated.
+    """
+    current = db.get_conversation_summary(conversation_id)
+    summary = current['summary'] if current else None
+    last_message_id = current['last_message_id'] if current else 0
+
+    messages = db.get_unsummarized_messages(user_id, conversation_id, last_message_id, keep_recent)
+    if len(messages) < threshold:
+        return None
+
+    return messages, gpt.submit(gpt.generate_summary_async(summary, messages, user_id))
+
+
+def save_summary(user_id: int, conversation_id: int, messages: list, future: Future) -> None:
+    """
+    Saves a conversation's refreshed summary.
+
+    Args:
+        user_id (int): The user's ID.
+        conversation_id (int): The conversation's ID.
+        messages (list): The messages folded into the summary, oldest first.
+        future (Future): The future of the new summary, as started by refresh_summary().
+
+    Returns:
+        None
+    """
+    new_summary = future.result()
+    db.set_conversation_summary(conversation_id, new_summary, messages[-1]['message_id'])
+
+    logger.info(f'Summarized {len(messages)} messages of conversation {conversation_id} for user {user_id}.')
+
+
+def schedule_summary_refresh(user_id: int, conversation_id: int, keep_recent: int, threshold: int) -> None:
+    """
+    Refreshes the conversation's summary in the background. Does nothing if a refresh is already running.
+
+    No worker waits for the GPT model: one worker starts the refresh, and another saves the summary once it arrives.
+
+    Args:
+        user_id (int): The user's ID.
+        conversation_id (int): The conversation's ID.
+        keep_recent (int): The number of most recent messages that are sent verbatim and not summarized.
+        threshold (int): The minimum number of unsummarized older messages before the summary is refreshed.
+
+    Returns:
+        None
+    """
+    conversation_id = int(conversation_id)
+
+    with _in_flight_lock:
+        if conversation_id in _in_flight:
+            return
+        _in_flight.add(conversation_id)
+
+    def release() -> None:
+        with _in_flight_lock:
+            _in_flight.discard(conversation_id)
+
+    def save(messages: list, future: Future) -> None:
+        try:
+            save_summary(user_id, conversation_id, messages, future)
+        finally:
+            release()
+
+    def start() -> None:
+        try:
+            refresh = refresh_summary(user_id, conversation_id, keep_recent, threshold)
+        except BaseException:
+            release()
+            raise
+
+        if refresh is None:
+            release()
+            return
+
+        messages, future = refresh
+        future.add_done_callback(lambda future: workers.submit(save, messages, future))
+
+    workers.submit(start)
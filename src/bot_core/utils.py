@@ -2,50 +2,34 @@ import base64
 import logging
 
 import telebot
-from telegramify_markdown import markdownify
 
 import database.models as db
+from bot_core.rendering import render_cache
+from bot_core.scheduler import inactivity_scheduler
+from bot_core.sessions import SESSION_IDLE_TTL, SESSION_TIMEOUT, session_store
 from bot_core.states import UserState
+from bot_core.strings import Strings
 
 logger = logging.getLogger(__name__)
 
-# Dictionary to store the state and conversation ID of each user
-# {
-#   user_id (int): {
-#       'state': state,
-#       'conversation_id': conversation_id,
-#       'message_ids': [message_id1, message_id2, ...],
-#       'last_activity': time_of_last_activity,
-#       'temp_data': temp_data
-#   }
-# }
-user_data = {}
-
 
 ##################################################
-# Functions for managing users' data
+# Functions for managing users' sessions
 def initialize_users_data() -> None:
     """
-    Initializes the user data in memory.
+    Schedules the timeouts of the sessions that were active when the bot last stopped.
+    The sessions themselves are restored lazily, on each user's first interaction.
 
     Returns:
         None
     """
     try:
-        global user_data
-
-        user_ids = db.get_whitelisted_user_ids()
+        active_sessions = db.get_active_sessions(UserState.IDLE.value)
 
-        for user_id in user_ids:
-            user_id = user_id[0]       # DB results are returned as tuples
-            user_data[user_id] = {}
-            set_user_state(user_id, UserState.IDLE)
-            set_user_conversation_id(user_id, None)
-            set_user_message_ids(user_id, [])
-            
-            set_user_temp_data(user_id, None)
+        for user_id, last_activity in active_sessions:
+            inactivity_scheduler.schedule(user_id, last_activity + SESSION_TIMEOUT)
 
-        logger.info('Successfully initialized user data.')
+        logger.info(f'Successfully initialized user data ({len(active_sessions)} active sessions).')
     except Exception as e:
         logger.error(f'Error initializing user data: {str(e)}')
         raise
@@ -62,7 +46,7 @@ def set_user_state(user_id: int, state: int) -> None:
     Returns:
         None
     """
-    user_data.setdefault(user_id, {})['state'] = state
+    session_store.set(user_id, 'state', state)
 
 
 def get_user_state(user_id: int) -> int:
@@ -75,7 +59,22 @@ def get_user_state(user_id: int) -> int:
     Returns:
         int: The state of the user.
     """
-    return user_data.get(user_id, {}).get('state', UserState.IDLE)
+    return session_store.get(user_id).state
+
+
+def compare_and_set_user_state(user_id: int, expected_state: int, state: int) -> bool:
+    """
+    Sets the state of a user only if the user is still in the expected state.
+
+    Args:
+        user_id (int): The user's ID.
+        expected_state (int): The state the user must be in.
+        state (int): The state to be set.
+
+    Returns:
+        bool: True if the state was set, False if the user's state had already changed.
+    """
+    return session_store.compare_and_set_state(user_id, expected_state, state)
 
 
 def set_user_conversation_id(user_id: int, conversation_id: int | None) -> None:
@@ -89,7 +88,20 @@ def set_user_conversation_id(user_id: int, conversation_id: int | None) -> None:
     Returns:
         None
     """
-    user_data.setdefault(user_id, {})['conversation_id'] = conversation_id
+    session_store.set(user_id, 'conversation_id', conversation_id)
+
+
+def remove_user_session(user_id: int) -> None:
+    """
+    Removes the session of a user who was removed from the whitelist, in memory and in the database.
+
+    Args:
+        user_id (int): The user's ID.
+
+    Returns:
+        None
+    """
+    session_store.remove(user_id)
 
 
 def get_user_conversation_id(user_id: int) -> int | None:
@@ -102,7 +114,7 @@ def get_user_conversation_id(user_id: int) -> int | None:
     Returns:
         int or None: The conversation ID of the user. None if the user is not in a conversation.
     """
-    return user_data.get(user_id, {}).get('conversation_id', None)
+    return session_store.get(user_id).conversation_id
 
 
 def set_user_message_ids(user_id: int, message_ids: list) -> None:
@@ -116,7 +128,7 @@ def set_user_message_ids(user_id: int, message_ids: list) -> None:
     Returns:
         None
     """
-    user_data.setdefault(user_id, {})['message_ids'] = message_ids
+    session_store.set_message_ids(user_id, message_ids)
 
 
 def get_user_message_ids(user_id: int) -> list:
@@ -127,14 +139,15 @@ def get_user_message_ids(user_id: int) -> list:
         user_id (int): The user's ID.
 
     Returns:
-        list: The list of message IDs of the user.
+        list: A copy of the list of message IDs of the user.
     """
-    return user_data.get(user_id, {}).get('message_ids', [])
+    return session_store.get(user_id).message_ids.tolist()
 
 
 def add_user_message_id(user_id: int, message_id: int) -> None:
     """
-    Adds a message ID to the list of message IDs of a user.
+    Adds a message ID to the list of message IDs of a user. The list is capped, and IDs of messages
+    too old to be deleted are dropped.
 
     Args:
         user_id (int): The user's ID.
@@ -143,7 +156,20 @@ def add_user_message_id(user_id: int, message_id: int) -> None:
     Returns:
         None
     """
-    user_data.setdefault(user_id, {}).setdefault('message_ids', []).append(message_id)
+    session_store.add_message_id(user_id, message_id)
+
+
+def pop_user_message_ids(user_id: int) -> list:
+    """
+    Gets the list of message IDs of a user and clears it, as one atomic step.
+
+    Args:
+        user_id (int): The user's ID.
+
+    Returns:
+        list: The list of message IDs the user had, except those of messages too old to be deleted.
+    """
+    return session_store.take_message_ids(user_id)
 
 
 def set_user_last_activity(user_id: int, last_activity: float) -> None:
@@ -152,12 +178,17 @@ def set_user_last_activity(user_id: int, last_activity: float) -> None:
 
     Args:
         user_id (int): The user's ID.
-        last_activity (float): The time of the last activity.
+        last_activity (float): The time of the last activity. None to stop the user's session from timing out.
 
     Returns:
         None
     """
-    user_data.setdefault(user_id, {})['last_activity'] = last_activity
+    session_store.set(user_id, 'last_activity', last_activity)
+
+    if last_activity is None:
+        inactivity_scheduler.cancel(user_id)
+    else:
+        inactivity_scheduler.schedule(user_id, last_activity + SESSION_TIMEOUT)
 
 
 def get_user_last_activity(user_id: int) -> float:
@@ -170,7 +201,7 @@ def get_user_last_activity(user_id: int) -> float:
     Returns:
         float: The time of the last activity of the user.
     """
-    return user_data.get(user_id, {}).get('last_activity', None)
+    return session_store.get(user_id).last_activity
 
 
 def set_user_temp_data(user_id: int, temp_data: dict | None) -> None:
@@ -184,7 +215,7 @@ def set_user_temp_data(user_id: int, temp_data: dict | None) -> None:
     Returns:
         None
     """
-    user_data.setdefault(user_id, {})['temp_data'] = temp_data
+    session_store.set(user_id, 'temp_data', temp_data)
 
 
 def get_user_temp_data(user_id: int) -> dict | None:
@@ -197,7 +228,85 @@ def get_user_temp_data(user_id: int) -> dict | None:
     Returns:
         dict or None: The temporary data of the user.
     """
-    return user_data.get(user_id, {}).get('temp_data', None)
+    return session_store.get(user_id).temp_data
+
+
+def expire_user_session(user_id: int, now: float) -> tuple[int | None, list] | None:
+    """
+    Resets a user's session to idle if the user has been inactive for longer than the session timeout,
+    or evicts it from memory if it has been idle for longer than the idle TTL.
+    Schedules the next check of the session, if it is still in memory.
+
+    Args:
+        user_id (int): The user's ID.
+        now (float): The current time.
+
+    Returns:
+        tuple or None: The conversation ID the user was in and the user's message IDs, if the session expired.
+                       None otherwise.
+    """
+    try:
+        expired, recheck_at = session_store.expire(user_id, now, SESSION_TIMEOUT, SESSION_IDLE_TTL)
+    except Exception as e:
+        logger.error(f'Error expiring session of user {user_id}: {str(e)}')
+        inactivity_scheduler.schedule(user_id, now + SESSION_TIMEOUT)
+        return None
+
+    if recheck_at is not None:
+        inactivity_scheduler.schedule(user_id, recheck_at)
+    else:
+        logger.debug(f'Evicted idle session of user {user_id}.')
+
+    return expired
+
+
+def get_session_stats() -> dict[str, int]:
+    """
+    Gets the number of sessions in memory and of those that are not idle.
+
+    Returns:
+        dict: The "resident" and "active" session counts.
+    """
+    return session_store.get_stats()
+
+
+def try_begin_user_turn(user_id: int) -> bool:
+    """
+    Marks a user's prompt as being answered, so that the user's prompts are answered one at a time.
+
+    Args:
+        user_id (int): The user's ID.
+
+    Returns:
+        bool: True if the user may proceed, False if a previous prompt is still being answered.
+    """
+    return session_store.try_begin_turn(user_id)
+
+
+def end_user_turn(user_id: int) -> None:
+    """
+    Marks a user's prompt as answered.
+
+    Args:
+        user_id (int): The user's ID.
+
+    Returns:
+        None
+    """
+    session_store.end_turn(user_id)
+
+
+def save_sessions() -> None:
+    """
+    Saves the sessions modified since the last save to the database.
+
+    Returns:
+        None
+    """
+    saved = session_store.checkpoint()
+
+    if saved:
+        logger.debug(f'Successfully saved {saved} sessions.')
 ##################################################
 
 
@@ -216,13 +325,27 @@ def verify_user(user_id: int) -> bool:
     return whitelisted
 
 
-def custom_inline_keyboard(buttons: list) -> telebot.types.InlineKeyboardMarkup:
+class FrozenInlineKeyboardMarkup(telebot.types.InlineKeyboardMarkup):
+    """
+    Inline keyboard markup whose JSON is serialized once, for keyboards that never change.
+    """
+
+    def __init__(self, keyboard: list) -> None:
+        super().__init__(keyboard)
+        self._json = super().to_json()
+
+    def to_json(self) -> str:
+        return self._json
+
+
+def custom_inline_keyboard(buttons: list, frozen: bool = False) -> telebot.types.InlineKeyboardMarkup:
     """
     Creates a custom inline keyboard with the given list of buttons.
 
     Args:
         buttons (list): A list of lists, where each inner list represents a row.
                         Each item in the inner list is a tuple (button_text, callback_data).
+        frozen (bool, optional): Whether to serialize the keyboard once, for static keyboards. Defaults to False.
 
     Returns:
         telebot.types.InlineKeyboardMarkup: A custom inline keyboard markup with the given buttons.
@@ -237,21 +360,46 @@ def custom_inline_keyboard(buttons: list) -> telebot.types.InlineKeyboardMarkup:
         
         keyboard.append(row)
 
+    if frozen:
+        return FrozenInlineKeyboardMarkup(keyboard)
+
     markup = telebot.types.InlineKeyboardMarkup(keyboard)
 
     return markup
 
 
-def admin_menu_inline_keyboard() -> telebot.types.InlineKeyboardMarkup:
-    buttons = []
-    buttons.append([('➕ Add Whitelist User', 'add')])
-    buttons.append([('➖ Remove Whitelist User', 'remove')])
-    buttons.append([('📜 Show Whitelist Users', 'show')])
-    buttons.append([('👋 Quit', 'quit')])
+# Button rows shared by static and dynamic keyboards
+BACK_QUIT_BUTTONS = [('🔙 Back', 'back'), ('👋 Quit', 'quit')]
 
-    markup = custom_inline_keyboard(buttons)
+# Static keyboards, built and serialized once
+MAIN_MENU_KEYBOARD = custom_inline_keyboard([
+    [('🆕 Create New Conversation', 'create')],
+    [('💬 Load Existing Conversation', 'load')],
+    [('✏️ Edit Existing Conversation', 'edit')],
+    [('🗑️ Delete Existing Conversation', 'delete')],
+    [('❓ Help', 'help'), ('🆔 Show User ID', 'id'), ('👋 Quit', 'quit')]
+], frozen=True)
 
-    return markup
+ADMIN_MENU_KEYBOARD = custom_inline_keyboard([
+    [('➕ Add Whitelist User', 'add')],
+    [('➖ Remove Whitelist User', 'remove')],
+    [('📜 Show Whitelist Users', 'show')],
+    [('👋 Quit', 'quit')]
+], frozen=True)
+
+BACK_QUIT_KEYBOARD = custom_inline_keyboard([BACK_QUIT_BUTTONS], frozen=True)
+
+CONFIRMATION_KEYBOARD = custom_inline_keyboard([[('✔️ Yes', 'yes'), ('❌ No', 'no')]], frozen=True)
+
+
+def admin_menu_inline_keyboard() -> telebot.types.InlineKeyboardMarkup:
+    """
+    Gets the admin menu's inline keyboard.
+
+    Returns:
+        telebot.types.InlineKeyboardMarkup: The prebuilt admin menu keyboard.
+    """
+    return ADMIN_MENU_KEYBOARD
 
 
 def admin_remove_whitelist_user_inline_keyboard() -> telebot.types.InlineKeyboardMarkup:
@@ -262,10 +410,9 @@ def admin_remove_whitelist_user_inline_keyboard() -> telebot.types.InlineKeyboar
     buttons = []
 
     for user_id in user_ids:
-        user_id = user_id[0]        # DB results are returned as tuples
         # Button text: User ID, Callback data: User ID
         buttons.append([(f'👤 {user_id}', f'{user_id}')])
-    buttons.append([('🔙 Back', 'back'), ('👋 Quit', 'quit')])
+    buttons.append(BACK_QUIT_BUTTONS)
     markup = custom_inline_keyboard(buttons)
 
     return markup
@@ -273,57 +420,48 @@ def admin_remove_whitelist_user_inline_keyboard() -> telebot.types.InlineKeyboar
 
 def back_quit_inline_keyboard() -> telebot.types.InlineKeyboardMarkup:
     """
-    Creates an inline keyboard with 'Back' and 'Quit' buttons.
+    Gets the inline keyboard with 'Back' and 'Quit' buttons.
 
     Returns:
-        telebot.types.InlineKeyboardMarkup: An inline keyboard markup with 'Back' and 'Quit' buttons.
+        telebot.types.InlineKeyboardMarkup: The prebuilt keyboard with 'Back' and 'Quit' buttons.
     """
-    buttons = [[('🔙 Back', 'back'), ('👋 Quit', 'quit')]]
-    markup = custom_inline_keyboard(buttons)
-
-    return markup
+    return BACK_QUIT_KEYBOARD
 
 
 def confirmation_inline_keyboard() -> telebot.types.InlineKeyboardMarkup:
     """
-    Creates an inline keyboard with 'Yes' and 'No' buttons for confirmation.
+    Gets the inline keyboard with 'Yes' and 'No' buttons for confirmation.
 
     Returns:
-        telebot.types.InlineKeyboardMarkup: An inline keyboard markup with 'Yes' and 'No' buttons.
+        telebot.types.InlineKeyboardMarkup: The prebuilt keyboard with 'Yes' and 'No' buttons.
     """
-    buttons = [[('✔️ Yes', 'yes'), ('❌ No', 'no')]]
-    markup = custom_inline_keyboard(buttons)
-
-    return markup
+    return CONFIRMATION_KEYBOARD
 
 
-def conversations_inline_keyboard(user_id: int) -> telebot.types.InlineKeyboardMarkup:
-    # Fetch user's conversations
-    conversations = [(conversation_id, title) for conversation_id, title in db.get_user_conversations(user_id)]
+def conversations_inline_keyboard(user_id: int, conversations: list | None = None) -> telebot.types.InlineKeyboardMarkup:
+    # Fetch user's conversations, unless the caller already has them
+    if conversations is None:
+        conversations = db.get_user_conversations(user_id)
 
     # Create custom keyboard
     buttons = []
     for conversation in conversations:
         # Button text: Conversation title, Callback data: Conversation ID
         buttons.append([(f'💬 {conversation[1]}', f'{conversation[0]}')])
-    buttons.append([('🔙 Back', 'back'), ('👋 Quit', 'quit')])
+    buttons.append(BACK_QUIT_BUTTONS)
     markup = custom_inline_keyboard(buttons)
 
     return markup
 
 
 def main_menu_inline_keyboard() -> telebot.types.InlineKeyboardMarkup:
-    buttons = []
-
-    buttons.append([('🆕 Create New Conversation', 'create')])
-    buttons.append([('💬 Load Existing Conversation', 'load')])
-    buttons.append([('✏️ Edit Existing Conversation', 'edit')])
-    buttons.append([('🗑️ Delete Existing Conversation', 'delete')])
-    buttons.append([('❓ Help', 'help'), ('🆔 Show User ID', 'id'), ('👋 Quit', 'quit')])
-
-    markup = custom_inline_keyboard(buttons)
+    """
+    Gets the main menu's inline keyboard.
 
-    return markup
+    Returns:
+        telebot.types.InlineKeyboardMarkup: The prebuilt main menu keyboard.
+    """
+    return MAIN_MENU_KEYBOARD
 
 
 def convert_image_to_base64(image_path: str) -> str:
@@ -343,4 +481,34 @@ def convert_image_to_base64(image_path: str) -> str:
 
 
 def convert_to_mdv2(mdv1_text: str) -> str:
-    return markdownify(mdv1_text)
+    """
+    Converts Markdown text to Telegram's MarkdownV2 format. Renderings are memoized, so that
+    replaying a conversation does not re-render identical text.
+
+    Args:
+        mdv1_text (str): The Markdown text.
+
+    Returns:
+        str: The text in MarkdownV2 format.
+    """
+    return render_cache.render(mdv1_text)
+
+
+class RenderedStrings():
+    """
+    Constant messages that are composed from Strings and converted to MarkdownV2 once, instead of on every use.
+    """
+    DELETE_CONV_SUCCESS_MESSAGE = convert_to_mdv2(Strings.DELETE_CONV_HEADER +
+                                                  'Conversation has been deleted.' +
+                                                  Strings.NAVIGATION_FOOTER)
+
+    REMOVE_WHITELIST_USER_SELECT_MESSAGE = convert_to_mdv2(Strings.REMOVE_WHITELIST_USER_HEADER +
+                                                           'Select a user to remove from the whitelist.' +
+                                                           Strings.NAVIGATION_FOOTER)
+
+    REMOVE_WHITELIST_USER_EMPTY_MESSAGE = convert_to_mdv2(Strings.REMOVE_WHITELIST_USER_HEADER +
+                                                          'No whitelisted users at the moment.' +
+                                                          Strings.NAVIGATION_FOOTER)
+
+    REMOVE_WHITELIST_USER_ERROR = convert_to_mdv2(Strings.ERROR_HEADER +
+                                                  'Error removing user from whitelist. Please try again.')
@@ -0,0 +1,50 @@
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MAX_WORKERS = 4     # Background tasks run off the telebot handler threads
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='worker')
+
+
+def _log_exception(future: Future) -> None:
+    """
+    Logs the exception raised by a background task, if any.
+
+    Args:
+        future (Future): The finished task.
+
+    Returns:
+        None
+    """
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f'Error in background task: {str(future.exception())}')
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """
+    Runs a function in the background worker pool. Exceptions are logged instead of being lost.
+
+    Args:
+        fn: The function to run.
+        *args: Positional arguments for the function.
+        **kwargs: Keyword arguments for the function.
+
+    Returns:
+        Future: The future of the task.
+    """
+    future = executor.submit(fn, *args, **kwargs)
+    future.add_done_callback(_log_exception)
+
+    return future
+
+
+def shutdown() -> None:
+    """
+    Waits for queued background tasks to finish and stops the worker pool.
+
+    Returns:
+        None
+    """
+    executor.shutdown(wait=True)
@@ -1,13 +1,11 @@
 import logging
 from logging.config import dictConfig
-from os import getenv
 
-from dotenv import load_dotenv
+from config.settings import Settings
 
 
-def setup_logging():
-    load_dotenv()
-    LOG_PATH = getenv('LOG_PATH')
+def setup_logging(settings: Settings):
+    LOG_PATH = settings.log_path
 
     log_config = {
         'version': 1,
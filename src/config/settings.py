@@ -0,0 +1,112 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from os import getenv
+
+from dotenv import load_dotenv
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Immutable application settings, parsed once from the environment (and .env file).
+    """
+    admin_id: int
+    bot_token: str
+    db_path: str
+    gpt_token: str
+    log_path: str
+    history_max_messages: int = 20         # Most past messages sent to GPT per turn
+    history_max_tokens: int = 4000         # Estimated token budget for past messages sent to GPT per turn
+    summary_threshold: int = 10            # Older messages to accumulate before refreshing a conversation's summary
+    gpt_max_concurrency: int = 8           # Most GPT requests in flight at once, across all users
+    response_cache_enabled: bool = False   # Reuse responses to identical first-turn prompts
+    response_cache_ttl: int = 604800       # Seconds a cached response is reused for (7 days)
+    response_cache_max_entries: int = 10000    # Most responses kept in the cache
+
+
+def _get_int(name: str, default: int) -> int:
+    """
+    Reads an optional integer setting from the environment.
+
+    Args:
+        name (str): The name of the environment variable.
+        default (int): The value to use if the variable is not set.
+
+    Returns:
+        int: The parsed value.
+
+    Raises:
+        ValueError: If the variable is set but is not an integer.
+    """
+    value = getenv(name)
+    if not value:
+        return default
+
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def _get_bool(name: str, default: bool) -> bool:
+    """
+    Reads an optional boolean setting from the environment.
+
+    Args:
+        name (str): The name of the environment variable.
+        default (bool): The value to use if the variable is not set.
+
+    Returns:
+        bool: The parsed value.
+
+    Raises:
+        ValueError: If the variable is set but is not a boolean.
+    """
+    value = getenv(name)
+    if not value:
+        return default
+
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+
+    raise ValueError(f'{name} must be a boolean')
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    Loads and validates the settings on first call. Subsequent calls return the same object.
+
+    Returns:
+        Settings: The application settings.
+
+    Raises:
+        ValueError: If a required setting is missing or invalid.
+    """
+    load_dotenv()
+
+    required = ('ADMIN_ID', 'BOT_TOKEN', 'DB_PATH', 'GPT_TOKEN', 'LOG_PATH')
+    missing = [name for name in required if not getenv(name)]
+    if missing:
+        raise ValueError(f'Missing required settings: {", ".join(missing)}')
+
+    try:
+        admin_id = int(getenv('ADMIN_ID'))
+    except ValueError:
+        raise ValueError('ADMIN_ID must be an integer')
+
+    return Settings(admin_id=admin_id,
+                    bot_token=getenv('BOT_TOKEN'),
+                    db_path=getenv('DB_PATH'),
+                    gpt_token=getenv('GPT_TOKEN'),
+                    log_path=getenv('LOG_PATH'),
+                    history_max_messages=_get_int('HISTORY_MAX_MESSAGES', Settings.history_max_messages),
+                    history_max_tokens=_get_int('HISTORY_MAX_TOKENS', Settings.history_max_tokens),
+                    summary_threshold=_get_int('SUMMARY_THRESHOLD', Settings.summary_threshold),
+                    gpt_max_concurrency=_get_int('GPT_MAX_CONCURRENCY', Settings.gpt_max_concurrency),
+                    response_cache_enabled=_get_bool('RESPONSE_CACHE_ENABLED', Settings.response_cache_enabled),
+                    response_cache_ttl=_get_int('RESPONSE_CACHE_TTL', Settings.response_cache_ttl),
+                    response_cache_max_entries=_get_int('RESPONSE_CACHE_MAX_ENTRIES',
+                                                        Settings.response_cache_max_entries))
@@ -0,0 +1,454 @@
+from collections import OrderedDict, deque
+from collections.abc import Callable
+import threading
+import time
+
+CONVERSATION_CACHE_SIZE = 1024      # Most users whose conversation lists are cached
+HISTORY_BUFFER_SIZE = 50            # Most recent messages kept in memory per active conversation
+HISTORY_BUFFER_MAX_CHARS = 8000000  # Total message characters kept in memory across all conversations
+HISTORY_BUFFER_IDLE_TIMEOUT = 1800  # Seconds after which an unused conversation's messages are dropped
+
+
+class WhitelistCache:
+    """
+    Process-wide set of whitelisted user IDs. Loaded once from the 'Whitelist' table,
+    then kept up to date write-through by the functions that modify the table.
+    """
+
+    def __init__(self) -> None:
+        self._user_ids = None
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self, loader: Callable[[], list[int]]) -> None:
+        """
+        Loads the whitelist if it has not been loaded yet.
+
+        Args:
+            loader (Callable[[], list[int]]): Function that reads all whitelisted user IDs from the database.
+
+        Returns:
+            None
+        """
+        if self._user_ids is not None:
+            return
+
+        with self._lock:
+            if self._user_ids is None:
+                self._user_ids = {int(user_id) for user_id in loader()}
+
+    def contains(self, user_id: int) -> bool:
+        """
+        Checks if a user is whitelisted.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            bool: True if the user is whitelisted, False otherwise.
+        """
+        return int(user_id) in self._user_ids
+
+    def add(self, user_id: int) -> None:
+        """
+        Adds a user to the cached whitelist. Does nothing if the whitelist has not been loaded yet.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._user_ids is not None:
+                self._user_ids.add(int(user_id))
+
+    def remove(self, user_id: int) -> None:
+        """
+        Removes a user from the cached whitelist. Does nothing if the whitelist has not been loaded yet.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._user_ids is not None:
+                self._user_ids.discard(int(user_id))
+
+    def get_all(self) -> list[int]:
+        """
+        Gets all whitelisted user IDs.
+
+        Returns:
+            list[int]: The whitelisted user IDs, in ascending order.
+        """
+        with self._lock:
+            return sorted(self._user_ids)
+
+
+class ConversationCache:
+    """
+    Bounded LRU cache of each user's (conversation_id, title) list.
+    Entries are updated in place by the functions that modify the 'Conversation' table.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self._capacity = capacity
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0        # Incremented on every modification, to detect lists loaded before it
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> list[tuple[int, str]] | None:
+        """
+        Gets a user's cached conversations.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            list or None: A copy of the user's (conversation_id, title) list. None if it is not cached.
+        """
+        with self._lock:
+            conversations = self._conversations.get(user_id)
+
+            if conversations is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conversations.move_to_end(user_id)
+
+            return list(conversations)
+
+    def get_generation(self) -> int:
+        """
+        Gets the cache's modification counter. Read before loading a list from the database and passed to put().
+
+        Returns:
+            int: The modification counter.
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, user_id: int, conversations: list[tuple[int, str]], generation: int) -> None:
+        """
+        Caches a user's conversations, evicting the least recently used user if the cache is full.
+        The list is discarded if the cache was modified since `generation`, as it may be stale.
+
+        Args:
+            user_id (int): The user's ID.
+            conversations (list): The user's (conversation_id, title) list.
+            generation (int): The value of get_generation() before the list was loaded.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+
+            self._conversations[user_id] = list(conversations)
+            self._conversations.move_to_end(user_id)
+
+            while len(self._conversations) > self._capacity:
+                self._conversations.popitem(last=False)
+
+    def add(self, user_id: int, conversation_id: int, title: str) -> None:
+        """
+        Adds a conversation to a user's cached list, if it is cached.
+
+        Args:
+            user_id (int): The user's ID.
+            conversation_id (int): The conversation's ID.
+            title (str): The title of the conversation.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._generation += 1
+            conversations = self._conversations.get(user_id)
+            if conversations is not None:
+                conversations.append((int(conversation_id), title))
+
+    def rename(self, user_id: int, conversation_id: int, title: str) -> None:
+        """
+        Updates the title of a conversation in a user's cached list, if it is cached.
+
+        Args:
+            user_id (int): The user's ID.
+            conversation_id (int): The conversation's ID.
+            title (str): The new title of the conversation.
+
+        Returns:
+            None
+        """
+        conversation_id = int(conversation_id)
+
+        with self._lock:
+            self._generation += 1
+            conversations = self._conversations.get(user_id)
+            if conversations is not None:
+                self._conversations[user_id] = [(cid, title if cid == conversation_id else old_title)
+                                                for cid, old_title in conversations]
+
+    def remove(self, user_id: int, conversation_id: int) -> None:
+        """
+        Removes a conversation from a user's cached list, if it is cached.
+
+        Args:
+            user_id (int): The user's ID.
+            conversation_id (int): The conversation's ID.
+
+        Returns:
+            None
+        """
+        conversation_id = int(conversation_id)
+
+        with self._lock:
+            self._generation += 1
+            conversations = self._conversations.get(user_id)
+            if conversations is not None:
+                self._conversations[user_id] = [(cid, title) for cid, title in conversations
+                                                if cid != conversation_id]
+
+    def invalidate(self, user_id: int) -> None:
+        """
+        Drops a user's cached list.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._generation += 1
+            self._conversations.pop(int(user_id), None)
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Gets the cache's counters.
+
+        Returns:
+            dict: The number of cached users, hits and misses ("size", "hits" and "misses" keys).
+        """
+        with self._lock:
+            return {
+                "size": len(self._conversations),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+
+class HistoryBuffer:
+    """
+    Size-bounded, in-memory buffer of the most recent messages of each active conversation.
+
+    A conversation's buffer is filled when the conversation is loaded and appended to as messages are added,
+    so that its history only has to be read from the database when the conversation is cold.
+    Buffers are dropped when idle for too long, when the conversation is left, or (least recently used first)
+    when the total buffered text exceeds the memory cap.
+    """
+
+    def __init__(self, capacity: int, max_chars: int, idle_timeout: float) -> None:
+        self.capacity = capacity
+        self._max_chars = max_chars
+        self._idle_timeout = idle_timeout
+        self._buffers = OrderedDict()       # conversation_id -> [user_id, deque of messages, last access time]
+        self._total_chars = 0
+        self._lock = threading.Lock()
+        self._generation = 0                # Incremented on every modification, to detect lists loaded before it
+        self._appending = {}                # conversation_id -> number of appends whose write is in progress
+
+    def get(self, user_id: int, conversation_id: int) -> list[dict[str, str]] | None:
+        """
+        Gets the buffered messages of a conversation.
+
+        Args:
+            user_id (int): The user's ID.
+            conversation_id (int): The conversation's ID.
+
+        Returns:
+            list or None: The most recent messages, oldest first. None if the conversation is not buffered.
+        """
+        conversation_id = int(conversation_id)
+
+        with self._lock:
+            self._evict_idle()
+
+            entry = self._buffers.get(conversation_id)
+            if entry is None or entry[0] != int(user_id):
+                return None
+
+            entry[2] = time.monotonic()
+            self._buffers.move_to_end(conversation_id)
+
+            return list(entry[1])
+
+    def get_generation(self) -> int:
+        """
+        Gets the buffer's modification counter. Read before loading messages from the database and passed to put().
+
+        Returns:
+            int: The modification counter.
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, user_id: int, conversation_id: int, messages: list[dict[str, str]], generation: int) -> None:
+        """
+        Fills a conversation's buffer with its most recent messages, replacing any buffered ones.
+        The messages are discarded if the buffer was modified since `generation`, or a message of the conversation
+        is being added, as they may be stale.
+
+        Args:
+            user_id (int): The user's ID.
+            conversation_id (int): The conversation's ID.
+            messages (list): The conversation's messages, oldest first.
+            generation (int): The value of get_generation() before the messages were loaded.
+
+        Returns:
+            None
+        """
+        conversation_id = int(conversation_id)
+
+        with self._lock:
+            if generation != self._generation or conversation_id in self._appending:
+                return
+
+            self._remove(conversation_id)
+
+            buffered_messages = deque(messages[-self.capacity:], maxlen=self.capacity)
+            self._buffers[conversation_id] = [int(user_id), buffered_messages, time.monotonic()]
+            self._total_chars += sum(len(message["content"]) for message in buffered_messages)
+
+            self._evict_idle()
+            self._evict_over_capacity()
+
+    def begin_append(self, conversation_id: int) -> None:
+        """
+        Marks messages of a conversation as being written to the database. Until end_append() is called,
+        the conversation's buffer is not filled by put(), as the messages loaded may or may not include them.
+
+        Args:
+            conversation_id (int): The conversation's ID.
+
+        Returns:
+            None
+        """
+        conversation_id = int(conversation_id)
+
+        with self._lock:
+            self._generation += 1
+            self._appending[conversation_id] = self._appending.get(conversation_id, 0) + 1
+
+    def end_append(self, user_id: int, conversation_id: int, messages: list[dict[str, str]]) -> None:
+        """
+        Appends the messages written since begin_append() to a conversation's buffer, if the conversation is buffered.
+
+        Args:
+            user_id (int): The user's ID.
+            conversation_id (int): The conversation's ID.
+            messages (list): The messages written, with "role" and "content" keys, oldest first.
+                             Empty if the write failed.
+
+        Returns:
+            None
+        """
+        conversation_id = int(conversation_id)
+
+        with self._lock:
+            self._generation += 1
+
+            appending = self._appending.pop(conversation_id, 1) - 1
+            if appending:
+                self._appending[conversation_id] = appending
+
+            entry = self._buffers.get(conversation_id)
+            if entry is None or entry[0] != int(user_id) or not messages:
+                return
+
+            buffered_messages = entry[1]
+            for message in messages:
+                if len(buffered_messages) == buffered_messages.maxlen:
+                    self._total_chars -= len(buffered_messages[0]["content"])
+
+                buffered_messages.append(message)
+                self._total_chars += len(message["content"])
+
+            entry[2] = time.monotonic()
+            self._buffers.move_to_end(conversation_id)
+
+            self._evict_over_capacity()
+
+    def evict(self, conversation_id: int) -> None:
+        """
+        Drops a conversation's buffer.
+
+        Args:
+            conversation_id (int): The conversation's ID.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._generation += 1
+            self._remove(int(conversation_id))
+
+    def evict_user(self, user_id: int) -> None:
+        """
+        Drops the buffers of all of a user's conversations.
+
+        Args:
+            user_id (int): The user's ID.
+
+        Returns:
+            None
+        """
+        user_id = int(user_id)
+
+        with self._lock:
+            self._generation += 1
+            for conversation_id in [cid for cid, entry in self._buffers.items() if entry[0] == user_id]:
+                self._remove(conversation_id)
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Gets the buffer's gauges.
+
+        Returns:
+            dict: The number of buffered conversations and characters ("conversations" and "chars" keys).
+        """
+        with self._lock:
+            return {
+                "conversations": len(self._buffers),
+                "chars": self._total_chars
+            }
+
+    def _remove(self, conversation_id: int) -> None:
+        entry = self._buffers.pop(conversation_id, None)
+        if entry is not None:
+            self._total_chars -= sum(len(message["content"]) for message in entry[1])
+
+    def _evict_idle(self) -> None:
+        # Buffers are ordered by last access, so idle ones are at the front
+        now = time.monotonic()
+        while self._buffers:
+            conversation_id, entry = next(iter(self._buffers.items()))
+            if now - entry[2] <= self._idle_timeout:
+                break
+            self._remove(conversation_id)
+
+    def _evict_over_capacity(self) -> None:
+        while self._total_chars > self._max_chars and self._buffers:
+            self._remove(next(iter(self._buffers)))
+
+
+whitelist_cache = WhitelistCache()
+conversation_cache = ConversationCache(CONVERSATION_CACHE_SIZE)
+history_buffer = HistoryBuffer(HISTORY_BUFFER_SIZE, HISTORY_BUFFER_MAX_CHARS, HISTORY_BUFFER_IDLE_TIMEOUT)
@@ -1,20 +1,130 @@
-from os import getenv
+from collections.abc import Iterator
+from contextlib import contextmanager
+import logging
+import threading
 
-from dotenv import load_dotenv
 import sqlite3
 
+from config.settings import Settings, get_settings
+
+CACHED_STATEMENTS = 256         # Size of each connection's prepared statement cache
+
+logger = logging.getLogger(__name__)
+
+# Path to the database file, set once by initialize_connector()
+_db_path = None
+
+# Each thread keeps one long-lived connection for the lifetime of the process
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+
+def initialize_connector(settings: Settings) -> None:
+    """
+    Configures the database connector with the application settings.
+
+    Args:
+        settings (Settings): The application settings.
+
+    Returns:
+        None
+    """
+    global _db_path
+    _db_path = settings.db_path
+
 
 def connect_to_database() -> sqlite3.Connection:
     """
-    Connects to the database. Creates the database if it doesn't exist.
+    Returns the calling thread's connection to the database, opening it on first use.
+    Creates the database if it doesn't exist.
 
     Returns:
         sqlite3.Connection: The connection object.
     """
-    load_dotenv()
-    DB_PATH = getenv('DB_PATH')
+    conn = getattr(_local, 'conn', None)
+
+    if conn is None:
+        if _db_path is None:
+            initialize_connector(get_settings())
+
+        # check_same_thread is disabled so that close_all_connections() can close
+        # connections owned by other threads on shutdown
+        conn = sqlite3.connect(_db_path,
+                               check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+
+        # Foreign keys (and their ON DELETE CASCADE actions) are enforced per connection
+        conn.execute("PRAGMA foreign_keys = ON")
+
+        _local.conn = conn
 
-    return sqlite3.connect(DB_PATH)
+        with _connections_lock:
+            _connections.append(conn)
+
+    return conn
+
+
+def close_all_connections() -> None:
+    """
+    Closes every connection opened by connect_to_database(). Called on shutdown.
+
+    Returns:
+        None
+    """
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+
+    # Only called on shutdown, so no other thread should use its closed connection
+    _local.conn = None
+
+
+def in_transaction() -> bool:
+    """
+    Checks if the calling thread is inside a transaction() block.
+
+    Returns:
+        bool: True if a transaction is open, False otherwise.
+    """
+    return getattr(_local, 'transaction_depth', 0) > 0
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """
+    Groups several queries into a single all-or-nothing commit.
+
+    Queries executed inside the block are committed together when the outermost block exits,
+    or rolled back together if an exception escapes it. Nested blocks join the outer transaction.
+
+    Yields:
+        sqlite3.Connection: The connection the transaction runs on.
+    """
+    conn = connect_to_database()
+    depth = getattr(_local, 'transaction_depth', 0)
+
+    # Begin explicitly, as sqlite3 only opens implicit transactions before DML statements
+    if depth == 0 and not conn.in_transaction:
+        conn.execute("BEGIN")
+
+    _local.transaction_depth = depth + 1
+
+    try:
+        yield conn
+    except BaseException:
+        if depth == 0:
+            conn.rollback()
+        raise
+    else:
+        if depth == 0:
+            conn.commit()
+    finally:
+        _local.transaction_depth = depth
 
 
 def execute_query(query: str,
@@ -32,6 +142,9 @@ def execute_query(query: str,
 
     Returns:
          list: A list of tuples containing the query results if fetch=True.
+
+    Raises:
+        sqlite3.Error: If the query fails inside a transaction() block.
     """
     conn = connect_to_database()
     cursor = conn.cursor()
@@ -42,7 +155,8 @@ def execute_query(query: str,
         else:
             cursor.execute(query)
 
-        conn.commit()
+        if not in_transaction():
+            conn.commit()
 
         if fetch:
             return cursor.fetchall()
@@ -52,8 +166,48 @@ def execute_query(query: str,
             return None
 
     except sqlite3.Error as e:
-        # TODO: Log error
+        # Let transaction() roll back the whole unit of work
+        if in_transaction():
+            raise
+
+        logger.error(f'Error executing query: {str(e)}')
+        conn.rollback()
         return None
 
     finally:
-        conn.close()
+        cursor.close()
+
+
+def execute_many(query: str, params_seq: list[tuple]) -> None:
+    """
+    Executes a SQL query once for each set of parameters, committing once at the end.
+
+    Args:
+        query (str): The SQL query.
+        params_seq (list[tuple]): The parameters to bind to each execution of the query.
+
+    Returns:
+        None
+
+    Raises:
+        sqlite3.Error: If the query fails inside a transaction() block.
+    """
+    conn = connect_to_database()
+    cursor = conn.cursor()
+
+    try:
+        cursor.executemany(query, params_seq)
+
+        if not in_transaction():
+            conn.commit()
+
+    except sqlite3.Error as e:
+        # Let transaction() roll back the whole unit of work
+        if in_transaction():
+            raise
+
+        logger.error(f'Error executing batched query: {str(e)}')
+        conn.rollback()
+
+    finally:
+        cursor.close()
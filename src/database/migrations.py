@@ -0,0 +1,77 @@
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass
+import time
+
+from database.db_connector import execute_query, transaction
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    A single schema migration step.
+
+    Steps are applied in ascending version order and must be idempotent (e.g. CREATE ... IF NOT EXISTS),
+    so that a step interrupted before its version is recorded can safely be re-run.
+    """
+    version: int
+    description: str
+    apply: Callable[[], None]
+
+
+def get_schema_version() -> int:
+    """
+    Gets the schema version stored in the database file.
+
+    Returns:
+        int: The value of PRAGMA user_version.
+    """
+    return execute_query("PRAGMA user_version", fetch=True)[0][0]
+
+
+def set_schema_version(version: int) -> None:
+    """
+    Sets the schema version stored in the database file.
+
+    Args:
+        version (int): The new schema version.
+
+    Returns:
+        None
+    """
+    # PRAGMA does not accept bound parameters
+    execute_query(f"PRAGMA user_version = {int(version)}")
+
+
+def run_migrations(migrations: list[Migration]) -> None:
+    """
+    Applies every migration newer than the database's schema version, in order.
+
+    Each step runs in a single transaction together with its version bump.
+
+    Args:
+        migrations (list[Migration]): The migration steps.
+
+    Returns:
+        None
+    """
+    current_version = get_schema_version()
+    pending = sorted((m for m in migrations if m.version > current_version), key=lambda m: m.version)
+
+    if not pending:
+        logger.info(f'Database schema is up to date (version {current_version}).')
+        return
+
+    for migration in pending:
+        logger.info(f'Applying migration {migration.version}: {migration.description}...')
+        start_time = time.perf_counter()
+
+        with transaction():
+            migration.apply()
+            set_schema_version(migration.version)
+
+        elapsed = time.perf_counter() - start_time
+        logger.info(f'Applied migration {migration.version} in {elapsed:.3f}s.')
+
@@ -1,24 +1,24 @@
 import logging
+import sqlite3
 
-from database.db_connector import execute_query
+from database.cache import conversation_cache, history_buffer, whitelist_cache
+from database.db_connector import execute_many, execute_query, transaction
+from database.migrations import Migration, run_migrations
+
+CHARS_PER_TOKEN = 4         # Rough estimate of characters per GPT token, used for history budgets
 
 logger = logging.getLogger(__name__)
 
 
 def initialize_db() -> None:
     """
-    Initializes the database by creating the necessary tables if they do not already exist.
+    Initializes the database by applying any pending schema migrations.
 
     Returns:
         None
     """
     try:
-        execute_query("PRAGMA foreign_keys = ON")
-
-        create_Whitelist_table()
-        create_User_table()
-        create_Conversation_table()
-        create_Message_table()
+        run_migrations(MIGRATIONS)
 
         logger.info('Successfully initialized database.')
     except Exception as e:
@@ -65,14 +65,24 @@ def add_whitelist_user(user_id: int) -> None:
         WHERE NOT EXISTS (SELECT 1 FROM Whitelist WHERE user_id = ?)
     """
     params = (user_id, user_id)
-    execute_query(query, params)
+
+    # Inside a transaction, a failed insert raises instead of being swallowed, so the cache stays in sync
+    try:
+        with transaction():
+            execute_query(query, params)
+    except sqlite3.Error as e:
+        logger.error(f'Error adding user {user_id} to Whitelist: {str(e)}')
+        return
+
+    whitelist_cache.add(user_id)
 
     logger.debug(f'Successfully added user {user_id} to Whitelist.')
 
 
 def remove_whitelist_user(user_id: int) -> None:
     """
-    Removes a user from the 'Whitelist' table.
+    Removes a user from the 'Whitelist' table, together with the user's saved session. The user's entry
+    in the 'User' table, conversations and messages are deleted by ON DELETE CASCADE.
 
     Args:
         user_id (int): The user's ID.
@@ -82,27 +92,36 @@ def remove_whitelist_user(user_id: int) -> None:
     """
     logger.debug(f'Removing user {user_id} from Whitelist...')
 
-    # Manual ON DELETE CASCADE
-    remove_user(user_id)
-
     query = """
         DELETE FROM Whitelist
         WHERE user_id = ?
     """
     params = (user_id,)
-    execute_query(query, params)
+
+    # Inside a transaction, a failed delete raises instead of being swallowed, so the caches stay in sync
+    try:
+        with transaction():
+            execute_query(query, params)
+            execute_query("DELETE FROM Session WHERE user_id = ?", params)
+    except sqlite3.Error as e:
+        logger.error(f'Error removing user {user_id} from Whitelist: {str(e)}')
+        return
+
+    whitelist_cache.remove(user_id)
+    conversation_cache.invalidate(user_id)
+    history_buffer.evict_user(user_id)
 
     logger.debug(f'Successfully removed user {user_id} from Whitelist.')
 
 
-def get_whitelisted_user_ids() -> list:
+def load_whitelisted_user_ids() -> list[int]:
     """
-    Get all whitelisted users.
+    Loads all whitelisted user IDs from the 'Whitelist' table, bypassing the whitelist cache.
 
     Returns:
-        list: A list of all whitelisted users.
+        list[int]: A list of all whitelisted user IDs.
     """
-    logger.debug('Retrieving whitelisted user IDs...')
+    logger.debug('Loading whitelisted user IDs...')
 
     query = """
         SELECT user_id
@@ -110,14 +129,26 @@ def get_whitelisted_user_ids() -> list:
     """
     whitelisted_users = execute_query(query, fetch=True)
 
-    logger.debug('Successfully retrieved all whitelisted user IDs.')
+    logger.debug('Successfully loaded all whitelisted user IDs.')
+
+    return [user_id for (user_id,) in whitelisted_users]
 
-    return whitelisted_users
+
+def get_whitelisted_user_ids() -> list[int]:
+    """
+    Get all whitelisted users. Served from the whitelist cache, which is loaded on first use.
+
+    Returns:
+        list[int]: A list of all whitelisted user IDs.
+    """
+    whitelist_cache.ensure_loaded(load_whitelisted_user_ids)
+
+    return whitelist_cache.get_all()
 
 
 def find_whitelisted_user(user_id: int) -> bool:
     """
-    Find a whitelisted user.
+    Find a whitelisted user. Served from the whitelist cache, which is loaded on first use.
 
     Args:
         user_id (int): The user's ID.
@@ -125,16 +156,8 @@ def find_whitelisted_user(user_id: int) -> bool:
     Returns:
         bool: True if the user is whitelisted, False otherwise.
     """
-    logger.debug(f'Finding if user {user_id} is whitelisted...')
-
-    query = """
-        SELECT 1
-        FROM Whitelist
-        WHERE user_id = ?
-    """
-    params = (user_id,)
-    whitelisted_user = execute_query(query, params, fetch=True)
-    whitelisted = bool(whitelisted_user)
+    whitelist_cache.ensure_loaded(load_whitelisted_user_ids)
+    whitelisted = whitelist_cache.contains(user_id)
 
     logger.debug(f"User {user_id} {'is' if whitelisted else 'is not'} whitelisted.")
 
@@ -190,7 +213,7 @@ def add_user(user_id: int, username: str) -> None:
 
 def remove_user(user_id: int) -> None:
     """
-    Removes a user from the 'User' table and deletes his conversations.
+    Removes a user from the 'User' table. The user's conversations and messages are deleted by ON DELETE CASCADE.
 
     Args:
         user_id (int): The user's ID.
@@ -200,9 +223,6 @@ def remove_user(user_id: int) -> None:
     """
     logger.debug(f'Removing user {user_id} from User table...')
 
-    # Manual ON DELETE CASCADE
-    delete_user_conversations(user_id)
-
     query = """
         DELETE FROM User
         WHERE user_id = ?
@@ -210,6 +230,9 @@ def remove_user(user_id: int) -> None:
     params = (user_id,)
     execute_query(query, params)
 
+    conversation_cache.invalidate(user_id)
+    history_buffer.evict_user(user_id)
+
     logger.debug(f'Successfully removed user {user_id} from User table.')
 ##################################################
 
@@ -237,6 +260,24 @@ def create_Conversation_table() -> None:
     logger.debug('Successfully created Conversation table.')
 
 
+def create_Conversation_indexes() -> None:
+    """
+    Creates the indexes on the 'Conversation' table, so that per-user lookups do not scan the table.
+
+    Returns:
+        None
+    """
+    logger.debug('Creating Conversation indexes...')
+
+    query = """
+        CREATE INDEX IF NOT EXISTS idx_Conversation_user_id
+        ON Conversation (user_id)
+    """
+    execute_query(query)
+
+    logger.debug('Successfully created Conversation indexes.')
+
+
 def add_conversation(user_id: int, title: str) -> int:
     """
     Adds a new conversation to the 'Conversation' table and returns the conversation ID.
@@ -246,7 +287,7 @@ def add_conversation(user_id: int, title: str) -> int:
         title (str): The title of the conversation.
 
     Returns:
-        int: The conversation ID.
+        int or None: The conversation ID. None if the conversation could not be added.
     """
     logger.debug(f'Adding conversation for user {user_id} to Conversation table...')
     
@@ -255,7 +296,16 @@ def add_conversation(user_id: int, title: str) -> int:
         VALUES (?, ?)
     """
     params = (user_id, title)
-    conversation_id = execute_query(query, params, fetch_lastrowid=True)
+
+    # Inside a transaction, a failed insert raises instead of being swallowed, so the cache stays in sync
+    try:
+        with transaction():
+            conversation_id = execute_query(query, params, fetch_lastrowid=True)
+    except sqlite3.Error as e:
+        logger.error(f'Error adding conversation for user {user_id} to Conversation table: {str(e)}')
+        return None
+
+    conversation_cache.add(user_id, conversation_id, title)
 
     logger.debug(f'Successfully added conversation {conversation_id} for user {user_id} to Conversation table.')
 
@@ -282,14 +332,63 @@ def edit_conversation(user_id: int, conversation_id: int, new_title: str) -> Non
         WHERE user_id = ? AND conversation_id = ?
     """
     params = (new_title, user_id, conversation_id)
-    execute_query(query, params)
+
+    try:
+        with transaction():
+            execute_query(query, params)
+    except sqlite3.Error as e:
+        logger.error(f'Error editing conversation {conversation_id} for user {user_id} in Conversation table: {str(e)}')
+        return
+
+    conversation_cache.rename(user_id, conversation_id, new_title)
 
     logger.debug(f'Successfully edited conversation {conversation_id} for user {user_id} in Conversation table.')
 
 
+def replace_provisional_title(user_id: int, conversation_id: int, provisional_title: str, new_title: str) -> bool:
+    """
+    Updates the title of a conversation in the 'Conversation' table, unless it is no longer the provisional title
+    (e.g. the user has renamed the conversation in the meantime).
+
+    Args:
+        user_id (int): The user's ID.
+        conversation_id (int): The conversation's ID.
+        provisional_title (str): The title the conversation was created with.
+        new_title (str): The new title of the conversation.
+
+    Returns:
+        bool: True if the title was updated, False otherwise.
+    """
+    logger.debug(f'Replacing provisional title of conversation {conversation_id} for user {user_id} in Conversation table...')
+
+    query = """
+        UPDATE Conversation
+        SET title = ?
+        WHERE user_id = ? AND conversation_id = ? AND title = ?
+    """
+    params = (new_title, user_id, conversation_id, provisional_title)
+
+    try:
+        with transaction() as conn:
+            updated = conn.execute(query, params).rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f'Error replacing provisional title of conversation {conversation_id} for user {user_id} in Conversation table: {str(e)}')
+        return False
+
+    if not updated:
+        logger.debug(f'Conversation {conversation_id} for user {user_id} no longer has its provisional title.')
+        return False
+
+    conversation_cache.rename(user_id, conversation_id, new_title)
+
+    logger.debug(f'Successfully replaced provisional title of conversation {conversation_id} for user {user_id} in Conversation table.')
+
+    return True
+
+
 def delete_conversation(user_id: int, conversation_id: int) -> None:
     """
-    Deletes a conversation and all associated messages from the 'Conversation' and 'Message' tables.
+    Deletes a conversation from the 'Conversation' table. Its messages are deleted by ON DELETE CASCADE.
 
     Args:
         user_id (int): The user's ID.
@@ -300,23 +399,28 @@ def delete_conversation(user_id: int, conversation_id: int) -> None:
     """
     logger.debug(f'Deleting conversation {conversation_id} for user {user_id} from Conversation table...')
 
-    # Manual ON DELETE CASCADE
-    delete_conversation_messages(user_id, conversation_id)
-
-    # Delete the conversation entry from the 'Conversation' table
     query = """
         DELETE FROM Conversation
         WHERE user_id = ? AND conversation_id = ?
     """
     params = (user_id, conversation_id)
-    execute_query(query, params)
+
+    try:
+        with transaction():
+            execute_query(query, params)
+    except sqlite3.Error as e:
+        logger.error(f'Error deleting conversation {conversation_id} for user {user_id} from Conversation table: {str(e)}')
+        return
+
+    conversation_cache.remove(user_id, conversation_id)
+    history_buffer.evict(conversation_id)
 
     logger.debug(f'Successfully deleted conversation {conversation_id} for user {user_id} from Conversation table.')
 
 
 def delete_user_conversations(user_id: int) -> None:
     """
-    Deletes all conversations for a user from the 'Conversation' table.
+    Deletes all conversations for a user from the 'Conversation' table. Their messages are deleted by ON DELETE CASCADE.
 
     Args:
         user_id (int): The user's ID.
@@ -326,9 +430,6 @@ def delete_user_conversations(user_id: int) -> None:
     """
     logger.debug(f'Deleting all conversations for user {user_id} from Conversation table...')
 
-    # Manual ON DELETE CASCADE
-    delete_user_messages(user_id)
-
     query = """
         DELETE FROM Conversation
         WHERE user_id = ?
@@ -336,19 +437,28 @@ def delete_user_conversations(user_id: int) -> None:
     params = (user_id,)
     execute_query(query, params)
 
+    conversation_cache.invalidate(user_id)
+    history_buffer.evict_user(user_id)
+
     logger.debug(f'Successfully deleted all conversations for user {user_id} from Conversation table.')
 
 
 def get_user_conversations(user_id: int) -> list:
     """
-    Gets conversations for a particular user.
+    Gets conversations for a particular user. Served from the conversation cache when possible.
 
     Args:
         user_id (int): The user's ID.
 
     Returns:
-        list: A list of all conversations for the user.
+        list: A list of all (conversation_id, title) pairs for the user.
     """
+    conversations = conversation_cache.get(user_id)
+    if conversations is not None:
+        return conversations
+
+    generation = conversation_cache.get_generation()
+
     logger.debug(f'Retrieving conversations for user {user_id} from Conversation table...')
 
     query = """
@@ -359,21 +469,30 @@ def get_user_conversations(user_id: int) -> list:
     params = (user_id,)
     conversations = execute_query(query, params, fetch=True)
 
+    if conversations is not None:
+        conversation_cache.put(user_id, conversations, generation)
+
     logger.debug(f'Successfully retrieved conversations for user {user_id} from Conversation table.')
 
     return conversations
 
 
-def get_conversation_title(conversation_id: int) -> str:
+def get_conversation_title(conversation_id: int, user_id: int | None = None) -> str:
     """
-    Get the title of a conversation.
+    Get the title of a conversation. Served from the conversation cache when the owner's ID is given.
 
     Args:
         conversation_id (int): The conversation's ID.
+        user_id (int or None, optional): The ID of the user who owns the conversation. Defaults to None.
 
     Returns:
         str: The title of the conversation.
     """
+    if user_id is not None:
+        for cached_conversation_id, title in get_user_conversations(user_id):
+            if cached_conversation_id == int(conversation_id):
+                return title
+
     logger.debug(f'Retrieving title for conversation {conversation_id} from Conversation table...')
 
     query = """
@@ -417,6 +536,32 @@ def create_Message_table() -> None:
     logger.debug('Successfully created Message table.')
 
 
+def create_Message_indexes() -> None:
+    """
+    Creates the indexes on the 'Message' table, so that per-user and per-conversation lookups
+    (including their ORDER BY timestamp) and foreign key checks on deleted conversations
+    do not scan the table.
+
+    Returns:
+        None
+    """
+    logger.debug('Creating Message indexes...')
+
+    query = """
+        CREATE INDEX IF NOT EXISTS idx_Message_user_id_conversation_id_timestamp
+        ON Message (user_id, conversation_id, timestamp)
+    """
+    execute_query(query)
+
+    query = """
+        CREATE INDEX IF NOT EXISTS idx_Message_conversation_id
+        ON Message (conversation_id)
+    """
+    execute_query(query)
+
+    logger.debug('Successfully created Message indexes.')
+
+
 def add_message(user_id: int, conversation_id: int, message_role: str, message_content: str) -> None:
     """
     Adds a new message to the 'Message' table.
@@ -437,33 +582,169 @@ def add_message(user_id: int, conversation_id: int, message_role: str, message_c
         VALUES (?, ?, ?, ?)
     """
     params = (user_id, conversation_id, message_role, message_content)
-    execute_query(query, params)
+
+    # Inside a transaction, a failed insert raises instead of being swallowed, so the history buffer stays in sync
+    history_buffer.begin_append(conversation_id)
+    added = []
+    try:
+        with transaction():
+            execute_query(query, params)
+        added = [{"role": message_role, "content": message_content}]
+    except sqlite3.Error as e:
+        logger.error(f'Error adding message to conversation {conversation_id} for user {user_id} in Message table: {str(e)}')
+        return
+    finally:
+        history_buffer.end_append(user_id, conversation_id, added)
 
     logger.debug(f'Successfully added message to conversation {conversation_id} for user {user_id} in Message table.')
 
 
-def get_past_messages(user_id: int, conversation_id: int) -> list[dict[str, str]]:
+def add_messages(user_id: int, conversation_id: int, messages: list[tuple[str, str]]) -> None:
     """
-    Get the all of the past messages from the 'Message' table for a given conversation.
+    Adds several messages to the 'Message' table in a single commit.
+
+    Args:
+        user_id (int): The user's ID.
+        conversation_id (int): The conversation's ID associated with the messages.
+        messages (list[tuple[str, str]]): The (message_role, message_content) pairs to add, in order.
+
+    Returns:
+        None
+    """
+    logger.debug(f'Adding {len(messages)} messages to conversation {conversation_id} for user {user_id} in Message table...')
+
+    query = """
+        INSERT INTO Message (user_id, conversation_id, message_role, message_content)
+        VALUES (?, ?, ?, ?)
+    """
+    params_seq = [(user_id, conversation_id, message_role, message_content)
+                  for message_role, message_content in messages]
+
+    history_buffer.begin_append(conversation_id)
+    added = []
+    try:
+        with transaction():
+            execute_many(query, params_seq)
+        added = [{"role": message_role, "content": message_content} for message_role, message_content in messages]
+    except sqlite3.Error as e:
+        logger.error(f'Error adding {len(messages)} messages to conversation {conversation_id} for user {user_id} in Message table: {str(e)}')
+        return
+    finally:
+        history_buffer.end_append(user_id, conversation_id, added)
+
+    logger.debug(f'Successfully added {len(messages)} messages to conversation {conversation_id} for user {user_id} in Message table.')
+
+
+def get_past_messages(user_id: int,
+                      conversation_id: int,
+                      max_messages: int | None = None,
+                      max_tokens: int | None = None) -> list[dict[str, str]]:
+    """
+    Get the most recent messages for a given conversation, within a history window.
+
+    Windows of up to HISTORY_BUFFER_SIZE messages are served from the conversation's in-memory history buffer,
+    which is filled from the 'Message' table only when the conversation is cold.
+    Larger windows are read from the 'Message' table directly.
 
     Args:
         user_id (int): The user's ID.
         conversation_id (int): The conversation's ID.
+        max_messages (int or None, optional): The maximum number of messages to return. Defaults to None (no limit).
+        max_tokens (int or None, optional): The estimated token budget of the returned messages. Defaults to None (no limit).
 
     Returns:
-        list: A list of the most recent ten messages.
+        list: A list of the most recent messages within the window, oldest first.
+    """
+    if max_messages is None or max_messages > history_buffer.capacity:
+        return select_past_messages(user_id, conversation_id, max_messages, max_tokens)
+
+    messages = history_buffer.get(user_id, conversation_id)
+
+    if messages is None:
+        generation = history_buffer.get_generation()
+        messages = select_past_messages(user_id, conversation_id, max_messages=history_buffer.capacity)
+        history_buffer.put(user_id, conversation_id, messages, generation)
+
+    return apply_history_window(messages, max_messages, max_tokens)
+
+
+def apply_history_window(messages: list[dict[str, str]],
+                         max_messages: int | None,
+                         max_tokens: int | None) -> list[dict[str, str]]:
     """
-    logger.debug(f'Retrieving past ten messages for conversation {conversation_id} for user {user_id} from Message table...')
+    Trims messages to a history window, the same way select_past_messages() does in SQL.
+
+    Args:
+        messages (list): The messages, oldest first.
+        max_messages (int or None): The maximum number of messages to keep. None for no limit.
+        max_tokens (int or None): The estimated token budget of the kept messages. None for no limit.
+
+    Returns:
+        list: The most recent messages within the window, oldest first.
+    """
+    if max_messages is not None:
+        messages = messages[-max_messages:] if max_messages > 0 else []
+
+    if max_tokens is None:
+        return messages
+
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    running_chars = 0
+    start = len(messages)
+
+    for i in range(len(messages) - 1, -1, -1):
+        running_chars += len(messages[i]["content"])
+        if running_chars > max_chars:
+            break
+        start = i
+
+    return messages[start:]
+
+
+def select_past_messages(user_id: int,
+                         conversation_id: int,
+                         max_messages: int | None = None,
+                         max_tokens: int | None = None) -> list[dict[str, str]]:
+    """
+    Get the most recent messages from the 'Message' table for a given conversation, within a history window.
+
+    The window is resolved in SQL: the newest `max_messages` messages are taken, then trimmed to the longest
+    suffix whose estimated token count fits `max_tokens`.
+
+    Args:
+        user_id (int): The user's ID.
+        conversation_id (int): The conversation's ID.
+        max_messages (int or None, optional): The maximum number of messages to return. Defaults to None (no limit).
+        max_tokens (int or None, optional): The estimated token budget of the returned messages. Defaults to None (no limit).
+
+    Returns:
+        list: A list of the most recent messages within the window, oldest first.
+    """
+    logger.debug(f'Retrieving past messages for conversation {conversation_id} for user {user_id} from Message table...')
+
+    # Negative values disable the corresponding limit
+    limit = max_messages if max_messages is not None else -1
+    max_chars = max_tokens * CHARS_PER_TOKEN if max_tokens is not None else -1
+
     query = """
         SELECT message_role, message_content
-        FROM Message
-        WHERE user_id = ? AND conversation_id = ?
-        ORDER BY timestamp
+        FROM (
+            SELECT message_id, timestamp, message_role, message_content,
+                   SUM(LENGTH(message_content)) OVER (
+                       ORDER BY timestamp DESC, message_id DESC
+                   ) AS running_chars
+            FROM Message
+            WHERE user_id = ? AND conversation_id = ?
+            ORDER BY timestamp DESC, message_id DESC
+            LIMIT ?
+        )
+        WHERE ? < 0 OR running_chars <= ?
+        ORDER BY timestamp, message_id
     """
-    params = (user_id, conversation_id)
+    params = (user_id, conversation_id, limit, max_chars, max_chars)
     messages = execute_query(query, params, fetch=True)
 
-    logger.debug(f'Successfully retrieved past messages for conversation {conversation_id} for user {user_id} from Message table.')
+    logger.debug(f'Successfully retrieved {len(messages)} past messages for conversation {conversation_id} for user {user_id} from Message table.')
 
     messages_list = []
     for message in messages:
@@ -475,9 +756,56 @@ def get_past_messages(user_id: int, conversation_id: int) -> list[dict[str, str]
     return messages_list
 
 
+def get_unsummarized_messages(user_id: int,
+                              conversation_id: int,
+                              after_message_id: int,
+                              keep_recent: int) -> list[dict]:
+    """
+    Get the messages of a conversation that are newer than its summary but older than the most recent ones.
+
+    Args:
+        user_id (int): The user's ID.
+        conversation_id (int): The conversation's ID.
+        after_message_id (int): The ID of the newest message already folded into the summary.
+        keep_recent (int): The number of most recent messages to leave out.
+
+    Returns:
+        list: A list of messages ("message_id", "role" and "content" keys), oldest first.
+    """
+    logger.debug(f'Retrieving unsummarized messages for conversation {conversation_id} for user {user_id} from Message table...')
+
+    query = """
+        SELECT message_id, message_role, message_content
+        FROM Message
+        WHERE user_id = ? AND conversation_id = ? AND message_id > ?
+            AND message_id NOT IN (
+                SELECT message_id
+                FROM Message
+                WHERE user_id = ? AND conversation_id = ?
+                ORDER BY timestamp DESC, message_id DESC
+                LIMIT ?
+            )
+        ORDER BY timestamp, message_id
+    """
+    params = (user_id, conversation_id, after_message_id, user_id, conversation_id, keep_recent)
+    messages = execute_query(query, params, fetch=True)
+
+    logger.debug(f'Successfully retrieved {len(messages)} unsummarized messages for conversation {conversation_id} for user {user_id} from Message table.')
+
+    messages_list = []
+    for message in messages:
+        messages_list.append({
+            "message_id": message[0],
+            "role": message[1],
+            "content": message[2]
+        })
+
+    return messages_list
+
+
 def get_conversation_messages(user_id: int, conversation_id: int) -> list[dict[str, str]]:
     """
-    Get all messages for a conversation from the 'Message' table.
+    Get all messages for a conversation from the 'Message' table, and fill the conversation's history buffer.
 
     Args:
         user_id (int): The user's ID.
@@ -492,9 +820,10 @@ def get_conversation_messages(user_id: int, conversation_id: int) -> list[dict[s
         SELECT message_role, message_content
         FROM Message
         WHERE user_id = ? AND conversation_id = ?
-        ORDER BY timestamp
+        ORDER BY timestamp, message_id
     """
     params = (user_id, conversation_id)
+    generation = history_buffer.get_generation()
     messages = execute_query(query, params, fetch=True)
 
     logger.debug(f'Successfully retrieved all messages for conversation {conversation_id} for user {user_id} from Message table.')
@@ -506,9 +835,25 @@ def get_conversation_messages(user_id: int, conversation_id: int) -> list[dict[s
             "content": message[1]
         })
 
+    # Warm the history buffer for the conversation being loaded
+    history_buffer.put(user_id, conversation_id, messages_list, generation)
+
     return messages_list
 
 
+def evict_conversation_history(conversation_id: int) -> None:
+    """
+    Drops a conversation's in-memory history buffer, e.g. when the user leaves the conversation.
+
+    Args:
+        conversation_id (int): The conversation's ID.
+
+    Returns:
+        None
+    """
+    history_buffer.evict(conversation_id)
+
+
 def delete_conversation_messages(user_id: int, conversation_id: int) -> None:
     """
     Deletes all messages for a conversation from the 'Message' table.
@@ -529,6 +874,8 @@ def delete_conversation_messages(user_id: int, conversation_id: int) -> None:
     params = (user_id, conversation_id)
     execute_query(query, params)
 
+    history_buffer.evict(conversation_id)
+
     logger.debug(f'Successfully deleted all messages for conversation {conversation_id} for user {user_id} from Message table.')
 
 
@@ -551,5 +898,434 @@ def delete_user_messages(user_id: int) -> None:
     params = (user_id,)
     execute_query(query, params)
 
+    history_buffer.evict_user(user_id)
+
     logger.debug(f'Successfully deleted all messages for user {user_id} from Message table.')
 ##################################################
+
+##################################################
+# Operations on 'ConversationSummary' table
+def create_ConversationSummary_table() -> None:
+    """
+    Creates the 'ConversationSummary' table in the database.
+
+    Returns:
+        None
+    """
+    logger.debug('Creating ConversationSummary table...')
+
+    query = """
+        CREATE TABLE IF NOT EXISTS ConversationSummary (
+            conversation_id INTEGER PRIMARY KEY,
+            summary TEXT,
+            last_message_id INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES Conversation (conversation_id) ON DELETE CASCADE
+        )
+    """
+    execute_query(query)
+
+    logger.debug('Successfully created ConversationSummary table.')
+
+
+def get_conversation_summary(conversation_id: int) -> dict | None:
+    """
+    Gets the stored summary of a conversation.
+
+    Args:
+        conversation_id (int): The conversation's ID.
+
+    Returns:
+        dict or None: The summary and the ID of the newest message folded into it
+                      ("summary" and "last_message_id" keys). None if the conversation has no summary.
+    """
+    logger.debug(f'Retrieving summary for conversation {conversation_id} from ConversationSummary table...')
+
+    query = """
+        SELECT summary, last_message_id
+        FROM ConversationSummary
+        WHERE conversation_id = ?
+    """
+    params = (conversation_id,)
+    rows = execute_query(query, params, fetch=True)
+
+    logger.debug(f'Successfully retrieved summary for conversation {conversation_id} from ConversationSummary table.')
+
+    if not rows:
+        return None
+
+    return {
+        "summary": rows[0][0],
+        "last_message_id": rows[0][1]
+    }
+
+
+def set_conversation_summary(conversation_id: int, summary: str, last_message_id: int) -> None:
+    """
+    Creates or replaces the stored summary of a conversation.
+
+    Args:
+        conversation_id (int): The conversation's ID.
+        summary (str): The summary of the conversation.
+        last_message_id (int): The ID of the newest message folded into the summary.
+
+    Returns:
+        None
+    """
+    logger.debug(f'Saving summary for conversation {conversation_id} to ConversationSummary table...')
+
+    query = """
+        INSERT INTO ConversationSummary (conversation_id, summary, last_message_id)
+        VALUES (?, ?, ?)
+        ON CONFLICT (conversation_id) DO UPDATE SET
+            summary = excluded.summary,
+            last_message_id = excluded.last_message_id,
+            updated_at = CURRENT_TIMESTAMP
+    """
+    params = (conversation_id, summary, last_message_id)
+    execute_query(query, params)
+
+    logger.debug(f'Successfully saved summary for conversation {conversation_id} to ConversationSummary table.')
+##################################################
+
+##################################################
+# Operations on 'Session' table
+def create_Session_table() -> None:
+    """
+    Creates the 'Session' table in the database.
+
+    Returns:
+        None
+    """
+    logger.debug('Creating Session table...')
+
+    query = """
+        CREATE TABLE IF NOT EXISTS Session (
+            user_id INTEGER PRIMARY KEY,
+            state INTEGER NOT NULL,
+            conversation_id INTEGER,
+            message_ids BLOB NOT NULL,
+            last_activity REAL,
+            temp_data TEXT,
+            FOREIGN KEY (conversation_id) REFERENCES Conversation (conversation_id) ON DELETE SET NULL
+        )
+    """
+    execute_query(query)
+
+    logger.debug('Successfully created Session table.')
+
+
+def add_Session_message_times_column() -> None:
+    """
+    Adds the 'message_times' column, holding the time each tracked message ID was added, to the 'Session' table.
+
+    Returns:
+        None
+    """
+    logger.debug('Adding message_times column to Session table...')
+
+    # ALTER TABLE ... ADD COLUMN cannot be made idempotent in SQL
+    columns = [column[1] for column in execute_query("PRAGMA table_info(Session)", fetch=True)]
+    if 'message_times' not in columns:
+        execute_query("ALTER TABLE Session ADD COLUMN message_times BLOB")
+
+    logger.debug('Successfully added message_times column to Session table.')
+
+
+def create_Session_conversation_id_index() -> None:
+    """
+    Indexes the 'Session' table by conversation, so that deleting a conversation finds the sessions
+    referencing it (ON DELETE SET NULL) without scanning the table.
+
+    Returns:
+        None
+    """
+    logger.debug('Creating Session conversation_id index...')
+
+    execute_query("CREATE INDEX IF NOT EXISTS idx_Session_conversation_id ON Session (conversation_id)")
+
+    logger.debug('Successfully created Session conversation_id index.')
+
+
+def get_session(user_id: int) -> dict | None:
+    """
+    Gets the saved session of a user.
+
+    Args:
+        user_id (int): The user's ID.
+
+    Returns:
+        dict or None: The saved session ("state", "conversation_id", "message_ids", "message_times",
+                      "last_activity" and "temp_data" keys), as stored. None if the user has no saved session.
+    """
+    logger.debug(f'Retrieving session for user {user_id} from Session table...')
+
+    query = """
+        SELECT state, conversation_id, message_ids, message_times, last_activity, temp_data
+        FROM Session
+        WHERE user_id = ?
+    """
+    params = (user_id,)
+    rows = execute_query(query, params, fetch=True)
+
+    logger.debug(f'Successfully retrieved session for user {user_id} from Session table.')
+
+    if not rows:
+        return None
+
+    return {
+        "state": rows[0][0],
+        "conversation_id": rows[0][1],
+        "message_ids": rows[0][2],
+        "message_times": rows[0][3],
+        "last_activity": rows[0][4],
+        "temp_data": rows[0][5]
+    }
+
+
+def get_active_sessions(idle_state: int) -> list[tuple[int, float]]:
+    """
+    Gets the users whose saved session is not idle.
+
+    Args:
+        idle_state (int): The stored value of the idle state.
+
+    Returns:
+        list[tuple[int, float]]: The (user_id, last_activity) pairs of the non-idle sessions.
+    """
+    logger.debug('Retrieving active sessions from Session table...')
+
+    query = """
+        SELECT user_id, last_activity
+        FROM Session
+        WHERE state != ? AND last_activity IS NOT NULL
+    """
+    params = (idle_state,)
+    rows = execute_query(query, params, fetch=True)
+
+    logger.debug('Successfully retrieved active sessions from Session table.')
+
+    return rows or []
+
+
+def delete_session(user_id: int) -> None:
+    """
+    Deletes the saved session of a user.
+
+    Args:
+        user_id (int): The user's ID.
+
+    Returns:
+        None
+    """
+    logger.debug(f'Deleting session for user {user_id} from Session table...')
+
+    query = """
+        DELETE FROM Session
+        WHERE user_id = ?
+    """
+    params = (user_id,)
+    execute_query(query, params)
+
+    logger.debug(f'Successfully deleted session for user {user_id} from Session table.')
+
+
+def save_sessions(sessions: list[tuple]) -> None:
+    """
+    Creates or replaces the saved sessions of several users in a single transaction.
+
+    Args:
+        sessions (list[tuple]): The (user_id, state, conversation_id, message_ids, message_times, last_activity,
+                                temp_data) rows.
+
+    Returns:
+        None
+    """
+    logger.debug(f'Saving {len(sessions)} sessions to Session table...')
+
+    query = """
+        INSERT INTO Session (user_id, state, conversation_id, message_ids, message_times, last_activity, temp_data)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            state = excluded.state,
+            conversation_id = excluded.conversation_id,
+            message_ids = excluded.message_ids,
+            message_times = excluded.message_times,
+            last_activity = excluded.last_activity,
+            temp_data = excluded.temp_data
+    """
+    # Raises on failure, so that the caller can retry the sessions later
+    with transaction():
+        execute_many(query, sessions)
+
+    logger.debug(f'Successfully saved {len(sessions)} sessions to Session table.')
+##################################################
+
+##################################################
+# Operations on 'ResponseCache' table
+def create_ResponseCache_table() -> None:
+    """
+    Creates the 'ResponseCache' table in the database.
+
+    Returns:
+        None
+    """
+    logger.debug('Creating ResponseCache table...')
+
+    query = """
+        CREATE TABLE IF NOT EXISTS ResponseCache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            latency REAL NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """
+    execute_query(query)
+
+    # Eviction deletes the oldest entries first
+    execute_query("CREATE INDEX IF NOT EXISTS idx_ResponseCache_created_at ON ResponseCache (created_at)")
+
+    logger.debug('Successfully created ResponseCache table.')
+
+
+def get_cached_response(cache_key: str, min_created_at: float) -> dict | None:
+    """
+    Gets a cached GPT response that has not expired.
+
+    Args:
+        cache_key (str): The key of the cached response.
+        min_created_at (float): The time.time() before which cached responses are expired.
+
+    Returns:
+        dict or None: The cached response, the number of completion tokens it took and the seconds it took
+                      to generate ("response", "completion_tokens" and "latency" keys). None if there is no
+                      such response or it has expired.
+    """
+    logger.debug(f'Retrieving cached response {cache_key} from ResponseCache table...')
+
+    query = """
+        SELECT response, completion_tokens, latency
+        FROM ResponseCache
+        WHERE cache_key = ? AND created_at >= ?
+    """
+    params = (cache_key, min_created_at)
+    rows = execute_query(query, params, fetch=True)
+
+    logger.debug(f'Successfully retrieved cached response {cache_key} from ResponseCache table.')
+
+    if not rows:
+        return None
+
+    return {
+        "response": rows[0][0],
+        "completion_tokens": rows[0][1],
+        "latency": rows[0][2]
+    }
+
+
+def set_cached_response(cache_key: str,
+                        model: str,
+                        response: str,
+                        completion_tokens: int,
+                        latency: float,
+                        created_at: float) -> None:
+    """
+    Creates or replaces a cached GPT response.
+
+    Args:
+        cache_key (str): The key of the cached response.
+        model (str): The GPT model that generated the response.
+        response (str): The response.
+        completion_tokens (int): The number of completion tokens the response took.
+        latency (float): The seconds the response took to generate.
+        created_at (float): The time.time() at which the response was generated.
+
+    Returns:
+        None
+    """
+    logger.debug(f'Saving cached response {cache_key} to ResponseCache table...')
+
+    query = """
+        INSERT INTO ResponseCache (cache_key, model, response, completion_tokens, latency, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (cache_key) DO UPDATE SET
+            model = excluded.model,
+            response = excluded.response,
+            completion_tokens = excluded.completion_tokens,
+            latency = excluded.latency,
+            created_at = excluded.created_at
+    """
+    params = (cache_key, model, response, completion_tokens, latency, created_at)
+    execute_query(query, params)
+
+    logger.debug(f'Successfully saved cached response {cache_key} to ResponseCache table.')
+
+
+def evict_cached_responses(min_created_at: float, max_entries: int) -> None:
+    """
+    Deletes the expired cached GPT responses, then the oldest ones beyond the size limit.
+
+    Args:
+        min_created_at (float): The time.time() before which cached responses are expired.
+        max_entries (int): The most cached responses to keep.
+
+    Returns:
+        None
+    """
+    logger.debug('Evicting cached responses from ResponseCache table...')
+
+    query = """
+        DELETE FROM ResponseCache
+        WHERE created_at < ?
+           OR cache_key IN (
+               SELECT cache_key
+               FROM ResponseCache
+               ORDER BY created_at DESC
+               LIMIT -1 OFFSET ?
+           )
+    """
+    params = (min_created_at, max_entries)
+    execute_query(query, params)
+
+    logger.debug('Successfully evicted cached responses from ResponseCache table.')
+##################################################
+
+##################################################
+# Schema migrations
+def create_tables() -> None:
+    """
+    Creates the 'Whitelist', 'User', 'Conversation' and 'Message' tables.
+
+    Returns:
+        None
+    """
+    create_Whitelist_table()
+    create_User_table()
+    create_Conversation_table()
+    create_Message_table()
+
+
+def create_indexes() -> None:
+    """
+    Creates the indexes on the 'Conversation' and 'Message' tables.
+
+    Returns:
+        None
+    """
+    create_Conversation_indexes()
+    create_Message_indexes()
+
+
+# Append new steps to the end. Never reorder or renumber existing steps.
+MIGRATIONS = [
+    Migration(1, 'Create Whitelist, User, Conversation and Message tables', create_tables),
+    Migration(2, 'Index Message and Conversation lookups', create_indexes),
+    Migration(3, 'Create ConversationSummary table', create_ConversationSummary_table),
+    Migration(4, 'Create Session table', create_Session_table),
+    Migration(5, 'Track when session message IDs were added', add_Session_message_times_column),
+    Migration(6, 'Create ResponseCache table', create_ResponseCache_table),
+    Migration(7, 'Index Session by conversation', create_Session_conversation_id_index),
+]
+##################################################
@@ -2,10 +2,15 @@
 import logging
 from threading import Thread
 
-from bot_core.bot_logic import bot, check_inactivity
-from bot_core.gpt_client import initialize_gpt_client
-from bot_core.utils import initialize_users_data
+from bot_core.bot_logic import bot, check_inactivity, checkpoint_sessions, initialize_bot
+from bot_core.gpt_client import initialize_gpt_client, shutdown_gpt_client
+from bot_core.rendering import render_cache
+import bot_core.workers as workers
+from bot_core.utils import get_session_stats, initialize_users_data, save_sessions
 from config.logging_config import setup_logging
+from config.settings import get_settings
+from database.cache import conversation_cache, history_buffer
+from database.db_connector import close_all_connections, initialize_connector
 from database.models import initialize_db
 
 
@@ -19,23 +24,45 @@ def main() -> None:
     Returns:
         None
     """
+    # Load settings once
+    settings = get_settings()
+
     # Setup loggers
-    setup_logging()
+    setup_logging(settings)
     logger = logging.getLogger(__name__)
 
-    # Initialize database, users' data, and GPT client
+    # Initialize database, users' data, GPT client and bot
+    initialize_connector(settings)
     initialize_db()
     initialize_users_data()
-    initialize_gpt_client()
-
-    # Bot is initialized in bot_logic
+    initialize_gpt_client(settings)
+    initialize_bot(settings)
 
     # Start inactivity checker in separate thread
     inactivity_thread = Thread(target=check_inactivity, daemon=True)
     inactivity_thread.start()
 
+    # Save modified sessions in separate thread
+    checkpoint_thread = Thread(target=checkpoint_sessions, daemon=True)
+    checkpoint_thread.start()
+
     logger.info('Bot is currently running.')
-    bot.infinity_polling(timeout=None, logger_level=None)
+    try:
+        bot.infinity_polling(timeout=None, logger_level=None)
+    finally:
+        # Finish in-flight GPT requests and background tasks and save sessions, then close pooled database connections.
+        # GPT requests finish first, so that their results reach the workers. Background tasks that start
+        # a GPT request after that fail immediately instead of waiting for the stopped event loop.
+        shutdown_gpt_client()
+        workers.shutdown()
+        save_sessions()
+        close_all_connections()
+
+        logger.info(f'Render cache stats: {render_cache.get_stats()}')
+        logger.info(f'Conversation cache stats: {conversation_cache.get_stats()}')
+        logger.info(f'History buffer stats: {history_buffer.get_stats()}')
+        logger.info(f'Session stats: {get_session_stats()}')
+        logger.info('Bot has been shut down.')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The bot's packages are imported from src/, as when running src/main.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from config.settings import Settings
+from database.cache import ConversationCache, HistoryBuffer, WhitelistCache
+import database.cache as cache
+import database.db_connector as db_connector
+import database.models as db
+
+
+@pytest.fixture
+def settings(tmp_path) -> Settings:
+    """
+    Application settings pointing at a fresh database file.
+    """
+    return Settings(admin_id=1,
+                    bot_token='test-token',
+                    db_path=str(tmp_path / 'test.db'),
+                    gpt_token='test-token',
+                    log_path=str(tmp_path / 'logs'))
+
+
+@pytest.fixture
+def database(settings, monkeypatch):
+    """
+    A fresh, migrated database with empty caches. Connections are closed afterwards.
+    """
+    monkeypatch.setattr(db, 'whitelist_cache', WhitelistCache())
+    monkeypatch.setattr(db, 'conversation_cache', ConversationCache(cache.CONVERSATION_CACHE_SIZE))
+    monkeypatch.setattr(db, 'history_buffer', HistoryBuffer(cache.HISTORY_BUFFER_SIZE,
+                                                             cache.HISTORY_BUFFER_MAX_CHARS,
+                                                             cache.HISTORY_BUFFER_IDLE_TIMEOUT))
+
+    db_connector.close_all_connections()
+    db_connector.initialize_connector(settings)
+    db.initialize_db()
+
+    yield db
+
+    db_connector.close_all_connections()
@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import httpx
+from openai import AsyncOpenAI
+import pytest
+
+import bot_core.gpt_client as gpt
+import bot_core.request_scheduler as request_scheduler
+from bot_core.request_scheduler import RequestScheduler
+from bot_core.response_cache import ResponseCache
+from bot_core.single_flight import SingleFlight
+
+PAST_MESSAGES = [{"role": "user", "content": "Earlier prompt"}, {"role": "assistant", "content": "Earlier response"}]
+
+
+def completion(content: str) -> dict:
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 0,
+        "model": gpt.CONV_MODEL,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+    }
+
+
+def stream(deltas: list[str]) -> bytes:
+    chunks = [{
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": gpt.CONV_MODEL,
+        "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]
+    } for delta in deltas]
+
+    return ''.join(f'data: {json.dumps(chunk)}\n\n' for chunk in chunks).encode() + b'data: [DONE]\n\n'
+
+
+class FakeServer:
+    """
+    Serves chat completions over an httpx mock transport, answering the first `rate_limited` requests with 429s.
+    """
+
+    def __init__(self, rate_limited: int, content: str) -> None:
+        self.rate_limited = rate_limited
+        self.content = content
+        self.headers = {'x-ratelimit-remaining-requests': '99', 'x-ratelimit-reset-requests': '1s'}
+        self.requests = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+
+        if len(self.requests) <= self.rate_limited:
+            return httpx.Response(429,
+                                  headers={'retry-after-ms': '10'},
+                                  json={"error": {"message": "Rate limit reached", "type": "requests"}})
+
+        if body.get('stream'):
+            return httpx.Response(200,
+                                  headers={'content-type': 'text/event-stream'},
+                                  content=stream([self.content[:5], self.content[5:]]))
+
+        return httpx.Response(200, headers=self.headers, json=completion(self.content))
+
+
+@pytest.fixture
+def server(monkeypatch) -> FakeServer:
+    """
+    Points the GPT client at a fake server, with a fresh request scheduler and the response cache disabled.
+    """
+    server = FakeServer(rate_limited=2, content='Hello there')
+
+    monkeypatch.setattr(request_scheduler.random, 'uniform', lambda low, high: low)
+    monkeypatch.setattr(gpt, 'request_scheduler', RequestScheduler(max_concurrency=2), raising=False)
+    monkeypatch.setattr(gpt, 'response_cache', ResponseCache(False, 0, 0), raising=False)
+    monkeypatch.setattr(gpt, 'in_flight', SingleFlight(), raising=False)
+
+    async def make_client():
+        return AsyncOpenAI(api_key='test-token',
+                           max_retries=0,
+                           http_client=httpx.AsyncClient(transport=httpx.MockTransport(server.handle)))
+
+    monkeypatch.setattr(gpt, 'client', asyncio.run(make_client()), raising=False)
+
+    return server
+
+
+def test_rate_limited_completion_is_retried(server):
+    response = asyncio.run(gpt.generate_response_async('Prompt', PAST_MESSAGES, user_id=1))
+
+    assert response == 'Hello there'
+    assert len(server.requests) == 3
+    assert server.requests[-1]["messages"][-1] == {"role": "user", "content": "Prompt"}
+
+    stats = gpt.request_scheduler.get_stats()
+    assert stats["retries"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_rate_limited_stream_is_retried(server):
+    async def consume():
+        return [delta async for delta in gpt.stream_response('Prompt', PAST_MESSAGES, user_id=1)]
+
+    assert asyncio.run(consume()) == ['Hello', ' there']
+    assert len(server.requests) == 3
+    assert server.requests[-1]["stream"] is True
+    assert gpt.request_scheduler.get_stats()["in_flight"] == 0
+
+
+def test_exhausted_rate_limit_headers_pause_the_next_request(server):
+    server.rate_limited = 0
+    server.headers = {'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '200ms'}
+
+    async def main():
+        responses = []
+        for _ in range(2):
+            async with gpt.create_completion(1, model=gpt.CONV_MODEL, messages=[]) as response:
+                responses.append(response.choices[0].message.content)
+        return responses
+
+    assert asyncio.run(main()) == ['Hello there', 'Hello there']
+    assert gpt.request_scheduler.get_stats()["max_wait"] >= 0.15
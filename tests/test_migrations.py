@@ -0,0 +1,50 @@
+import pytest
+
+import database.db_connector as db_connector
+from database.migrations import Migration, get_schema_version, run_migrations
+
+
+def tables() -> set[str]:
+    conn = db_connector.connect_to_database()
+
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def create_table(name: str):
+    return lambda: db_connector.execute_query(f"CREATE TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY)")
+
+
+def test_pending_migrations_are_applied_in_order(database):
+    version = get_schema_version()
+    applied = []
+
+    migrations = [
+        Migration(version + 2, 'Second', lambda: applied.append(2)),
+        Migration(version + 1, 'First', lambda: applied.append(1)),
+        Migration(version, 'Already applied', lambda: applied.append(0))
+    ]
+    run_migrations(migrations)
+
+    assert applied == [1, 2]
+    assert get_schema_version() == version + 2
+
+
+def test_failed_migration_is_rolled_back_and_rerun(database):
+    version = get_schema_version()
+
+    def create_then_fail():
+        create_table('Partial')()
+        raise RuntimeError('interrupted')
+
+    with pytest.raises(RuntimeError):
+        run_migrations([Migration(version + 1, 'First', create_table('First')),
+                        Migration(version + 2, 'Interrupted', create_then_fail)])
+
+    assert get_schema_version() == version + 1
+    assert 'First' in tables() and 'Partial' not in tables()
+
+    run_migrations([Migration(version + 1, 'First', create_table('First')),
+                    Migration(version + 2, 'Interrupted', create_table('Partial'))])
+
+    assert get_schema_version() == version + 2
+    assert 'Partial' in tables()
@@ -0,0 +1,139 @@
+import pytest
+
+import database.db_connector as db_connector
+
+
+def fail_on(operation: str, table: str) -> None:
+    """
+    Makes every `operation` (INSERT, UPDATE or DELETE) on `table` fail.
+    """
+    conn = db_connector.connect_to_database()
+    conn.execute(f"CREATE TRIGGER fail_{operation}_{table} BEFORE {operation} ON {table} "
+                 f"BEGIN SELECT RAISE(ABORT, 'failed'); END")
+    conn.commit()
+
+
+@pytest.fixture
+def user(database) -> int:
+    database.add_whitelist_user(1)
+    database.add_user(1, 'user1')
+
+    return 1
+
+
+def test_failed_add_conversation_leaves_cache_untouched(database, user):
+    conversation_id = database.add_conversation(user, 'First')
+    assert database.get_user_conversations(user) == [(conversation_id, 'First')]
+
+    fail_on('INSERT', 'Conversation')
+
+    assert database.add_conversation(user, 'Second') is None
+    assert database.get_user_conversations(user) == [(conversation_id, 'First')]
+
+
+def test_failed_edit_conversation_leaves_cache_untouched(database, user):
+    conversation_id = database.add_conversation(user, 'First')
+    database.get_user_conversations(user)
+
+    fail_on('UPDATE', 'Conversation')
+    database.edit_conversation(user, conversation_id, 'Renamed')
+
+    assert database.get_user_conversations(user) == [(conversation_id, 'First')]
+
+
+def test_failed_delete_conversation_leaves_cache_untouched(database, user):
+    conversation_id = database.add_conversation(user, 'First')
+    database.get_user_conversations(user)
+
+    fail_on('DELETE', 'Conversation')
+    database.delete_conversation(user, conversation_id)
+
+    assert database.get_user_conversations(user) == [(conversation_id, 'First')]
+
+
+def test_generated_title_replaces_provisional_title(database, user):
+    conversation_id = database.add_conversation(user, 'Provisional...')
+    database.get_user_conversations(user)
+
+    assert database.replace_provisional_title(user, conversation_id, 'Provisional...', 'Generated')
+    assert database.get_user_conversations(user) == [(conversation_id, 'Generated')]
+
+
+def test_generated_title_does_not_replace_users_title(database, user):
+    conversation_id = database.add_conversation(user, 'Provisional...')
+    database.edit_conversation(user, conversation_id, 'Renamed')
+    database.get_user_conversations(user)
+
+    assert not database.replace_provisional_title(user, conversation_id, 'Provisional...', 'Generated')
+    assert database.get_user_conversations(user) == [(conversation_id, 'Renamed')]
+    assert database.get_conversation_title(conversation_id, user) == 'Renamed'
+
+
+def test_sessions_are_indexed_by_conversation(database):
+    conn = db_connector.connect_to_database()
+    indexed_columns = [conn.execute(f"PRAGMA index_info({index[1]})").fetchall()[0][2]
+                       for index in conn.execute("PRAGMA index_list(Session)").fetchall()]
+
+    assert 'conversation_id' in indexed_columns
+
+
+def test_removing_whitelisted_user_deletes_saved_session(database, user):
+    conversation_id = database.add_conversation(user, 'First')
+    database.save_sessions([(user, 1, conversation_id, b'', b'', 0.0, None)])
+
+    database.remove_whitelist_user(user)
+
+    assert database.get_session(user) is None
+
+
+def contents(messages: list) -> list[str]:
+    return [message['content'] for message in messages]
+
+
+def test_failed_add_messages_leaves_history_buffer_untouched(database, user):
+    conversation_id = database.add_conversation(user, 'First')
+    database.add_messages(user, conversation_id, [('user', 'm0'), ('assistant', 'm1')])
+    assert contents(database.get_past_messages(user, conversation_id, max_messages=20)) == ['m0', 'm1']
+
+    fail_on('INSERT', 'Message')
+    database.add_messages(user, conversation_id, [('user', 'm2'), ('assistant', 'm3')])
+    database.add_message(user, conversation_id, 'user', 'm4')
+
+    assert contents(database.get_past_messages(user, conversation_id, max_messages=20)) == ['m0', 'm1']
+
+
+def test_history_loaded_while_messages_are_added_is_not_buffered(database, user, monkeypatch):
+    conversation_id = database.add_conversation(user, 'First')
+    database.add_messages(user, conversation_id, [('user', 'm0'), ('assistant', 'm1')])
+
+    select_past_messages = database.select_past_messages
+
+    def select_then_add(*args, **kwargs):
+        # Another thread adds messages after the history was read, while the buffer is cold
+        messages = select_past_messages(*args, **kwargs)
+        database.add_messages(user, conversation_id, [('user', 'm2'), ('assistant', 'm3')])
+        return messages
+
+    monkeypatch.setattr(database, 'select_past_messages', select_then_add)
+    assert contents(database.get_past_messages(user, conversation_id, max_messages=20)) == ['m0', 'm1']
+    monkeypatch.setattr(database, 'select_past_messages', select_past_messages)
+
+    assert contents(database.get_past_messages(user, conversation_id, max_messages=20)) == ['m0', 'm1', 'm2', 'm3']
+
+
+def test_history_loaded_during_an_add_is_not_buffered(database, user, monkeypatch):
+    conversation_id = database.add_conversation(user, 'First')
+    database.add_messages(user, conversation_id, [('user', 'm0')])
+
+    execute_many = database.execute_many
+
+    def fill_during_write(*args, **kwargs):
+        # Another thread fills the cold buffer after the messages are written but before they are appended
+        execute_many(*args, **kwargs)
+        database.get_past_messages(user, conversation_id, max_messages=20)
+
+    monkeypatch.setattr(database, 'execute_many', fill_during_write)
+    database.add_messages(user, conversation_id, [('user', 'm1')])
+    monkeypatch.setattr(database, 'execute_many', execute_many)
+
+    assert contents(database.get_past_messages(user, conversation_id, max_messages=20)) == ['m0', 'm1']
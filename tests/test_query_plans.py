@@ -0,0 +1,71 @@
+import re
+
+import pytest
+
+import database.db_connector as db_connector
+
+# A full scan of either table grows with every user's traffic, not just the user's own data
+TABLE_SCAN = re.compile(r'\bSCAN (TABLE )?(Message|Conversation)\b')
+
+
+@pytest.fixture
+def recorded_queries(database, monkeypatch):
+    """
+    Runs every query of database.models that reads or writes the 'Message' or 'Conversation' table
+    against a populated database, and returns the (query, params) pairs executed.
+    """
+    db = database
+
+    for user_id in (1, 2):
+        db.add_whitelist_user(user_id)
+        db.add_user(user_id, f'user{user_id}')
+        for i in range(3):
+            conversation_id = db.add_conversation(user_id, f'Conversation {i}')
+            db.add_messages(user_id, conversation_id, [('user', f'Prompt {j}') for j in range(10)])
+
+    queries = []
+
+    def record_query(query, params=None, *args, **kwargs):
+        queries.append((query, params))
+        return db_connector.execute_query(query, params, *args, **kwargs)
+
+    def record_many(query, params_seq):
+        queries.append((query, params_seq[0] if params_seq else None))
+        return db_connector.execute_many(query, params_seq)
+
+    monkeypatch.setattr(db, 'execute_query', record_query)
+    monkeypatch.setattr(db, 'execute_many', record_many)
+
+    conversation_id = db.get_user_conversations(1)[0][0]
+
+    db.add_conversation(1, 'New conversation')
+    db.add_message(1, conversation_id, 'assistant', 'Response')
+    db.edit_conversation(1, conversation_id, 'Renamed')
+
+    # Served from the conversation cache unless the user's conversations are cold
+    db.conversation_cache.invalidate(1)
+    db.get_conversation_title(conversation_id, 1)
+    db.select_past_messages(1, conversation_id, max_messages=20, max_tokens=4000)
+    db.get_unsummarized_messages(1, conversation_id, 0, 5)
+    db.evict_conversation_history(conversation_id)
+    db.get_conversation_messages(1, conversation_id)
+    db.delete_conversation_messages(1, conversation_id)
+    db.delete_conversation(1, conversation_id)
+    db.delete_user_messages(2)
+    db.delete_user_conversations(2)
+
+    return [(query, params) for query, params in queries if re.search(r'\b(Message|Conversation)\b', query)]
+
+
+def test_queries_are_recorded(recorded_queries):
+    assert len(recorded_queries) >= 10
+
+
+def test_no_query_scans_message_or_conversation(recorded_queries):
+    conn = db_connector.connect_to_database()
+
+    for query, params in recorded_queries:
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {query}', params or ()).fetchall()
+        details = [row[3] for row in plan]
+
+        assert not any(TABLE_SCAN.search(detail) for detail in details), f'{query.strip()}\n{details}'
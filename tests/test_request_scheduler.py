@@ -0,0 +1,342 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import bot_core.request_scheduler as request_scheduler
+from bot_core.request_scheduler import CircuitOpenError, RequestScheduler
+
+REQUEST = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+
+
+class RawResponse:
+    """
+    Stands in for the raw response returned by `client.with_raw_response`.
+    """
+
+    def __init__(self, value, headers: dict | None = None) -> None:
+        self.value = value
+        self.headers = headers or {}
+
+    def parse(self):
+        return self.value
+
+
+def rate_limit_error(headers: dict) -> openai.RateLimitError:
+    response = httpx.Response(429, headers=headers, request=REQUEST)
+    return openai.RateLimitError('Rate limit reached', response=response, body=None)
+
+
+def server_error() -> openai.InternalServerError:
+    response = httpx.Response(500, request=REQUEST)
+    return openai.InternalServerError('Server error', response=response, body=None)
+
+
+def bad_request_error() -> openai.BadRequestError:
+    response = httpx.Response(400, request=REQUEST)
+    return openai.BadRequestError('Bad request', response=response, body=None)
+
+
+def stub_create(outcomes: list):
+    """
+    Builds a stub create() that raises or returns the given outcomes in turn, recording each call.
+    """
+    calls = []
+
+    async def create():
+        calls.append(len(calls))
+        outcome = outcomes[min(len(calls), len(outcomes)) - 1]
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    return create, calls
+
+
+async def send(scheduler: RequestScheduler, create, key='user'):
+    async with scheduler.request(key, create) as response:
+        return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list[float]:
+    """
+    Replaces the scheduler's sleeps with ones that return at once, and records their delays.
+    """
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(request_scheduler.asyncio, 'sleep', fake_sleep)
+
+    return delays
+
+
+def test_rate_limited_request_is_retried_after_retry_after(sleeps, monkeypatch):
+    monkeypatch.setattr(request_scheduler.random, 'uniform', lambda low, high: low)
+    scheduler = RequestScheduler(max_concurrency=2)
+    create, calls = stub_create([rate_limit_error({'retry-after-ms': '1500'}), RawResponse('ok')])
+
+    assert asyncio.run(send(scheduler, create)) == 'ok'
+    assert len(calls) == 2
+    assert 1.5 in sleeps
+    assert scheduler.get_stats()["retries"] == 1
+
+
+def test_retry_after_seconds_header_is_honoured(sleeps, monkeypatch):
+    monkeypatch.setattr(request_scheduler.random, 'uniform', lambda low, high: low)
+    scheduler = RequestScheduler(max_concurrency=2)
+    create, _ = stub_create([rate_limit_error({'retry-after': '7'}), RawResponse('ok')])
+
+    assert asyncio.run(send(scheduler, create)) == 'ok'
+    assert 7.0 in sleeps
+
+
+def test_backoff_is_jittered_and_exponential(sleeps, monkeypatch):
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return high / 2
+
+    monkeypatch.setattr(request_scheduler.random, 'uniform', uniform)
+    scheduler = RequestScheduler(max_concurrency=2)
+    create, calls = stub_create([server_error()])
+
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(send(scheduler, create))
+
+    base = request_scheduler.BACKOFF_BASE
+    assert len(calls) == request_scheduler.MAX_ATTEMPTS
+    assert bounds == [(0, base * 2 ** attempt) for attempt in range(request_scheduler.MAX_ATTEMPTS - 1)]
+    assert sleeps == [high / 2 for _, high in bounds]
+
+
+def test_non_retryable_error_is_raised_at_once(sleeps):
+    scheduler = RequestScheduler(max_concurrency=2)
+    create, calls = stub_create([bad_request_error()])
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(send(scheduler, create))
+
+    assert len(calls) == 1
+    assert scheduler.get_stats()["retries"] == 0
+
+
+def test_exhausted_rate_limit_pauses_dispatch(sleeps):
+    scheduler = RequestScheduler(max_concurrency=2)
+    headers = {'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '2s'}
+    create, _ = stub_create([RawResponse('first', headers), RawResponse('second')])
+
+    async def main():
+        await send(scheduler, create)
+        return await send(scheduler, create)
+
+    assert asyncio.run(main()) == 'second'
+    assert len(sleeps) == 1 and 1.5 < sleeps[0] <= 2.0
+
+
+def test_circuit_opens_after_consecutive_failures(sleeps, monkeypatch):
+    monkeypatch.setattr(request_scheduler, 'MAX_ATTEMPTS', 1)
+    scheduler = RequestScheduler(max_concurrency=2)
+    create, calls = stub_create([server_error()])
+
+    async def main():
+        for _ in range(request_scheduler.CIRCUIT_FAILURE_THRESHOLD):
+            with pytest.raises(openai.InternalServerError):
+                await send(scheduler, create)
+
+        with pytest.raises(CircuitOpenError):
+            await send(scheduler, create)
+
+    asyncio.run(main())
+
+    stats = scheduler.get_stats()
+    assert len(calls) == request_scheduler.CIRCUIT_FAILURE_THRESHOLD
+    assert stats["circuit"] == 'open'
+    assert stats["rejected"] == 1
+
+
+def test_half_open_trial_success_closes_circuit(sleeps, monkeypatch):
+    monkeypatch.setattr(request_scheduler, 'MAX_ATTEMPTS', 1)
+    scheduler = RequestScheduler(max_concurrency=2)
+    failing, _ = stub_create([server_error()])
+    succeeding, calls = stub_create([RawResponse('ok')])
+
+    async def main():
+        for _ in range(request_scheduler.CIRCUIT_FAILURE_THRESHOLD):
+            with pytest.raises(openai.InternalServerError):
+                await send(scheduler, failing)
+
+        # Once the cooldown has passed, one trial request is let through
+        monkeypatch.setattr(request_scheduler, 'CIRCUIT_COOLDOWN', 0)
+        return await send(scheduler, succeeding)
+
+    assert asyncio.run(main()) == 'ok'
+    assert len(calls) == 1
+    assert scheduler.get_stats()["circuit"] == 'closed'
+
+
+def test_half_open_trial_failure_reopens_circuit(sleeps, monkeypatch):
+    monkeypatch.setattr(request_scheduler, 'MAX_ATTEMPTS', 1)
+    scheduler = RequestScheduler(max_concurrency=2)
+    failing, calls = stub_create([server_error()])
+
+    async def main():
+        for _ in range(request_scheduler.CIRCUIT_FAILURE_THRESHOLD):
+            with pytest.raises(openai.InternalServerError):
+                await send(scheduler, failing)
+
+        monkeypatch.setattr(request_scheduler, 'CIRCUIT_COOLDOWN', 0)
+        with pytest.raises(openai.InternalServerError):
+            await send(scheduler, failing)
+
+        # The failed trial restarts the cooldown
+        monkeypatch.setattr(request_scheduler, 'CIRCUIT_COOLDOWN', 60)
+        with pytest.raises(CircuitOpenError):
+            await send(scheduler, failing)
+
+    asyncio.run(main())
+
+    assert len(calls) == request_scheduler.CIRCUIT_FAILURE_THRESHOLD + 1
+    assert scheduler.get_stats()["circuit"] == 'open'
+
+
+def test_half_open_circuit_lets_one_trial_through(sleeps, monkeypatch):
+    monkeypatch.setattr(request_scheduler, 'MAX_ATTEMPTS', 1)
+    scheduler = RequestScheduler(max_concurrency=2)
+    failing, _ = stub_create([server_error()])
+
+    async def main():
+        for _ in range(request_scheduler.CIRCUIT_FAILURE_THRESHOLD):
+            with pytest.raises(openai.InternalServerError):
+                await send(scheduler, failing)
+
+        monkeypatch.setattr(request_scheduler, 'CIRCUIT_COOLDOWN', 0)
+        release = asyncio.Event()
+
+        async def slow_create():
+            await release.wait()
+            return RawResponse('ok')
+
+        trial = asyncio.create_task(send(scheduler, slow_create))
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()["circuit"] == 'half-open'
+
+        with pytest.raises(CircuitOpenError):
+            await send(scheduler, slow_create)
+
+        release.set()
+        return await trial
+
+    assert asyncio.run(main()) == 'ok'
+    assert scheduler.get_stats()["circuit"] == 'closed'
+
+
+def test_waiting_requests_are_served_round_robin_by_key():
+    scheduler = RequestScheduler(max_concurrency=1)
+    order = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def blocking_create():
+            await release.wait()
+            return RawResponse('blocker')
+
+        def create_for(key):
+            async def create():
+                order.append(key)
+                return RawResponse(key)
+            return create
+
+        blocker = asyncio.create_task(send(scheduler, blocking_create, key='blocker'))
+        await asyncio.sleep(0)
+
+        waiters = [asyncio.create_task(send(scheduler, create_for(key), key=key)) for key in ('a', 'a', 'a', 'b')]
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()["queue_depth"] == 4
+
+        release.set()
+        await asyncio.gather(blocker, *waiters)
+
+    asyncio.run(main())
+
+    assert order == ['a', 'b', 'a', 'a']
+    assert scheduler.get_stats()["in_flight"] == 0
+
+
+def test_cancelled_request_releases_its_slot():
+    scheduler = RequestScheduler(max_concurrency=1)
+
+    async def main():
+        started = asyncio.Event()
+
+        async def hanging_create():
+            started.set()
+            await asyncio.Event().wait()
+
+        request = asyncio.create_task(send(scheduler, hanging_create))
+        await started.wait()
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+
+        create, _ = stub_create([RawResponse('ok')])
+        return await asyncio.wait_for(send(scheduler, create), timeout=1)
+
+    assert asyncio.run(main()) == 'ok'
+    assert scheduler.get_stats()["in_flight"] == 0
+
+
+def test_request_cancelled_during_rate_limit_pause_releases_its_slot():
+    scheduler = RequestScheduler(max_concurrency=1)
+    headers = {'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '60s'}
+
+    async def main():
+        create, _ = stub_create([RawResponse('first', headers)])
+        await send(scheduler, create)
+
+        paused = asyncio.create_task(send(scheduler, create))
+        await asyncio.sleep(0.01)
+        assert scheduler.get_stats()["in_flight"] == 1
+
+        paused.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await paused
+
+    asyncio.run(main())
+
+    assert scheduler.get_stats()["in_flight"] == 0
+
+
+def test_cancelled_trial_lets_the_next_trial_through(sleeps, monkeypatch):
+    monkeypatch.setattr(request_scheduler, 'MAX_ATTEMPTS', 1)
+    scheduler = RequestScheduler(max_concurrency=2)
+    failing, _ = stub_create([server_error()])
+
+    async def main():
+        for _ in range(request_scheduler.CIRCUIT_FAILURE_THRESHOLD):
+            with pytest.raises(openai.InternalServerError):
+                await send(scheduler, failing)
+
+        monkeypatch.setattr(request_scheduler, 'CIRCUIT_COOLDOWN', 0)
+
+        async def hanging_create():
+            await asyncio.Event().wait()
+
+        trial = asyncio.create_task(send(scheduler, hanging_create))
+        await asyncio.sleep(0)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        succeeding, _ = stub_create([RawResponse('ok')])
+        return await send(scheduler, succeeding)
+
+    assert asyncio.run(main()) == 'ok'
+    assert scheduler.get_stats()["circuit"] == 'closed'
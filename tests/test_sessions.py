@@ -0,0 +1,217 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import bot_core.sessions as sessions
+from bot_core.sessions import MAX_TRACKED_MESSAGES, SESSION_LOCK_STRIPES, SessionStore, UserSession
+from bot_core.states import UserState
+
+THREADS = 16
+
+
+class YieldingSession(UserSession):
+    """
+    A session that gives up the GIL whenever one of its fields is read, so that a read-modify-write
+    which is not guarded by the session's lock is interleaved with other threads.
+    """
+
+    __slots__ = ('_state', '_busy', '_message_ids')
+
+    def _yield(self, value):
+        time.sleep(0)
+        return value
+
+    state = property(lambda self: self._yield(self._state), lambda self, value: setattr(self, '_state', value))
+    busy = property(lambda self: self._yield(self._busy), lambda self, value: setattr(self, '_busy', value))
+    message_ids = property(lambda self: self._yield(self._message_ids),
+                           lambda self, value: setattr(self, '_message_ids', value))
+
+
+@pytest.fixture
+def store(database, monkeypatch) -> SessionStore:
+    """
+    An empty session store backed by a fresh database, whose sessions yield on every read.
+    """
+    monkeypatch.setattr(sessions, 'UserSession', YieldingSession)
+
+    return SessionStore(SESSION_LOCK_STRIPES)
+
+
+@pytest.fixture(autouse=True)
+def frequent_thread_switches():
+    """
+    Switches threads far more often than usual, so that races have a chance to show.
+    """
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def run_threads(target, count: int = THREADS) -> list:
+    """
+    Runs target(index, barrier) on `count` threads started together, and returns their results in order.
+    """
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    errors = []
+
+    def run(index):
+        try:
+            results[index] = target(index, barrier)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors
+
+    return results
+
+
+def test_same_user_keeps_every_message_id(store):
+    per_thread = MAX_TRACKED_MESSAGES // THREADS
+
+    def add(index, barrier):
+        barrier.wait()
+        for i in range(per_thread):
+            store.add_message_id(1, index * per_thread + i)
+
+    run_threads(add)
+
+    assert sorted(store.get(1).message_ids) == list(range(THREADS * per_thread))
+
+
+def test_different_users_do_not_interfere(store):
+    def add(index, barrier):
+        user_id = 100 + index
+        barrier.wait()
+        for i in range(200):
+            store.add_message_id(user_id, i)
+            store.set(user_id, 'last_activity', float(i))
+
+    run_threads(add)
+
+    for index in range(THREADS):
+        session = store.get(100 + index)
+        assert list(session.message_ids) == list(range(200))
+        assert session.last_activity == 199.0
+
+
+def test_taking_message_ids_while_adding_loses_none(store):
+    per_thread = 50
+    taken = []
+    done = threading.Event()
+
+    def add(index, barrier):
+        barrier.wait()
+        for i in range(per_thread):
+            store.add_message_id(1, index * per_thread + i)
+
+    def take():
+        while not done.is_set():
+            taken.extend(store.take_message_ids(1))
+
+    taker = threading.Thread(target=take)
+    taker.start()
+    run_threads(add)
+    done.set()
+    taker.join()
+
+    taken.extend(store.take_message_ids(1))
+
+    assert sorted(taken) == list(range(THREADS * per_thread))
+
+
+def test_compare_and_set_has_one_winner(store):
+    for _ in range(50):
+        store.set(1, 'state', UserState.IDLE)
+
+        def transition(index, barrier):
+            barrier.wait()
+            return store.compare_and_set_state(1, UserState.IDLE, UserState.MAIN_MENU)
+
+        assert sum(run_threads(transition)) == 1
+        assert store.get(1).state == UserState.MAIN_MENU
+
+
+def test_compare_and_set_wins_once_per_reset(store):
+    # One thread keeps resetting the state to idle while the others race to leave it.
+    # Each reset can be won by at most one transition, and each later reset needs a win before it.
+    store.set(1, 'state', UserState.MAIN_MENU)
+    done = threading.Event()
+    resets = 0
+
+    def reset():
+        nonlocal resets
+        for _ in range(500):
+            resets += store.compare_and_set_state(1, UserState.MAIN_MENU, UserState.IDLE)
+        done.set()
+
+    def transition(index, barrier):
+        wins = 0
+        barrier.wait()
+        while not done.is_set():
+            wins += store.compare_and_set_state(1, UserState.IDLE, UserState.MAIN_MENU)
+        return wins
+
+    resetter = threading.Thread(target=reset)
+    resetter.start()
+    wins = sum(run_threads(transition))
+    resetter.join()
+
+    assert resets - 1 <= wins <= resets
+
+
+def test_only_one_turn_runs_at_a_time(store):
+    for _ in range(50):
+        def begin(index, barrier):
+            barrier.wait()
+            return store.try_begin_turn(1)
+
+        assert sum(run_threads(begin)) == 1
+
+        store.end_turn(1)
+        assert store.try_begin_turn(1)
+        store.end_turn(1)
+
+
+def test_users_are_spread_over_stripes(store):
+    assert store.lock(42) is store.lock(42)
+    assert len({id(store.lock(user_id)) for user_id in range(10 * SESSION_LOCK_STRIPES)}) == SESSION_LOCK_STRIPES
+
+
+def test_held_stripe_does_not_block_other_stripes(store):
+    other_user_id = next(user_id for user_id in range(2, 100) if store.lock(user_id) is not store.lock(1))
+    updated = threading.Event()
+
+    def update():
+        store.set(other_user_id, 'last_activity', 1.0)
+        updated.set()
+
+    with store.lock(1):
+        thread = threading.Thread(target=update)
+        thread.start()
+        assert updated.wait(timeout=5)
+
+    thread.join()
+
+
+def test_removed_session_does_not_come_back(store):
+    store.set(1, 'state', UserState.MAIN_MENU)
+    store.add_message_id(1, 42)
+    store.checkpoint()
+
+    store.add_message_id(1, 43)
+    store.remove(1)
+    store.checkpoint()
+
+    session = store.get(1)
+    assert session.state == UserState.IDLE
+    assert list(session.message_ids) == []
@@ -0,0 +1,42 @@
+from bot_core.summarizer import get_history
+
+
+def add_conversation(db, count: int) -> int:
+    db.add_whitelist_user(1)
+    db.add_user(1, 'user1')
+    conversation_id = db.add_conversation(1, 'Conversation')
+    db.add_messages(1, conversation_id, [('user', f'm{i}') for i in range(count)])
+
+    return conversation_id
+
+
+def contents(messages: list) -> list[str]:
+    return [message['content'] for message in messages]
+
+
+def test_messages_outside_the_window_are_sent_until_summarized(database):
+    conversation_id = add_conversation(database, 29)
+
+    past_messages, summary = get_history(1, conversation_id, max_messages=20, max_tokens=None)
+
+    assert summary is None
+    assert contents(past_messages) == [f'm{i}' for i in range(29)]
+
+
+def test_summarized_messages_are_not_sent(database):
+    conversation_id = add_conversation(database, 29)
+    messages = database.get_unsummarized_messages(1, conversation_id, 0, 20)
+    database.set_conversation_summary(conversation_id, 'Summary of m0-m4', messages[4]['message_id'])
+
+    past_messages, summary = get_history(1, conversation_id, max_messages=20, max_tokens=None)
+
+    assert summary == 'Summary of m0-m4'
+    assert contents(past_messages) == [f'm{i}' for i in range(5, 29)]
+
+
+def test_messages_trimmed_by_the_token_budget_are_sent_until_summarized(database):
+    conversation_id = add_conversation(database, 29)
+
+    past_messages, _ = get_history(1, conversation_id, max_messages=20, max_tokens=10)
+
+    assert contents(past_messages) == [f'm{i}' for i in range(29)]